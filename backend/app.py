@@ -1,20 +1,36 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium_stealth import stealth
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 import time
-import threading
-import smtplib
-import requests
 import os
+import hashlib
 import json
-from datetime import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import logging
+import threading
+from datetime import datetime, timedelta
+from governor import BrowserLimitReached, count_browser_processes
+from driver_pool import DriverPool, LoginError
+from job_queue import create_queue
+from worker import RemoteFetcher, fetch_calendar, verify_login
+from scheduler import MonitorScheduler, StoreBackedScheduler
+from leader import LeaderLock
+from calendar_cache import CalendarCache, credential_key
+from notifier import NotificationDispatcher
+from polling import AdaptivePoller
+from lessons import index_lessons
+from store import MonitorStore
+from session_vault import SecretBox, SessionVault
+from events import EventBus, format_sse
+from sites import DEFAULT_SITE, SiteBusy, SiteUnavailable, UnknownSite, get_site, site_ids
+from circuit import CircuitOpen
+from scrape_jobs import ScrapeJobManager, ScrapeError, ScrapeQueueFull, DONE, FAILED
+from diff_engine import diff_snapshots, WatchRule, OPENED, FILLED, THRESHOLD, ADDED
+from metrics import (REGISTRY, CHECKS, CHECK_SECONDS, SEAT_EVENTS, ACTIVE_JOBS,
+                     BROWSER_PROCESSES, POOLED_DRIVERS)
+from logging_config import configure_logging
+
+# print の代わりに構造化ログ（JSON）を出力
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
@@ -22,429 +38,594 @@ CORS(app)
 # プロキシのサブパス対応
 app.config['APPLICATION_ROOT'] = '/scraper'
 
-# グローバル変数で監視状態を管理
-monitoring_active = False
-monitoring_thread = None
+# 旧バージョンの監視状態ファイル（起動時にストアへ移行）
 MONITORING_STATE_FILE = 'monitoring_state.json'
 
-def save_monitoring_state(state):
-    """監視状態をファイルに保存"""
+# ジョブ定義・スナップショット・残り枠履歴の保存先（ジョブ定義のパスワードは暗号化して保存）
+store = MonitorStore(secrets=SecretBox())
+
+# 会員番号ごとにログイン済みブラウザを使い回す（ログイン済みCookieは暗号化して保存し、再起動後も再利用）
+# 取得を行うプロセスで初回の取得時に作成する（取得しないWebワーカー・キュー経由のプロセスでは作らない）
+driver_pool = None
+_driver_pool_lock = threading.Lock()
+
+# SCRAPE_MODE=queue ではブラウザ処理を取得ワーカー（worker.py）に任せ、このプロセスでは起動しない
+SCRAPE_MODE = os.getenv("SCRAPE_MODE", "local")
+job_queue = create_queue() if SCRAPE_MODE == 'queue' else None
+remote_fetcher = RemoteFetcher(job_queue) if job_queue is not None else None
+WORKER_STALE_SECONDS = float(os.getenv("WORKER_STALE_SECONDS", "120"))
+
+# 通知はバックグラウンドで送信し、監視ループを待たせない
+notifier = NotificationDispatcher()
+
+# 同じ日付のカレンダー取得は監視・APIをまたいで1回にまとめる
+calendar_caches = {}
+
+# 画面からのレッスン取得はバックグラウンドで実行し、APIは即座に返す（状態確認は他のWebワーカーに届いてもよい）
+scrape_jobs = ScrapeJobManager(store=store)
+
+# 監視ジョブのイベントをブラウザへ配信（SSE）
+event_bus = EventBus()
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+MAX_DATE_RANGE_DAYS = 31
+
+def get_driver_pool():
+    """ブラウザプール（初回の呼び出しで作成し、取り残されたブラウザの掃除もその時に行う）"""
+    global driver_pool
+    with _driver_pool_lock:
+        if driver_pool is None:
+            driver_pool = DriverPool(vault=SessionVault(store, box=store.secrets))
+        return driver_pool
+
+def calendar_cache_for(site_id):
+    """サイトごとのカレンダーキャッシュ（同じクラブの会員同士でのみ共有）"""
+    cache = calendar_caches.get(site_id)
+    if cache is None:
+        cache = calendar_caches.setdefault(site_id, CalendarCache())
+    return cache
+
+def fetch_lessons_by_date(user_id, password, dates, site_id=None):
+    """複数日のレッスン一覧を1回のページ表示で取得（同じ日付の同時取得は共有）"""
+    site = get_site(site_id)
+    # 日付をYYYYMMDD形式に変換
+    date_strs = [date.replace('-', '') for date in dates]  # YYYY-MM-DD → YYYYMMDD
+
+    def fetch_many(missing):
+        # 表示中の全日付を取得してキャッシュし、他の日付の監視にも使い回す
+        if remote_fetcher is not None:
+            lessons_by_date = remote_fetcher.fetch(site, user_id, password)
+        else:
+            lessons_by_date = fetch_calendar(get_driver_pool(), site, user_id, password)
+        try:
+            store.record_observations([l for lessons in lessons_by_date.values() for l in lessons])
+        except Exception as e:
+            logger.error(f"残り枠履歴の記録失敗: {e}")
+        return lessons_by_date
+
+    def authenticate():
+        # 他の会員が取得した結果を渡す前に、この会員番号・パスワードでログインできることを確認
+        if remote_fetcher is not None:
+            remote_fetcher.login(site, user_id, password)
+        else:
+            verify_login(get_driver_pool(), site, user_id, password)
+
+    by_date_str = calendar_cache_for(site.site_id).get_many(
+        date_strs, fetch_many, credential_key(user_id, password), authenticate)
+    return {date: by_date_str.get(date_str, []) for date, date_str in zip(dates, date_strs)}
+
+def fetch_lessons(user_id, password, date, site_id=None):
+    """指定日のレッスン一覧を取得"""
+    return fetch_lessons_by_date(user_id, password, [date], site_id)[date]
+
+def parse_dates(data):
+    """リクエストから対象日付一覧を取得（dates / dateFrom〜dateTo / date）"""
+    if data.get('dates'):
+        dates = sorted(set(data['dates']))
+    elif data.get('dateFrom') and data.get('dateTo'):
+        start = datetime.strptime(data['dateFrom'], '%Y-%m-%d')
+        end = datetime.strptime(data['dateTo'], '%Y-%m-%d')
+        if end < start:
+            raise ValueError("dateTo は dateFrom 以降を指定してください")
+        dates = [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+    elif data.get('date'):
+        dates = [data['date']]
+    else:
+        return []
+
+    if len(dates) > MAX_DATE_RANGE_DAYS:
+        raise ValueError(f"日付は最大{MAX_DATE_RANGE_DAYS}日分まで指定できます")
+    for date in dates:
+        datetime.strptime(date, '%Y-%m-%d')
+    return dates
+
+def migrate_legacy_state_file():
+    """旧形式の監視状態ファイル（JSON）をストアへ取り込み、平文のファイルを削除"""
+    if not os.path.exists(MONITORING_STATE_FILE):
+        return
     try:
-        with open(MONITORING_STATE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
-        print(f"[INFO] 監視状態を保存しました: {MONITORING_STATE_FILE}")
+        with open(MONITORING_STATE_FILE, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        # 単一監視の旧形式と複数ジョブ形式の両方に対応
+        states = state.get('jobs', [state] if 'user_id' in state else [])
+        for i, s in enumerate(states):
+            store.save_job(s.get('job_id') or f"legacy{i}", s['user_id'], s, s.get('active', True))
+        os.remove(MONITORING_STATE_FILE)
+        logger.info(f"監視状態ファイルをストアへ移行しました: {len(states)}件")
     except Exception as e:
-        print(f"[ERROR] 監視状態保存失敗: {e}")
+        logger.error(f"監視状態ファイルの移行失敗: {e}")
 
-def load_monitoring_state():
-    """監視状態をファイルから読み込み"""
+def save_monitor_snapshot(job):
+    """チェック後の最新スナップショットを保存（再起動後も差分判定を継続するため）"""
+    if not job.monitor.has_snapshot:
+        return
     try:
-        if os.path.exists(MONITORING_STATE_FILE):
-            with open(MONITORING_STATE_FILE, 'r', encoding='utf-8') as f:
-                state = json.load(f)
-            print(f"[INFO] 監視状態を読み込みました: {len(state.get('selected_lessons', []))}件のレッスン")
-            return state
+        store.save_snapshot(job.job_id, job.monitor.previous_lessons)
     except Exception as e:
-        print(f"[ERROR] 監視状態読み込み失敗: {e}")
-    return None
+        logger.error(f"スナップショット保存失敗: {e}")
+
+def publish_event(type, data, job):
+    """イベントをストアに記録して配信（IDはストアで採番し、全プロセスで共通にする）"""
+    event_id = store.append_event(type, job.job_id, job.user_id, data)
+    event_bus.publish(type, data, job.job_id, job.user_id, event_id=event_id)
 
-def clear_monitoring_state():
-    """監視状態ファイルを削除"""
+def handle_job_event(kind, job):
+    """スケジューラーのジョブ状態変化をストアへ反映し、イベントとして配信"""
+    status = job.to_dict()
     try:
-        if os.path.exists(MONITORING_STATE_FILE):
-            os.remove(MONITORING_STATE_FILE)
-            print(f"[INFO] 監視状態ファイルを削除しました")
+        if kind == 'finished':
+            store.update_job_status(job.job_id, status, active=False)
+        elif kind != 'removed':
+            store.update_job_status(job.job_id, status)
     except Exception as e:
-        print(f"[ERROR] 監視状態ファイル削除失敗: {e}")
+        logger.error(f"実行状況の保存失敗({job.job_id}): {e}")
 
-def restore_monitoring_on_startup():
-    """サーバー起動時に監視状態を復旧"""
-    global monitoring_active, monitoring_thread
-    
-    state = load_monitoring_state()
-    if not state:
+    if kind == 'check_started':
+        publish_event('check_started', {'job': status}, job)
+        return
+    if kind != 'check_finished':
+        publish_event('status', {'change': kind, 'job': status}, job)
         return
-    
-    try:
-        # 前回の監視が今日の日付かチェック
-        target_date = state.get('date')
-        today = datetime.now().strftime('%Y-%m-%d')
-        
-        if target_date != today:
-            print(f"[INFO] 前回の監視日付({target_date})と今日({today})が異なるため、監視を復旧しません")
-            clear_monitoring_state()
-            return
-        
-        print("[INFO] 前回の監視状態を復旧中...")
-        
-        monitor = LessonMonitor(
-            state['user_id'], state['password'], state['date'],
-            state['notify_method'], state['interval'],
-            state.get('email'), state.get('line_token'),
-            state['selected_lessons']
-        )
-        
-        monitoring_active = True
-        monitoring_thread = threading.Thread(target=monitor.start_monitoring)
-        monitoring_thread.daemon = False
-        monitoring_thread.start()
-        
-        print(f"[INFO] 監視を復旧しました - 対象: {len(state['selected_lessons'])}件")
-        
-    except Exception as e:
-        print(f"[ERROR] 監視復旧失敗: {e}")
-        clear_monitoring_state()
 
-class SeleniumGunzeScraper:
-    """スポーツクラブサイトのスクレイパークラス"""
-    
-    def __init__(self):
-        """Chrome WebDriverを初期化"""
-        chrome_options = Options()
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-        chrome_options.add_argument('--disable-extensions')
-        chrome_options.add_argument('--disable-plugins')
-        chrome_options.add_experimental_option("detach", True)
-        
-        # ユニークなuser-data-dirを指定して競合を回避
-        import tempfile
-        import uuid
-        temp_dir = tempfile.gettempdir()
-        unique_id = str(uuid.uuid4())
-        chrome_options.add_argument(f'--user-data-dir={temp_dir}/chrome_profile_{unique_id}')
-        
-        # 本番環境: ヘッドレスモードで安定動作を優先
-        chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--disable-gpu')
-        chrome_options.add_argument('--window-size=1920,1080')
-        chrome_options.add_argument('--remote-debugging-port=0')  # ポート競合を回避
+    monitor = job.monitor
+    publish_event('check_finished', {'job': status}, job)
+    if job.last_error:
+        publish_event('error', {'message': job.last_error, 'job': status}, job)
+        return
+    lessons = sorted(monitor.previous_lessons.values(), key=lambda l: (l.date or '', l.time))
+    publish_event('snapshot', {'lessons': [l.to_dict() for l in lessons]}, job)
+    if monitor.last_events:
+        publish_event('changes', {'events': [e.to_dict() for e in monitor.last_events]}, job)
 
-        # ChromeDriverのパスを明示的に指定（必要に応じて）
-        try:
-            self.driver = webdriver.Chrome(options=chrome_options)
-        except Exception as e:
-            print(f"[ERROR] ChromeDriver初期化失敗: {e}")
-            # システムのchromedriver-autoinstallerを使用
-            import chromedriver_autoinstaller
-            chromedriver_autoinstaller.install()
-            self.driver = webdriver.Chrome(options=chrome_options)
-
-        # 自動化検出回避のためのステルス設定
-        self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-        stealth(
-            self.driver,
-            languages=["ja-JP", "en-US"],
-            vendor="Google Inc.",
-            platform="Win32",
-            webgl_vendor="Intel Inc.",
-            renderer="Intel Iris OpenGL Engine",
-            fix_hairline=True
-        )
+def request_reconcile():
+    """ジョブ定義の変更を監視プロセスへすぐに反映させる（同じプロセス内の場合）"""
+    _reconcile_requested.set()
 
-        self.logged_in = False
+# APIからのジョブ操作はストア経由（どのWebワーカーで受けても同じ結果になる）
+scheduler = StoreBackedScheduler(store, lambda state: LessonMonitor.from_state(state), on_change=request_reconcile)
 
-    def login(self, username, password):
-        """スポーツクラブサイトにログイン"""
-        try:
-            self.driver.get("https://www1.nesty-gcloud.net/gunzesports_mypage/")
-            
-            WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.NAME, "会員番号"))
-            )
-            
-            self.driver.find_element(By.NAME, "会員番号").send_keys(username)
-            self.driver.find_element(By.NAME, "パスワード").send_keys(password)
-            self.driver.find_element(By.ID, "DN10BtnLogin").click()
+# 監視ジョブを実際に実行するスケジューラー（リーダーのプロセスでのみ作成）
+monitor_scheduler = None
+leader_lock = LeaderLock()
+_reconcile_requested = threading.Event()
+_failed_versions = {}
 
-            WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.ID, "menuItemAnchorWebPersonal"))
-            )
+SCHEDULER_SYNC_SECONDS = float(os.getenv("SCHEDULER_SYNC_SECONDS", "2"))
+EVENT_RELAY_SECONDS = float(os.getenv("EVENT_RELAY_SECONDS", "0.5"))
+EVENT_RETENTION_SECONDS = float(os.getenv("EVENT_RETENTION_SECONDS", "3600"))
+METRICS_PUBLISH_SECONDS = float(os.getenv("METRICS_PUBLISH_SECONDS", "10"))
+process_role = 'web'
 
-            self.logged_in = True
-            print(f"[INFO] ログイン成功: {username}")
-            return True
-            
-        except Exception as e:
-            print(f"[ERROR] ログイン失敗: {e}")
-            return False
+def _pooled_drivers():
+    if driver_pool is None:
+        return {('in_use',): 0, ('idle',): 0}
+    stats = driver_pool.stats()
+    return {('in_use',): stats['in_use'], ('idle',): stats['size'] - stats['in_use']}
 
-    def go_to_program_page_and_scrape(self, date_str):
-        """指定日のレッスン情報を取得（scraper.pyと同じ構造）"""
-        if not self.logged_in:
-            raise Exception("ログインが必要です")
+def _job_counts():
+    jobs = monitor_scheduler.jobs() if monitor_scheduler else []
+    return {
+        ('active',): sum(1 for j in jobs if j.active),
+        ('paused',): sum(1 for j in jobs if not j.active and not j.finished),
+        ('finished',): sum(1 for j in jobs if j.finished)
+    }
 
-        try:
-            self.driver.find_element(By.ID, "menuItemAnchorWebPersonal").click()
-            time.sleep(0.5)
-
-            windows = self.driver.window_handles
-            self.driver.switch_to.window(windows[-1])
-
-            prog_anchor = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.ID, "menuItemAnchor__sisetu3"))
-            )
-            prog_anchor.click()
-            time.sleep(1)
-
-            print("[INFO] プログラムページに到達 → スクレイピング準備完了")
-
-            lessons = []
-            panel_parent = self.driver.find_element(By.ID, f"Q060CalendarDate__{date_str}")
-            panels = panel_parent.find_elements(By.CLASS_NAME, "Q060_calendar_panel_yotei")
-
-            print(f"[INFO] 指定日({date_str})のパネル数: {len(panels)}")
-            for i, panel in enumerate(panels):
-                try:
-                    text = panel.text.strip()
-                    if len(text) < 5:
-                        continue
-                    time_part = text[:5]
-                    name_part = text[5:].strip()
-                    
-                    # 括弧内の数字で空き状況を判定
-                    status = 'unknown'
-                    if '(' in text and ')' in text:
-                        # 括弧内は残り枠数 例: 30メガダンス(37) → 37が残り枠数
-                        import re
-                        match = re.search(r'\((\d+)\)', text)
-                        if match:
-                            remaining = int(match.group(1))
-                            print(f"[DEBUG] テキスト: '{text}' → 残り枠数: {remaining}")
-                            if remaining == 0:
-                                status = '満員'
-                            elif remaining <= 3:
-                                status = '残りわずか'
-                            else:
-                                status = '空きあり'
-                            print(f"[DEBUG] ステータス判定: {status}")
-                        else:
-                            print(f"[DEBUG] 括弧内数字が見つからない - テキスト: '{text}'")
-                    
-                    lessons.append({
-                        'id': f'selenium_{i+1}',
-                        'time': time_part,
-                        'name': name_part,
-                        'status': status
-                    })
-                except Exception as ex:
-                    print(f"[WARN] パネル処理エラー: {ex}")
-                    continue
-
-            for lesson in lessons:
-                print(f"{lesson['time']} {lesson['name']}")
+BROWSER_PROCESSES.set_function(lambda: count_browser_processes(os.getpid()))
+POOLED_DRIVERS.set_function(_pooled_drivers)
+ACTIVE_JOBS.set_function(_job_counts)
 
-            return lessons
+def publish_metrics():
+    """このプロセスのメトリクスをストアへ書き出す（/metrics で全プロセス分を合算）"""
+    store.save_metrics(os.getpid(), process_role, REGISTRY.snapshot())
 
+def metrics_loop():
+    while True:
+        time.sleep(METRICS_PUBLISH_SECONDS)
+        try:
+            publish_metrics()
         except Exception as e:
-            print(f"[ERROR] プログラムページ遷移・取得失敗: {e}")
-            return []
+            logger.error(f"メトリクス書き出し失敗: {e}")
+
+def reconcile_jobs():
+    """ストア上のジョブ定義（版数）とスケジューラーの実行中ジョブを揃える"""
+    versions = store.job_versions()
+    for job in monitor_scheduler.jobs():
+        if job.job_id not in versions:
+            monitor_scheduler.remove(job.job_id)
 
-    def quit(self):
-        """WebDriverを終了"""
+    for job_id, version in versions.items():
+        job = monitor_scheduler.get(job_id)
+        if job is not None and job.version == version:
+            continue
+        if _failed_versions.get(job_id) == version:
+            continue
+        row = store.load_job(job_id)
+        if row is None:
+            continue
         try:
-            self.driver.quit()
-        except:
-            pass
+            monitor = LessonMonitor.from_state(row['state'])
+            if job is None:
+                monitor.restore_snapshot(store.load_snapshot(job_id))
+        except Exception as e:
+            logger.error(f"監視ジョブの読み込み失敗({job_id}): {e}")
+            _failed_versions[job_id] = row['version']
+            continue
+        if job is None:
+            job = monitor_scheduler.add(monitor, job_id=job_id, active=row['active'])
+        else:
+            # 実行中のジョブは定義だけ差し替え（差分判定の状態・次回予定を引き継ぐ）
+            job = monitor_scheduler.update(job_id, monitor, active=row['active'])
+        job.version = row['version']
 
-class NotificationService:
-    """通知サービスクラス"""
-    
-    @staticmethod
-    def send_email(to_email, subject, body):
-        """メール通知を送信"""
+def maintenance_loop():
+    """ジョブ定義の反映と古いイベントの削除を定期的に行う（リーダーのみ）"""
+    last_prune = 0
+    while True:
+        _reconcile_requested.wait(SCHEDULER_SYNC_SECONDS)
+        _reconcile_requested.clear()
         try:
-            from_email = os.getenv("GMAIL_EMAIL")
-            from_password = os.getenv("GMAIL_PASSWORD")
-            
-            if not from_email or not from_password:
-                print("[WARN] メール認証情報が設定されていません")
-                return False
-
-            msg = MIMEMultipart()
-            msg['From'] = from_email
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            msg.attach(MIMEText(body, 'plain', 'utf-8'))
-
-            server = smtplib.SMTP("smtp.gmail.com", 587)
-            server.starttls()
-            server.login(from_email, from_password)
-            server.send_message(msg)
-            server.quit()
-
-            print(f"[INFO] メール通知送信成功: {to_email}")
-            return True
-            
+            reconcile_jobs()
+            if time.time() - last_prune > 600:
+                store.prune_events(EVENT_RETENTION_SECONDS)
+                last_prune = time.time()
         except Exception as e:
-            print(f"[ERROR] メール送信失敗: {e}")
-            return False
+            logger.error(f"監視ジョブの同期失敗: {e}")
 
-    @staticmethod
-    def send_line(message, line_token):
-        """LINE通知を送信"""
+def relay_events_loop():
+    """監視プロセスが記録したイベントをこのプロセスの購読者へ中継（Webワーカーのみ）"""
+    last_id = store.last_event_id()
+    while True:
+        time.sleep(EVENT_RELAY_SECONDS)
         try:
-            if not line_token:
-                print("[WARN] LINE Notifyトークンが設定されていません")
-                return False
+            for event in store.events_since(last_id):
+                event_bus.publish(event['type'], event['data'], event['job_id'], event['user_id'],
+                                  event_id=event['id'])
+                last_id = event['id']
+        except Exception as e:
+            logger.error(f"イベント中継失敗: {e}")
 
-            url = "https://notify-api.line.me/api/notify"
-            headers = {"Authorization": f"Bearer {line_token}"}
-            data = {"message": message}
+def _start_thread(target, name):
+    thread = threading.Thread(target=target, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
 
-            response = requests.post(url, headers=headers, data=data)
+def restore_monitoring_on_startup():
+    """サーバー起動時に監視状態を復旧（前回のスナップショットから差分判定を再開）"""
+    migrate_legacy_state_file()
+    try:
+        encrypted = store.encrypt_job_passwords()
+        if encrypted:
+            logger.info(f"平文で保存されていたパスワードを暗号化しました: {encrypted}件")
+    except Exception as e:
+        logger.error(f"保存済みパスワードの暗号化失敗: {e}")
 
-            if response.status_code == 200:
-                print("[INFO] LINE通知送信成功")
-                return True
-            else:
-                print(f"[ERROR] LINE通知送信失敗: {response.status_code}")
-                return False
-                
-        except Exception as e:
-            print(f"[ERROR] LINE通知送信失敗: {e}")
-            return False
+    today = datetime.now().strftime('%Y-%m-%d')
+    for row in store.load_jobs():
+        # 監視日付が過ぎたジョブは復旧しない
+        state = row['state']
+        target_date = max(state.get('dates') or [state.get('date') or ''])
+        if not target_date or target_date < today:
+            logger.info(f"前回の監視日付({target_date})が過ぎているため、監視を復旧しません")
+            store.delete_job(row['job_id'])
+
+    reconcile_jobs()
+    logger.info(f"監視を復旧しました - {len(monitor_scheduler.jobs())}件のジョブ")
+
+def start_services(role=None):
+    """バックグラウンド処理を開始（監視ジョブはロックを取得した1プロセスだけが実行）
+
+    role: auto（ロックを取れたプロセスが実行役）/ leader（ロックを待って実行役になる）/ web（実行しない）
+    """
+    global monitor_scheduler, process_role
+    _start_thread(metrics_loop, 'metrics-publisher')
+    role = role or os.getenv("MONITOR_ROLE", "auto")
+    if role == 'leader':
+        logger.info("監視ジョブの実行ロックを待機中...")
+    if role == 'web' or not leader_lock.acquire(blocking=(role == 'leader')):
+        logger.info(f"Webワーカーとして起動しました (pid={os.getpid()})")
+        _start_thread(relay_events_loop, 'event-relay')
+        return False
+
+    logger.info(f"監視ジョブの実行役として起動しました (pid={os.getpid()})")
+    process_role = 'leader'
+    # キュー経由ではチェック中のスレッドはワーカーの結果を待つだけなので多めに確保
+    max_workers = int(os.getenv("SCHEDULER_QUEUE_WORKERS", "16")) if remote_fetcher is not None else None
+    monitor_scheduler = MonitorScheduler(max_workers=max_workers, on_check=save_monitor_snapshot,
+                                         on_event=handle_job_event)
+    restore_monitoring_on_startup()
+    _start_thread(maintenance_loop, 'monitor-maintenance')
+    return True
 
 class LessonMonitor:
     """レッスン監視クラス"""
     
     def __init__(self, user_id, password, date, notify_method, interval_minutes, 
-                 email=None, line_token=None, selected_lessons=None):
+                 email=None, line_token=None, selected_lessons=None, dates=None, rule=None, site_id=None):
         self.user_id = user_id
+        self.site_id = site_id or DEFAULT_SITE
         self.password = password
         self.date = date
+        self.dates = dates or [date]
         self.notify_method = notify_method
         self.interval_minutes = interval_minutes
         self.email = email
         self.line_token = line_token
         self.selected_lessons = selected_lessons or []
+        # フロントエンドからはレッスン情報（id付き）、旧形式では一覧上の位置が渡される
+        self.selected_ids = [s['id'] if isinstance(s, dict) else s for s in self.selected_lessons]
+        self.rule = rule or WatchRule()
         self.previous_lessons = {}
+        self.has_snapshot = False
+        # 定義変更で監視対象に加わったレッスン（次回は差分ではなく初回と同じ扱い）
+        self.unseen_ids = set()
+        self.last_events = []
+        self.last_error = None
+        self.poller = AdaptivePoller(interval_minutes * 60)
 
-    def start_monitoring(self):
-        """監視を開始"""
-        global monitoring_active
-        
-        print(f"[INFO] 監視開始: {self.date}, 間隔: {self.interval_minutes}分")
-        if self.selected_lessons:
-            print(f"[INFO] 監視対象レッスン: {len(self.selected_lessons)}件")
-
-        while monitoring_active:
-            try:
-                # レッスン情報を取得
-                lessons = self._get_current_lessons()
-                
-                # 監視対象レッスンを特定
-                target_lessons = self._get_target_lessons(lessons)
-                
-                # 変化をチェックして通知
-                self._check_and_notify(target_lessons)
-                
-                print(f"[INFO] 監視更新: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - 対象{len(target_lessons)}件を確認")
-                
-                # 指定間隔で待機
-                time.sleep(self.interval_minutes * 60)
-                
-            except Exception as e:
-                print(f"[ERROR] 監視中にエラー: {e}")
-                time.sleep(60)
-
-        print("[INFO] 監視終了")
+    @classmethod
+    def from_state(cls, state):
+        """保存済みの状態から監視を復元"""
+        return cls(
+            state['user_id'], state['password'], state['date'],
+            state['notify_method'], state['interval'],
+            state.get('email'), state.get('line_token'),
+            state['selected_lessons'], state.get('dates'),
+            WatchRule.from_dict(state.get('rule')), state.get('site')
+        )
 
-    def _get_current_lessons(self):
-        """現在のレッスン情報を取得"""
-        scraper = SeleniumGunzeScraper()
+    def to_state(self):
+        """再起動時の復旧用に保存する状態"""
+        return {
+            'user_id': self.user_id,
+            'site': self.site_id,
+            'password': self.password,
+            'date': self.date,
+            'dates': self.dates,
+            'notify_method': self.notify_method,
+            'interval': self.interval_minutes,
+            'email': self.email,
+            'line_token': self.line_token,
+            'selected_lessons': self.selected_ids,
+            'rule': self.rule.to_dict()
+        }
+
+    def restore_snapshot(self, lessons):
+        """保存済みのスナップショットから差分判定を再開（初回通知を繰り返さない）"""
+        if lessons:
+            self.previous_lessons = lessons
+            self.has_snapshot = True
+
+    def carry_over(self, previous):
+        """定義変更前の監視から差分判定の状態を引き継ぐ（会員・サイト・日付が同じ場合のみ）"""
+        if (previous.user_id, previous.site_id, previous.dates) != (self.user_id, self.site_id, self.dates):
+            return False
+        selected = set(self.selected_ids)
+        self.previous_lessons = {k: v for k, v in previous.previous_lessons.items() if k in selected}
+        self.has_snapshot = previous.has_snapshot
+        self.unseen_ids = {k for k in selected if isinstance(k, str)} - (set(previous.selected_ids) - previous.unseen_ids)
+        self.last_events = previous.last_events
+        self.last_error = previous.last_error
+        if previous.interval_minutes == self.interval_minutes:
+            self.poller = previous.poller
+        return True
+
+    def run_check(self):
+        """1回分の監視を実行し、次回チェックまでの秒数を返す（監視終了時はNone）"""
+        started = time.perf_counter()
         try:
-            if not scraper.login(self.user_id, self.password):
-                raise Exception("ログイン失敗")
+            # レッスン情報を取得
+            lessons = self._get_current_lessons()
             
-            # 日付をYYYYMMDD形式に変換
-            date_str = self.date.replace('-', '')  # YYYY-MM-DD → YYYYMMDD
-            lessons = scraper.go_to_program_page_and_scrape(date_str)
-            return lessons
-        finally:
-            scraper.quit()
+            # 監視対象レッスンを特定
+            target_lessons = self._get_target_lessons(lessons)
+            
+            # 変化をチェックして通知
+            self._check_and_notify(target_lessons)
+            self.last_error = None
+            CHECKS.inc(result='ok')
+            CHECK_SECONDS.observe(time.perf_counter() - started, result='ok')
+            for event in self.last_events:
+                SEAT_EVENTS.inc(type=event.type)
+            
+            logger.info(f"監視更新: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {self.user_id} {','.join(self.dates)} 対象{len(target_lessons)}件を確認")
+            
+            # 開始時刻の近さと空き状況の変動に応じて次回チェックを決定（全て開始済みなら終了）
+            if not target_lessons and max(self.dates) < datetime.now().strftime('%Y-%m-%d'):
+                delay = None
+            else:
+                delay = self.poller.next_delay(target_lessons, self.date)
+            if delay is None:
+                logger.info(f"監視対象のレッスンが全て開始済みのため監視を終了: {self.user_id}")
+            else:
+                logger.info(f"次回チェックまで{delay / 60:.1f}分")
+            return delay
+            
+        except Exception as e:
+            delay = self.poller.error_delay()
+            if isinstance(e, CircuitOpen):
+                # サイトへのアクセスを止めている間は、再試行できる時刻まで待つ
+                delay = max(delay, e.retry_after)
+            self.last_error = str(e)
+            CHECKS.inc(result='error')
+            CHECK_SECONDS.observe(time.perf_counter() - started, result='error')
+            logger.error(f"監視中にエラー: {e} → {delay:.0f}秒後に再試行")
+            return delay
+
+    def _get_current_lessons(self):
+        """現在のレッスン情報を取得（複数日の監視も1回の取得で済ませる）"""
+        lessons_by_date = fetch_lessons_by_date(self.user_id, self.password, self.dates, self.site_id)
+        return [lesson for date in self.dates for lesson in lessons_by_date[date]]
 
     def _get_target_lessons(self, lessons):
-        """監視対象のレッスンを取得"""
-        if not self.selected_lessons:
+        """監視対象のレッスンをIDで取得（パネルの並び順が変わっても同じレッスンを追跡）"""
+        if not self.selected_ids:
             return lessons
-        
-        target_lessons = []
-        for lesson_index in self.selected_lessons:
-            if lesson_index < len(lessons):
-                target_lessons.append(lessons[lesson_index])
-        
-        return target_lessons
+
+        # 旧形式（一覧上の位置）は初回取得時にIDへ固定
+        for i, selected in enumerate(self.selected_ids):
+            if isinstance(selected, int) and selected < len(lessons):
+                self.selected_ids[i] = lessons[selected].key
+
+        index = index_lessons(lessons)
+        return [index[lesson_id] for lesson_id in self.selected_ids if lesson_id in index]
 
     def _check_and_notify(self, target_lessons):
-        """レッスンの変化をチェックして通知"""
-        for lesson in target_lessons:
-            lesson_id = lesson['id']
-            current_status = lesson.get('status', 'unknown')
-            
-            if lesson_id in self.previous_lessons:
-                prev_status = self.previous_lessons[lesson_id].get('status', 'unknown')
-                
-                # 満席・残りわずか → 空き有り の変化を検出
-                if (prev_status in ["満席", "残りわずか"]) and current_status == "空き有り":
-                    self._send_notification(lesson, prev_status, current_status)
+        """前回のスナップショットとの差分からイベントを検出し、1回のチェック分をまとめて通知"""
+        current = index_lessons(target_lessons)
+
+        if not current and self.previous_lessons:
+            # 取得失敗で空になった場合は前回のスナップショットを維持
+            logger.warning(f"レッスン情報が空のため差分判定をスキップ: {self.user_id}")
+            self.last_events = []
+            return []
+
+        if not self.has_snapshot:
+            # 初回監視時：条件を満たす空きがあるレッスンは即座に通知
+            events = []
+            initial = [lesson for lesson in target_lessons if self.rule.is_available(lesson)]
+            if initial and self.rule.notify_initial:
+                self._send_initial_notification(initial)
+        else:
+            fresh = [lesson for lesson in target_lessons if lesson.key in self.unseen_ids]
+            if fresh:
+                # 定義変更で追加されたレッスンは「追加」として扱わず、初回と同じく空きがあれば通知
+                current_known = {k: v for k, v in current.items() if k not in self.unseen_ids}
+                initial = [lesson for lesson in fresh if self.rule.is_available(lesson)]
+                if initial and self.rule.notify_initial:
+                    self._send_initial_notification(initial)
+                self.unseen_ids -= {lesson.key for lesson in fresh}
             else:
-                # 初回監視時：空きがあるレッスンは即座に通知（オプション）
-                if current_status == "空き有り":
-                    self._send_initial_notification(lesson)
-            
-            self.previous_lessons[lesson_id] = lesson
+                current_known = current
+            events = diff_snapshots(self.previous_lessons, current_known, self.rule.thresholds)
+            for event in events:
+                logger.info(f"変化検出({event.type}): {event.lesson.date} {event.lesson.time} {event.lesson.name} 残り{event.lesson.remaining}")
+            # 同じレッスンで複数の条件に一致した場合は1件として通知
+            notify_events = []
+            notified_ids = set()
+            for event in events:
+                if self.rule.matches(event) and event.lesson_id not in notified_ids:
+                    notify_events.append(event)
+                    notified_ids.add(event.lesson_id)
+            if notify_events:
+                self._send_notification(notify_events)
+
+        self.previous_lessons = current
+        self.has_snapshot = True
+        self.last_events = events
+        return events
 
-    def _send_initial_notification(self, lesson):
-        """初回監視時の通知（空きがあるレッスン）"""
+    def _send_initial_notification(self, lessons):
+        """初回監視時の通知（空きがあるレッスン、複数件は1通にまとめる）"""
+        details = "\n\n".join(
+            f"📚 レッスン: {lesson.name}\n"
+            f"🕒 時間: {self._format_lesson_time(lesson)}\n"
+            f"📊 現在の状況: {lesson.status}（残り{lesson.remaining}枠）"
+            for lesson in lessons
+        )
+        summary = ("✅ このレッスンは現在空きがあります" if len(lessons) == 1
+                   else f"✅ {len(lessons)}件のレッスンに現在空きがあります")
         message = (f"📋【監視開始】📋\n\n"
-                  f"📚 レッスン: {lesson['name']}\n"
-                  f"🕒 時間: {lesson['time']}\n"
-                  f"📊 現在の状況: {lesson['status']}\n\n"
-                  f"✅ このレッスンは現在空きがあります\n"
-                  f"🔗 https://www1.nesty-gcloud.net/gunzesports_mypage/")
+                  f"{details}\n\n"
+                  f"{summary}\n"
+                  f"🔗 {get_site(self.site_id).mypage_url}")
         
-        print(f"[INFO] 初回通知: {lesson['name']} (現在{lesson['status']})")
+        for lesson in lessons:
+            logger.info(f"初回通知: {lesson.name} (現在{lesson.status})")
         
-        if self.notify_method == "email" and self.email:
-            NotificationService.send_email(
-                self.email, 
-                "📋 スポーツクラブ 監視開始通知", 
-                message
-            )
-        elif self.notify_method == "line" and self.line_token:
-            NotificationService.send_line(message, self.line_token)
-
-    def _send_notification(self, lesson, prev_status, current_status):
-        """通知を送信"""
-        message = (f"🚨【空きが出ました！】🚨\n\n"
-                  f"📚 レッスン: {lesson['name']}\n"
-                  f"🕒 時間: {lesson['time']}\n"
-                  f"📊 状況: {prev_status} → {current_status}\n\n"
+        self._dispatch("📋 スポーツクラブ 監視開始通知", message)
+
+    def _describe_event(self, event):
+        """イベント1件分の通知文"""
+        lesson = event.lesson
+        before = event.previous.remaining if event.previous else None
+        if event.type in (OPENED, THRESHOLD):
+            status = f"📊 残り枠: {before} → {lesson.remaining}"
+        elif event.type == FILLED:
+            status = "📊 満員になりました"
+        elif event.type == ADDED:
+            status = f"📊 新しく追加されました（残り{lesson.remaining}枠）"
+        else:
+            status = "📊 カレンダーから削除されました"
+        return (f"📚 レッスン: {lesson.name}\n"
+                f"🕒 時間: {self._format_lesson_time(lesson)}\n"
+                f"{status}")
+
+    def _send_notification(self, events):
+        """変化の通知を送信（1回のチェックで複数件あった場合は1通にまとめる）"""
+        openings = [e for e in events if e.type in (OPENED, THRESHOLD, ADDED)]
+        details = "\n\n".join(self._describe_event(event) for event in events)
+        if openings and len(events) == 1:
+            title = "🚨【空きが出ました！】🚨"
+        elif openings:
+            title = f"🚨【{len(openings)}件の空きが出ました！】🚨"
+        else:
+            title = "📋【レッスンの状況が変わりました】📋"
+        message = (f"{title}\n\n"
+                  f"{details}\n\n"
                   f"💨 すぐに予約サイトをチェックしてください！\n"
-                  f"🔗 https://www1.nesty-gcloud.net/gunzesports_mypage/")
+                  f"🔗 {get_site(self.site_id).mypage_url}")
         
-        print(f"[ALERT] 空き検出: {lesson['name']} ({prev_status} → {current_status})")
+        for event in events:
+            logger.warning(f"通知対象の変化: {event.lesson.name} ({event.type})")
         
-        if self.notify_method == "email" and self.email:
-            NotificationService.send_email(
-                self.email, 
-                "🚨 スポーツクラブ レッスン空き通知", 
-                message
-            )
-        elif self.notify_method == "line" and self.line_token:
-            NotificationService.send_line(message, self.line_token)
+        subject = "🚨 スポーツクラブ レッスン空き通知" if openings else "📋 スポーツクラブ レッスン状況通知"
+        self._dispatch(subject, message)
+
+    def _format_lesson_time(self, lesson):
+        """複数日監視の場合は日付付きで表示"""
+        if len(self.dates) > 1 and lesson.date:
+            return f"{lesson.date} {lesson.time}"
+        return lesson.time
+
+    def _dispatch(self, subject, message):
+        """通知キューへ送信（送信完了は待たない）"""
+        notifier.notify(self.notify_method, subject, message,
+                        email=self.email, line_token=self.line_token)
 
 # Flask APIエンドポイント
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend')
+
+# style.css / script.js のブラウザキャッシュ秒数（ETagで更新は検知される）
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+
+_index_cache = {}
+
+def _load_index():
+    """index.html をメモリに保持（ファイルが更新された場合のみ読み直す）"""
+    path = os.path.join(FRONTEND_DIR, 'index.html')
+    mtime = os.path.getmtime(path)
+    if _index_cache.get('mtime') != mtime:
+        with open(path, 'rb') as f:
+            body = f.read()
+        _index_cache.update(mtime=mtime, body=body, etag=hashlib.sha1(body).hexdigest())
+    return _index_cache
+
 @app.route('/')
 def index():
     """メインページ"""
     try:
-        import os
-        frontend_path = os.path.join(os.path.dirname(__file__), '../frontend/index.html')
-        with open(frontend_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        page = _load_index()
     except FileNotFoundError:
         return '''
         <!DOCTYPE html>
@@ -452,163 +633,502 @@ def index():
         <body><h1>フロントエンドファイルが見つかりません</h1>
         <p>frontend/index.html を配置してください</p></body></html>
         '''
+    response = Response(page['body'], mimetype='text/html')
+    response.set_etag(page['etag'])
+    # 毎回ETagで確認し、変更が無ければ304を返す
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/style.css')
 @app.route('/scraper/style.css')
 def serve_css():
     """CSSファイルを提供"""
-    import os
-    try:
-        frontend_path = os.path.join(os.path.dirname(__file__), '../frontend')
-        print(f"Frontend path: {frontend_path}")
-        print(f"Absolute path: {os.path.abspath(frontend_path)}")
-        print(f"CSS file exists: {os.path.exists(os.path.join(frontend_path, 'style.css'))}")
-        return send_from_directory(frontend_path, 'style.css', mimetype='text/css')
-    except Exception as e:
-        print(f"Error serving CSS: {e}")
-        return str(e), 500
+    return send_from_directory(FRONTEND_DIR, 'style.css', mimetype='text/css', max_age=STATIC_MAX_AGE)
 
 @app.route('/script.js')
 @app.route('/scraper/script.js')  
 def serve_js():
     """JavaScriptファイルを提供"""
-    import os
-    return send_from_directory(os.path.join(os.path.dirname(__file__), '../frontend'), 'script.js', mimetype='application/javascript')
+    return send_from_directory(FRONTEND_DIR, 'script.js', mimetype='application/javascript',
+                               max_age=STATIC_MAX_AGE)
+
+def _scrape_result(user_id, password, dates, single, site_id):
+    """レッスン取得ジョブの本体（API応答用の辞書を返す）"""
+    try:
+        lessons_by_date = fetch_lessons_by_date(user_id, password, dates, site_id)
+    except LoginError:
+        raise ScrapeError("ログインに失敗しました", 401)
+    except (BrowserLimitReached, SiteBusy):
+        raise ScrapeError("混雑しているため取得できませんでした。しばらくしてから再度お試しください", 503)
+    except CircuitOpen:
+        raise ScrapeError("サイトに接続できない状態が続いているため、取得を一時停止しています", 503)
+    except SiteUnavailable as e:
+        raise ScrapeError(str(e), 502)
+
+    if single:
+        lessons = lessons_by_date[dates[0]]
+        return {
+            "lessons": [lesson.to_dict() for lesson in lessons],
+            "message": f"{len(lessons)}件のレッスンを取得しました"
+        }
+
+    total = sum(len(lessons) for lessons in lessons_by_date.values())
+    return {
+        "lessonsByDate": {date: [lesson.to_dict() for lesson in lessons]
+                          for date, lessons in lessons_by_date.items()},
+        "message": f"{len(dates)}日分・{total}件のレッスンを取得しました"
+    }
+
+def _scrape_job_response(job):
+    """取得ジョブの状態を返す（完了=200、失敗=エラーのステータス、処理中=202）"""
+    if job.status == DONE:
+        return jsonify(job.to_dict()), 200
+    if job.status == FAILED:
+        return jsonify(job.to_dict()), job.error_status
+    return jsonify(dict(job.to_dict(), statusUrl=f"/api/scrape_jobs/{job.job_id}")), 202
 
 @app.route('/api/scrape_lessons', methods=['POST'])
 def api_scrape_lessons():
-    """レッスン情報取得API（フロントエンド用）"""
+    """レッスン情報取得API（ジョブを登録して即座に返す。dates / dateFrom〜dateTo で複数日）"""
     try:
         data = request.get_json()
         user_id = data.get('userId')
         password = data.get('password')
-        date = data.get('date')
+        try:
+            dates = parse_dates(data)
+        except ValueError as e:
+            return jsonify({"error": f"日付の指定が不正です: {e}"}), 400
         
-        if not user_id or not password or not date:
+        if not user_id or not password or not dates:
             return jsonify({"error": "必要な情報が不足しています"}), 400
 
-        # レッスン情報を取得
-        scraper = SeleniumGunzeScraper()
         try:
-            if not scraper.login(user_id, password):
-                return jsonify({"error": "ログインに失敗しました"}), 401
-            
-            # 日付をYYYYMMDD形式に変換
-            date_str = date.replace('-', '')  # YYYY-MM-DD → YYYYMMDD
-            lessons = scraper.go_to_program_page_and_scrape(date_str)
-            
-            return jsonify({
-                "lessons": lessons,
-                "message": f"{len(lessons)}件のレッスンを取得しました"
-            })
-        finally:
-            scraper.quit()
+            site = get_site(data.get('site'))
+        except UnknownSite as e:
+            return jsonify({"error": str(e)}), 400
+        site_id = site.site_id
+
+        # サイトの障害でアクセスを止めている間はジョブを登録せず即座に返す
+        retry_after = site.breaker.retry_after()
+        if retry_after:
+            return jsonify({"error": "サイトに接続できない状態が続いているため、取得を一時停止しています",
+                            "retryAfter": round(retry_after)}), 503, {'Retry-After': str(int(retry_after) + 1)}
+
+        # ブラウザ処理はバックグラウンドで実行（同じ条件の取得中・直近の結果は共有）
+        single = len(dates) == 1 and not data.get('dates')
+        key = ScrapeJobManager.make_key(user_id, password, dates) + (single, site_id)
+        try:
+            job = scrape_jobs.submit(key, lambda: _scrape_result(user_id, password, dates, single, site_id))
+        except ScrapeQueueFull as e:
+            return jsonify({"error": str(e)}), 503
+
+        # wait秒（最大30秒）までは完了を待ってから返す
+        job.wait(min(request.args.get('wait', 0, type=float), 30))
+        return _scrape_job_response(job)
         
     except Exception as e:
-        print(f"[ERROR] API scrape_lessons エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"API scrape_lessons エラー: {e}")
         return jsonify({"error": f"エラーが発生しました: {str(e)}"}), 500
 
+@app.route('/api/sites', methods=['GET'])
+def api_sites():
+    """対応しているクラブ（サイト）一覧API"""
+    return jsonify({"default": DEFAULT_SITE, "sites": [get_site(site_id).to_dict() for site_id in site_ids()]})
+
+@app.route('/api/workers', methods=['GET'])
+def api_workers():
+    """取得ワーカー一覧API（SCRAPE_MODE=queue の場合のみ。ワーカーは実行中に増減できる）"""
+    if job_queue is None:
+        return jsonify({"mode": SCRAPE_MODE, "workers": [], "queue": None})
+    return jsonify({"mode": SCRAPE_MODE, "workers": job_queue.workers(WORKER_STALE_SECONDS),
+                    "queue": job_queue.stats()})
+
+@app.route('/api/scrape_jobs/<job_id>', methods=['GET'])
+def api_scrape_job(job_id):
+    """レッスン取得ジョブの結果API（?wait=秒 で完了まで待機、最大30秒）"""
+    job = scrape_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "取得ジョブが見つかりません"}), 404
+    job.wait(min(request.args.get('wait', 0, type=float), 30))
+    return _scrape_job_response(job)
+
+def _check_fields(data):
+    """監視定義の各項目の型・値を検証（不備があればエラーメッセージ、無ければNone）"""
+    if 'interval' in data:
+        interval = data['interval']
+        if isinstance(interval, bool) or not isinstance(interval, (int, float)) or not 0 < interval < float('inf'):
+            return "監視間隔(interval)は正の数値（分）で指定してください"
+    for key in ('userId', 'password'):
+        if data.get(key) is not None and not isinstance(data[key], str):
+            return f"{key} は文字列で指定してください"
+    if data.get('notification') is not None and not isinstance(data['notification'], dict):
+        return "notification はオブジェクトで指定してください"
+    if data.get('lessons') is not None and not isinstance(data['lessons'], list):
+        return "lessons は配列で指定してください"
+    if data.get('active') is not None and not isinstance(data['active'], bool):
+        return "active は true / false で指定してください"
+    return None
+
+def _build_monitor(data):
+    """リクエスト内容からLessonMonitorを作成（不備があればエラーメッセージを返す）"""
+    if not isinstance(data, dict):
+        return None, "監視定義はオブジェクトで指定してください"
+    error = _check_fields(data)
+    if error:
+        return None, error
+    user_id = data.get('userId')
+    password = data.get('password')
+    interval = data.get('interval', 5)
+    notification = data.get('notification', {})
+    selected_lessons = data.get('lessons', [])
+    try:
+        dates = parse_dates(data)
+    except ValueError as e:
+        return None, f"日付の指定が不正です: {e}"
+
+    if not user_id or not password or not dates:
+        return None, "必要な情報が不足しています"
+
+    if not selected_lessons:
+        return None, "監視対象のレッスンを選択してください"
+
+    try:
+        rule = WatchRule.from_dict(data.get('rule'))
+    except (TypeError, ValueError) as e:
+        return None, f"通知条件が不正です: {e}"
+
+    try:
+        site_id = get_site(data.get('site')).site_id
+    except UnknownSite as e:
+        return None, str(e)
+
+    monitor = LessonMonitor(
+        user_id, password, dates[0], notification.get('method', 'none'), interval,
+        notification.get('email'), notification.get('lineToken'), selected_lessons,
+        dates=dates, rule=rule, site_id=site_id
+    )
+    return monitor, None
+
+def _update_monitor(job, data):
+    """既存ジョブの定義に、指定された項目だけ変更を適用したLessonMonitorを作成"""
+    if not isinstance(data, dict):
+        return None, "変更内容はオブジェクトで指定してください"
+    error = _check_fields(data)
+    if error:
+        return None, error
+    state = dict(job.monitor.to_state())
+    for key, field in (('password', 'password'), ('interval', 'interval'), ('lessons', 'selected_lessons')):
+        if key in data:
+            state[field] = data[key]
+
+    notification = data.get('notification') or {}
+    if 'method' in notification:
+        state['notify_method'] = notification['method']
+    for key, field in (('email', 'email'), ('lineToken', 'line_token')):
+        if key in notification:
+            state[field] = notification[key]
+
+    if any(data.get(key) for key in ('date', 'dates', 'dateFrom')):
+        try:
+            dates = parse_dates(data)
+        except ValueError as e:
+            return None, f"日付の指定が不正です: {e}"
+        state['date'], state['dates'] = dates[0], dates
+
+    if 'rule' in data:
+        try:
+            state['rule'] = WatchRule.from_dict(data['rule']).to_dict()
+        except (TypeError, ValueError) as e:
+            return None, f"通知条件が不正です: {e}"
+
+    if 'site' in data:
+        try:
+            state['site'] = get_site(data['site']).site_id
+        except UnknownSite as e:
+            return None, str(e)
+
+    if not state['password']:
+        return None, "必要な情報が不足しています"
+    if not state['selected_lessons']:
+        return None, "監視対象のレッスンを選択してください"
+    return LessonMonitor.from_state(state), None
+
 @app.route('/api/start_monitoring', methods=['POST'])
 def api_start_monitoring():
-    """レッスン情報取得・監視開始API"""
-    global monitoring_active, monitoring_thread
-    
+    """レッスン情報取得・監視開始API（同じ会員・日付の監視は置き換え）"""
     try:
-        data = request.get_json()
-        user_id = data.get('userId')
-        password = data.get('password')
-        date = data.get('date')
-        interval = data.get('interval', 5)
-        notification = data.get('notification', {})
-        selected_lessons = data.get('lessons', [])
-        
-        if not user_id or not password or not date:
-            return jsonify({"error": "必要な情報が不足しています"}), 400
-            
-        if not selected_lessons:
-            return jsonify({"error": "監視対象のレッスンを選択してください"}), 400
-
-        # 既存の監視を停止
-        monitoring_active = False
-        if monitoring_thread and monitoring_thread.is_alive():
-            monitoring_thread.join(timeout=5)
-
-        # 監視開始
-        email = notification.get('email')
-        line_token = notification.get('lineToken')
-        notify_method = notification.get('method', 'none')
-        
-        monitor = LessonMonitor(
-            user_id, password, date, notify_method, interval,
-            email, line_token, selected_lessons
-        )
-        
-        monitoring_active = True
-        monitoring_thread = threading.Thread(target=monitor.start_monitoring)
-        monitoring_thread.daemon = False  # daemonをFalseにして独立したプロセスとして実行
-        monitoring_thread.start()
-        
-        # 監視状態をファイルに保存（サーバー再起動時の復旧用）
-        save_monitoring_state({
-            'user_id': user_id,
-            'password': password,
-            'date': date,
-            'notify_method': notify_method,
-            'interval': interval,
-            'email': email,
-            'line_token': line_token,
-            'selected_lessons': selected_lessons,
-            'started_at': datetime.now().isoformat()
-        })
+        monitor, error = _build_monitor(request.get_json())
+        if error:
+            return jsonify({"error": error}), 400
+
+        # 同じ会員・日付・サイトの既存ジョブは定義だけ差し替え（差分判定の状態を引き継ぎ、他の監視には影響しない）
+        existing = scheduler.find(monitor.user_id, monitor.date, monitor.site_id)
+        if existing:
+            job = scheduler.update(existing.job_id, monitor, active=True)
+        else:
+            job = scheduler.add(monitor)
         
-        message = f"監視を開始しました（間隔: {interval}分）"
-        message += f" - 監視対象: {len(selected_lessons)}件のレッスン"
+        message = f"監視を開始しました（間隔: {monitor.interval_minutes}分）"
+        message += f" - 監視対象: {len(monitor.selected_lessons)}件のレッスン"
         
-        return jsonify({
-            "monitoring": True,
-            "message": message
-        })
+        return jsonify(dict(job.to_dict(), monitoring=True, message=message))
         
     except Exception as e:
-        print(f"[ERROR] API scrape_lessons エラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"API start_monitoring エラー: {e}")
         return jsonify({"error": f"エラーが発生しました: {str(e)}"}), 500
 
 @app.route('/api/stop_monitoring', methods=['POST'])
 def api_stop_monitoring():
-    """監視停止API"""
-    global monitoring_active, monitoring_thread
-    
-    monitoring_active = False
-    
-    if monitoring_thread and monitoring_thread.is_alive():
-        monitoring_thread.join(timeout=5)
-    
-    # 監視状態ファイルをクリア
-    clear_monitoring_state()
-    
-    return jsonify({"message": "監視を停止しました"})
+    """監視停止API（jobId・userId指定が無ければ全ジョブを停止）"""
+    data = request.get_json(silent=True) or {}
+    job_id = data.get('jobId')
+    user_id = data.get('userId')
+
+    if job_id:
+        targets = [job_id]
+    else:
+        targets = [job.job_id for job in scheduler.jobs(user_id)]
+
+    for target in targets:
+        scheduler.remove(target)
+
+    return jsonify({"message": "監視を停止しました", "stopped": len(targets)})
 
 @app.route('/api/monitoring_status', methods=['GET'])
 def api_monitoring_status():
-    """監視状態確認API"""
-    global monitoring_active, monitoring_thread
-    
-    is_active = monitoring_active and monitoring_thread and monitoring_thread.is_alive()
+    """監視状態確認API（jobId指定時はそのジョブの詳細も返す）"""
+    job_id = request.args.get('jobId')
+    jobs = scheduler.jobs(request.args.get('userId'))
+    result = {
+        "monitoring": any(job.active for job in jobs),
+        "jobs": len(jobs),
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+    if job_id:
+        job = scheduler.get(job_id)
+        if job:
+            result.update(job.to_dict())
+            result["monitoring"] = job.active
+        else:
+            result.update({"monitoring": False, "isRunning": False})
     
+    return jsonify(result)
+
+@app.route('/api/monitors', methods=['GET'])
+def api_list_monitors():
+    """監視ジョブ一覧API"""
+    jobs = scheduler.jobs(request.args.get('userId'))
+    return jsonify({"jobs": [job.to_dict() for job in jobs], "scheduler": scheduler.stats()})
+
+@app.route('/api/monitors', methods=['POST'])
+def api_create_monitor():
+    """監視ジョブ追加API（既存の監視は停止しない）"""
+    monitor, error = _build_monitor(request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
+
+    job = scheduler.add(monitor)
+    return jsonify(job.to_dict()), 201
+
+@app.route('/api/monitors/<job_id>', methods=['GET'])
+def api_get_monitor(job_id):
+    """監視ジョブ状態API"""
+    job = scheduler.get(job_id)
+    if not job:
+        return jsonify({"error": "監視ジョブが見つかりません"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/monitors/<job_id>', methods=['PATCH'])
+def api_update_monitor(job_id):
+    """監視ジョブ変更API（指定した項目だけ変更し、ジョブは再起動しない。active で実行・一時停止も切替）"""
+    data = request.get_json(silent=True) or {}
+    job = scheduler.get(job_id)
+    if not job:
+        return jsonify({"error": "監視ジョブが見つかりません"}), 404
+    monitor, error = _update_monitor(job, data)
+    if error:
+        return jsonify({"error": error}), 400
+    job = scheduler.update(job_id, monitor, active=data.get('active'))
+    if not job:
+        return jsonify({"error": "監視ジョブが見つかりません"}), 404
+    return jsonify(job.to_dict())
+
+# 一括操作1回あたりの最大件数（追加・変更・削除の合計）
+MONITOR_BATCH_MAX = int(os.getenv("MONITOR_BATCH_MAX", "200"))
+
+@app.route('/api/monitors/batch', methods=['POST'])
+def api_batch_monitors():
+    """監視ジョブの一括追加・変更・削除API（会員・日付をまたいで指定でき、対象外のジョブは再起動しない）
+
+    {"create": [監視定義...], "update": [{"jobId": ..., 変更する項目...}], "delete": [ジョブID...]}
+    1件でも不備があれば何も反映せず400を返す。
+    """
+    data = request.get_json(silent=True) or {}
+    creates = data.get('create') or []
+    updates = data.get('update') or []
+    deletes = data.get('delete') or []
+    if not all(isinstance(items, list) for items in (creates, updates, deletes)):
+        return jsonify({"error": "create・update・delete は配列で指定してください"}), 400
+    if len(creates) + len(updates) + len(deletes) > MONITOR_BATCH_MAX:
+        return jsonify({"error": f"一度に操作できるのは{MONITOR_BATCH_MAX}件までです"}), 400
+
+    errors, add, update = [], [], []
+    for i, item in enumerate(creates):
+        monitor, error = _build_monitor(item)
+        if error:
+            errors.append({"op": "create", "index": i, "error": error})
+        else:
+            add.append(monitor)
+
+    seen = set()
+    for i, item in enumerate(updates):
+        if not isinstance(item, dict) or not isinstance(item.get('jobId'), str):
+            errors.append({"op": "update", "index": i, "error": "jobId（文字列）を含むオブジェクトで指定してください"})
+            continue
+        job_id = item['jobId']
+        job = scheduler.get(job_id)
+        if not job:
+            errors.append({"op": "update", "index": i, "jobId": job_id, "error": "監視ジョブが見つかりません"})
+            continue
+        if job_id in seen:
+            errors.append({"op": "update", "index": i, "jobId": job_id, "error": "同じジョブが複数回指定されています"})
+            continue
+        seen.add(job_id)
+        monitor, error = _update_monitor(job, item)
+        if error:
+            errors.append({"op": "update", "index": i, "jobId": job_id, "error": error})
+        else:
+            update.append((job_id, monitor, item.get('active')))
+
+    for i, job_id in enumerate(deletes):
+        if not isinstance(job_id, str):
+            errors.append({"op": "delete", "index": i, "error": "削除するジョブIDは文字列で指定してください"})
+            continue
+        if job_id in seen:
+            errors.append({"op": "delete", "index": i, "jobId": job_id, "error": "同じジョブが複数回指定されています"})
+        seen.add(job_id)
+
+    if errors:
+        return jsonify({"error": "一括操作の内容に不備があります", "errors": errors}), 400
+
+    added, updated, removed = scheduler.apply(add, update, deletes)
     return jsonify({
-        "monitoring": is_active,
-        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        "created": [job.to_dict() for job in added],
+        "updated": [job.to_dict() for job in updated],
+        "deleted": removed
+    })
+
+@app.route('/api/monitors/<job_id>', methods=['DELETE'])
+def api_delete_monitor(job_id):
+    """監視ジョブ削除API"""
+    if not scheduler.remove(job_id):
+        return jsonify({"error": "監視ジョブが見つかりません"}), 404
+    return jsonify({"message": "監視を停止しました", "jobId": job_id})
+
+@app.route('/api/monitors/<job_id>/start', methods=['POST'])
+def api_resume_monitor(job_id):
+    """監視ジョブ再開API"""
+    job = scheduler.start(job_id)
+    if not job:
+        return jsonify({"error": "監視ジョブが見つかりません"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/monitors/<job_id>/stop', methods=['POST'])
+def api_pause_monitor(job_id):
+    """監視ジョブ一時停止API"""
+    job = scheduler.stop(job_id)
+    if not job:
+        return jsonify({"error": "監視ジョブが見つかりません"}), 404
+    return jsonify(job.to_dict())
+
+def _event_stream(subscription, initial):
+    """購読中のイベントを送り続けるジェネレーター（一定時間ごとにkeep-aliveを送る）"""
+    try:
+        yield "retry: 3000\n\n"
+        for chunk in initial:
+            yield chunk
+        while True:
+            event = subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield event.to_sse()
+    finally:
+        event_bus.unsubscribe(subscription)
+
+def _sse_response(job_id=None, user_id=None, jobs=()):
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    subscription = event_bus.subscribe(job_id, user_id, last_event_id)
+    # 接続直後に現在の状態を送り、初回表示のための問い合わせを不要にする
+    initial = [format_sse('status', {'change': 'connected', 'job': job.to_dict(), 'jobId': job.job_id})
+               for job in jobs]
+    return Response(_event_stream(subscription, initial), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/monitors/<job_id>/events', methods=['GET'])
+def api_monitor_events(job_id):
+    """監視ジョブのイベント配信API（Server-Sent Events）"""
+    job = scheduler.get(job_id)
+    if not job:
+        return jsonify({"error": "監視ジョブが見つかりません"}), 404
+    return _sse_response(job_id=job_id, jobs=[job])
+
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    """全監視ジョブのイベント配信API（userIdで絞り込み可）"""
+    user_id = request.args.get('userId')
+    return _sse_response(user_id=user_id, jobs=scheduler.jobs(user_id))
+
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
+    """Prometheus形式のメトリクス（全プロセス分を合算）"""
+    publish_metrics()
+    snapshots = store.load_metrics(max_age=METRICS_PUBLISH_SECONDS * 3)
+    return Response(REGISTRY.render(list(snapshots.values())),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/lessons/<lesson_id>/history', methods=['GET'])
+def api_lesson_history(lesson_id):
+    """レッスンの残り枠履歴API（since: UNIX秒, limit: 件数）"""
+    lesson = store.lesson(lesson_id)
+    if not lesson:
+        return jsonify({"error": "レッスンが見つかりません"}), 404
+
+    since = request.args.get('since', type=float)
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+    history = store.lesson_history(lesson_id, since=since, limit=limit)
+    return jsonify({
+        "lesson": lesson,
+        "history": [{"remaining": h['remaining'],
+                     "observedAt": datetime.fromtimestamp(h['observed_at']).isoformat()} for h in history]
+    })
+
+@app.route('/api/lessons/history', methods=['GET'])
+def api_slot_history():
+    """同じレッスン名・開始時刻の全日付の残り枠履歴API"""
+    name = request.args.get('name')
+    time_str = request.args.get('time')
+    if not name or not time_str:
+        return jsonify({"error": "name と time を指定してください"}), 400
+
+    since = request.args.get('since', type=float)
+    history = store.slot_history(name, time_str, since=since)
+    return jsonify({
+        "name": name,
+        "time": time_str,
+        "history": [{"lessonId": h['lesson_id'], "date": h['date'], "remaining": h['remaining'],
+                     "observedAt": datetime.fromtimestamp(h['observed_at']).isoformat()} for h in history]
     })
 
 if __name__ == '__main__':
-    print("🚀 スポーツクラブ レッスン監視システム起動中...")
-    print("📱 ブラウザで http://127.0.0.1:5000 にアクセスしてください")
+    logger.info("🚀 スポーツクラブ レッスン監視システム起動中...")
+    logger.info("📱 ブラウザで http://127.0.0.1:5000 にアクセスしてください")
     
-    # サーバー起動時に前回の監視状態を復旧
-    restore_monitoring_on_startup()
+    # サーバー起動時に前回の監視状態を復旧（リローダーを使うと二重に起動するため無効化）
+    start_services()
     
-    app.run(host="0.0.0.0", debug=True, port=5000)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=5000, threaded=True,
+            debug=os.getenv("FLASK_DEBUG") == "1", use_reloader=False)
@@ -0,0 +1,252 @@
+"""偽サイトに対してチェック遅延・同時監視のスループット・セッションごとのメモリ・通知遅延を計測する
+
+使い方（backend ディレクトリで実行）:
+    python -m bench.benchmark --backends http,selenium --iterations 20 --monitors 8
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# backend 直下のモジュールを読み込めるようにする
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from bench.fake_site import FakeClubSite, SeatModel
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "password"
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 4)
+
+
+def _summary(values):
+    """秒の一覧 → p50/p95/平均"""
+    return {
+        'count': len(values),
+        'p50': _percentile(values, 50),
+        'p95': _percentile(values, 95),
+        'mean': round(statistics.mean(values), 4) if values else None,
+        'max': round(max(values), 4) if values else None
+    }
+
+
+def _process_rss_mb():
+    """このプロセスの常駐メモリ(MB)（/procが無い環境ではNone）"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _make_pool(backend, max_size):
+    from driver_pool import DriverPool
+    from http_scraper import create_scraper
+    return DriverPool(factory=lambda site: create_scraper(backend, site), max_size=max_size,
+                      max_uses=10 ** 6, idle_timeout=3600)
+
+
+def bench_check_latency(backend, iterations):
+    """1会員のログイン（初回）と、ログイン済みセッションでのカレンダー取得の所要時間"""
+    pool = _make_pool(backend, 1)
+    cold, warm, phases = None, [], {}
+    try:
+        for i in range(iterations + 1):
+            started = time.perf_counter()
+            with pool.session(BENCH_USER, BENCH_PASSWORD) as scraper:
+                results = scraper.go_to_program_page_and_scrape_dates(None)
+                timings = getattr(scraper, 'last_timings', None) or {}
+            elapsed = time.perf_counter() - started
+            if not results:
+                raise RuntimeError(f"{backend}: カレンダーを取得できませんでした")
+            if i == 0:
+                cold = round(elapsed, 4)
+                continue
+            warm.append(elapsed)
+            for name, seconds in timings.items():
+                phases.setdefault(name, []).append(seconds)
+    finally:
+        pool.shutdown()
+    return {
+        'coldSeconds': cold,
+        'warm': _summary(warm),
+        'phases': {name: _summary(values) for name, values in phases.items()}
+    }
+
+
+class BenchMonitor:
+    """計測用の監視（前回との差分検出まで行い、所定の時間が過ぎたら終了）"""
+
+    def __init__(self, user_id, pool, until, latencies, events):
+        self.user_id = user_id
+        self.date = None
+        self.interval_minutes = 0
+        self.pool = pool
+        self.until = until
+        self.latencies = latencies
+        self.events = events
+        self.previous = {}
+
+    def run_check(self):
+        from diff_engine import diff_snapshots
+        from lessons import index_lessons
+
+        if time.time() >= self.until:
+            return None
+        started = time.perf_counter()
+        with self.pool.session(self.user_id, BENCH_PASSWORD) as scraper:
+            results = scraper.go_to_program_page_and_scrape_dates(None)
+        current = index_lessons(l for lessons in results.values() for l in lessons)
+        changes = diff_snapshots(self.previous, current) if self.previous else []
+        self.previous = current
+        self.latencies.append(time.perf_counter() - started)
+        self.events.append(len(changes))
+        return 0
+
+
+def bench_concurrent_monitors(backend, monitors, workers, pool_size, duration):
+    """多数の監視ジョブを同時に登録し、一定時間内に完了したチェック数を計測"""
+    from scheduler import MonitorScheduler
+
+    pool = _make_pool(backend, pool_size)
+    scheduler = MonitorScheduler(max_workers=workers, per_user_limit=1)
+    latencies, events = [], []
+    started = time.time()
+    until = started + duration
+    try:
+        for i in range(monitors):
+            scheduler.add(BenchMonitor(f"{BENCH_USER}{i:03d}", pool, until, latencies, events))
+        while time.time() < until + 1 and any(not job.finished for job in scheduler.jobs()):
+            time.sleep(0.1)
+        elapsed = time.time() - started
+    finally:
+        scheduler.shutdown()
+        pool.shutdown()
+    return {
+        'monitors': monitors,
+        'workers': workers,
+        'poolSize': pool_size,
+        'checks': len(latencies),
+        'checksPerSecond': round(len(latencies) / elapsed, 3) if elapsed else None,
+        'checkLatency': _summary(latencies),
+        'changesDetected': sum(events)
+    }
+
+
+def bench_memory_per_session(backend, sessions):
+    """会員ごとのセッションを同時に保持したときのメモリ（ブラウザ分とこのプロセス分）"""
+    pool = _make_pool(backend, sessions)
+    before = _process_rss_mb()
+    browser_mb = []
+    try:
+        for i in range(sessions):
+            with pool.session(f"{BENCH_USER}{i:03d}", BENCH_PASSWORD) as scraper:
+                scraper.go_to_program_page_and_scrape_dates(None)
+                browser_mb.append(scraper.memory_usage_mb())
+        after = _process_rss_mb()
+    finally:
+        pool.shutdown()
+    process_delta = round(after - before, 1) if before is not None and after is not None else None
+    return {
+        'sessions': sessions,
+        'browserMbPerSession': _summary(browser_mb),
+        'processRssDeltaMb': process_delta,
+        'processRssDeltaMbPerSession': round(process_delta / sessions, 2) if process_delta is not None else None
+    }
+
+
+def bench_notification_latency(site, count):
+    """通知をキューに積んでから偽サイトのLINE Notify互換エンドポイントに届くまでの時間"""
+    from notifier import NotificationDispatcher
+
+    dispatcher = NotificationDispatcher()
+    offset = len(site.notifications)
+    sent_at = []
+    try:
+        for i in range(count):
+            sent_at.append(time.time())
+            dispatcher.notify("line", "bench", f"bench-{i}", line_token="bench-token")
+        received = site.wait_for_notifications(offset + count, timeout=30) - offset
+    finally:
+        dispatcher.shutdown()
+    arrivals = {message: at for at, message in site.notifications[offset:]}
+    latencies = [arrivals[f"bench-{i}"] - sent_at[i] for i in range(count) if f"bench-{i}" in arrivals]
+    return {'sent': count, 'received': received, 'latency': _summary(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="偽サイトを使ったスクレイピング・監視のベンチマーク")
+    parser.add_argument('--backends', default='http', help="計測するバックエンド（カンマ区切り: http,selenium,auto）")
+    parser.add_argument('--iterations', type=int, default=20, help="チェック遅延の計測回数")
+    parser.add_argument('--monitors', type=int, default=8, help="同時に登録する監視ジョブ数")
+    parser.add_argument('--workers', type=int, default=4, help="スケジューラーのワーカー数")
+    parser.add_argument('--pool-size', type=int, default=4, help="ドライバープールの上限")
+    parser.add_argument('--duration', type=float, default=10.0, help="同時監視の計測時間(秒)")
+    parser.add_argument('--sessions', type=int, default=4, help="メモリ計測で同時に保持するセッション数")
+    parser.add_argument('--notifications', type=int, default=20, help="通知遅延の計測件数")
+    parser.add_argument('--latency', type=float, default=0.05, help="偽サイトの1リクエストあたりの待ち時間(秒)")
+    parser.add_argument('--jitter', type=float, default=0.02, help="偽サイトの待ち時間の揺らぎ(秒)")
+    parser.add_argument('--churn-interval', type=float, default=1.0, help="残り枠数を変動させる間隔(秒)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="結果のJSONを書き出すファイル")
+    args = parser.parse_args()
+
+    site = FakeClubSite(latency=args.latency, jitter=args.jitter, password=BENCH_PASSWORD,
+                        seat_model=SeatModel(churn_interval=args.churn_interval, seed=args.seed)).start()
+
+    # 各モジュールは読み込み時に接続先を決めるため、偽サイトの起動後に設定してから読み込む
+    # （Chromeのプロファイル等は一時ディレクトリに作成）
+    workdir = tempfile.mkdtemp(prefix='lesson_bench_')
+    os.environ['GUNZE_MYPAGE_URL'] = site.mypage_url
+    os.environ['LINE_NOTIFY_URL'] = site.notify_url
+    os.environ.setdefault('NOTIFY_BACKOFF_SECONDS', '0.1')
+    os.environ.setdefault('SCRAPER_BLOCKED_URLS', '*/static/*')
+    # サイトごとのアクセス上限で計測が律速されないようにする
+    os.environ.setdefault('GUNZE_MAX_CONCURRENCY', '64')
+    os.environ.setdefault('GUNZE_RATE_PER_MINUTE', '1000000')
+    os.chdir(workdir)
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper(), stream=sys.stderr)
+
+    results = {
+        'site': {'latency': args.latency, 'jitter': args.jitter, 'churnInterval': args.churn_interval},
+        'backends': {}
+    }
+    try:
+        for backend in [b.strip() for b in args.backends.split(',') if b.strip()]:
+            entry = results['backends'][backend] = {}
+            try:
+                entry['checkLatency'] = bench_check_latency(backend, args.iterations)
+                entry['concurrentMonitors'] = bench_concurrent_monitors(
+                    backend, args.monitors, args.workers, args.pool_size, args.duration)
+                entry['memoryPerSession'] = bench_memory_per_session(backend, args.sessions)
+            except Exception as e:
+                entry['error'] = str(e)
+        results['notification'] = bench_notification_latency(site, args.notifications)
+        results['site']['stats'] = site.stats()
+    finally:
+        site.stop()
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
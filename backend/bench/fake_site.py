@@ -0,0 +1,262 @@
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse
+import html
+import json
+import random
+import threading
+import time
+import uuid
+
+# 公開サイトのマークアップを模した最小限のページ
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>マイページ ログイン</title>
+<link rel="stylesheet" href="/static/site.css"></head>
+<body>
+<form method="post" action="/mypage/login">
+  <input type="text" name="会員番号" value="">
+  <input type="password" name="パスワード" value="">
+  <input type="hidden" name="__token" value="{token}">
+  <input type="submit" id="DN10BtnLogin" name="DN10BtnLogin" value="ログイン">
+</form>
+</body></html>"""
+
+MENU_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>マイページ</title></head>
+<body>
+<a id="menuItemAnchorWebPersonal" href="/mypage/personal" target="_blank">個人メニュー</a>
+</body></html>"""
+
+PERSONAL_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>個人メニュー</title></head>
+<body>
+<a id="menuItemAnchor__sisetu3" href="/mypage/program">プログラム予約</a>
+</body></html>"""
+
+PROGRAM_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>プログラム</title>
+<img src="/static/banner.png"></head>
+<body><div id="Q060Calendar">{days}</div></body></html>"""
+
+LESSON_NAMES = ["30メガダンス", "ヨガ ベーシック", "ボディコンバット", "ZUMBA", "ピラティス", "アクアビクス"]
+LESSON_TIMES = ["09:30", "10:45", "12:00", "14:15", "18:30", "19:45"]
+
+
+class SeatModel:
+    """日付×時刻ごとのレッスンと、時間とともに変動する残り枠数"""
+
+    def __init__(self, days=7, capacity=30, churn_interval=5.0, churn_probability=0.3, seed=1):
+        self.capacity = capacity
+        self.churn_interval = churn_interval
+        self.churn_probability = churn_probability
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._last_churn = time.time()
+        today = datetime.now().date()
+        self.lessons = {}
+        for offset in range(days):
+            date_str = (today + timedelta(days=offset)).strftime('%Y%m%d')
+            self.lessons[date_str] = [
+                [time_str, LESSON_NAMES[(offset + i) % len(LESSON_NAMES)], self._random.randint(0, 5)]
+                for i, time_str in enumerate(LESSON_TIMES)
+            ]
+
+    def snapshot(self):
+        """現在の {YYYYMMDD: [(時刻, レッスン名, 残り枠)]}（経過時間分だけ枠数を変動させる）"""
+        with self._lock:
+            now = time.time()
+            steps = int((now - self._last_churn) / self.churn_interval) if self.churn_interval > 0 else 0
+            for _ in range(min(steps, 100)):
+                for lessons in self.lessons.values():
+                    for lesson in lessons:
+                        if self._random.random() < self.churn_probability:
+                            delta = self._random.choice((-2, -1, 1, 2))
+                            lesson[2] = max(0, min(self.capacity, lesson[2] + delta))
+            if steps:
+                self._last_churn += steps * self.churn_interval
+            return {date: [tuple(l) for l in lessons] for date, lessons in self.lessons.items()}
+
+
+class FakeClubSite:
+    """ログイン・メニュー・カレンダー・LINE Notify互換の通知受信を提供するローカルサーバー"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, password='password',
+                 seat_model=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.password = password
+        self.seats = seat_model or SeatModel()
+        self.sessions = {}
+        self.notifications = []  # (受信時刻, メッセージ)
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._notified = threading.Condition(self._lock)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def mypage_url(self):
+        return f"{self.base_url}/mypage/"
+
+    @property
+    def notify_url(self):
+        return f"{self.base_url}/notify"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-club-site')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def wait_for_notifications(self, count, timeout):
+        """通知をcount件受信するまで待つ（受信済み件数を返す）"""
+        deadline = time.time() + timeout
+        with self._notified:
+            while len(self.notifications) < count and time.time() < deadline:
+                self._notified.wait(max(0.0, deadline - time.time()))
+            return len(self.notifications)
+
+    def stats(self):
+        with self._lock:
+            return {'requests': dict(self.requests), 'sessions': len(self.sessions),
+                    'notifications': len(self.notifications)}
+
+    def _render_program(self):
+        days = []
+        for date_str, lessons in self.seats.snapshot().items():
+            panels = ''.join(
+                f'<div class="Q060_calendar_panel_yotei"><div>{time_str}</div>'
+                f'<div>{html.escape(name)}({remaining})</div></div>'
+                for time_str, name, remaining in lessons
+            )
+            days.append(f'<div id="Q060CalendarDate__{date_str}">{panels}</div>')
+        return PROGRAM_PAGE.format(days=''.join(days))
+
+    def _handler_class(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _delay(self):
+                if site.latency or site.jitter:
+                    time.sleep(site.latency + random.uniform(0, site.jitter))
+
+            def _count(self, path):
+                with site._lock:
+                    site.requests[path] = site.requests.get(path, 0) + 1
+
+            def _session_user(self):
+                cookie = SimpleCookie(self.headers.get('Cookie', ''))
+                token = cookie['FAKESESSION'].value if 'FAKESESSION' in cookie else None
+                with site._lock:
+                    return site.sessions.get(token)
+
+            def _send(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_form(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8')
+                return {k: v[0] for k, v in parse_qs(body, keep_blank_values=True).items()}
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                self._count(path)
+                self._delay()
+                if path.startswith('/static/'):
+                    self._send(404, '')
+                elif path == '/stats':
+                    self._send(200, json.dumps(site.stats()), 'application/json')
+                elif path in ('/mypage/', '/mypage/menu'):
+                    if self._session_user():
+                        self._send(200, MENU_PAGE)
+                    else:
+                        self._send(200, LOGIN_PAGE.format(token=uuid.uuid4().hex))
+                elif not self._session_user():
+                    self._send(302, '', headers={'Location': '/mypage/'})
+                elif path == '/mypage/personal':
+                    self._send(200, PERSONAL_PAGE)
+                elif path == '/mypage/program':
+                    self._send(200, site._render_program())
+                else:
+                    self._send(404, 'not found', 'text/plain')
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                self._count(path)
+                if path == '/notify':
+                    # LINE Notify互換（通知遅延の計測用なので待ち時間は入れない）
+                    message = self._read_form().get('message', '')
+                    with site._notified:
+                        site.notifications.append((time.time(), message))
+                        site._notified.notify_all()
+                    self._send(200, json.dumps({'status': 200, 'message': 'ok'}), 'application/json')
+                    return
+
+                self._delay()
+                if path != '/mypage/login':
+                    self._send(404, 'not found', 'text/plain')
+                    return
+                form = self._read_form()
+                if not form.get('会員番号') or form.get('パスワード') != site.password:
+                    self._send(200, LOGIN_PAGE.format(token=uuid.uuid4().hex))
+                    return
+                token = uuid.uuid4().hex
+                with site._lock:
+                    site.sessions[token] = form['会員番号']
+                self._send(303, '', headers={'Location': '/mypage/menu',
+                                             'Set-Cookie': f'FAKESESSION={token}; Path=/; HttpOnly'})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スポーツクラブサイトのローカル代替サーバー")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help="1リクエストあたりの待ち時間(秒)")
+    parser.add_argument('--jitter', type=float, default=0.05, help="待ち時間に加える揺らぎの最大値(秒)")
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--churn-interval', type=float, default=5.0, help="残り枠数を変動させる間隔(秒)")
+    parser.add_argument('--churn-probability', type=float, default=0.3)
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    seats = SeatModel(args.days, churn_interval=args.churn_interval,
+                      churn_probability=args.churn_probability, seed=args.seed)
+    site = FakeClubSite(args.host, args.port, args.latency, args.jitter, args.password, seats).start()
+    print(f"GUNZE_MYPAGE_URL={site.mypage_url}")
+    print(f"LINE_NOTIFY_URL={site.notify_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        site.stop()
+
+
+if __name__ == '__main__':
+    main()
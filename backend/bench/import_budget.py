@@ -0,0 +1,97 @@
+"""APIプロセスの起動時間（import時間）と、ブラウザ関連モジュールを読み込んでいないことを確認する
+
+新しいPythonプロセスで app を読み込み、/api/monitoring_status と静的ファイルに応答するまでの
+時間を計測する。予算超過、またはスクレイピング専用のモジュールが読み込まれていれば終了コード1。
+
+使い方（backend ディレクトリで実行）:
+    python -m bench.import_budget --budget 1.5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# APIだけを処理するプロセスでは読み込まないモジュール（スクレイピングを行うワーカーが初回に読み込む）
+HEAVY_MODULES = (
+    'selenium', 'selenium_stealth', 'chromedriver_autoinstaller', 'scraper', 'http_scraper',
+    'requests', 'urllib3', 'cryptography',
+)
+
+# 子プロセスで実行する計測コード
+PROBE = r"""
+import json
+import sys
+import time
+
+started = time.perf_counter()
+import {module} as target
+imported = time.perf_counter() - started
+
+requests_seconds = {{}}
+app = getattr(target, 'app', None)
+if app is not None and hasattr(app, 'test_client'):
+    client = app.test_client()
+    for path in {paths!r}:
+        started = time.perf_counter()
+        status = client.get(path).status_code
+        requests_seconds[path] = [status, time.perf_counter() - started]
+
+heavy = sorted(name for name in sys.modules if name.split('.')[0] in {heavy!r})
+print(json.dumps({{'importSeconds': imported, 'requests': requests_seconds, 'heavyModules': heavy}}))
+"""
+
+
+def measure(module, paths):
+    """新しいプロセスで module を読み込み、import時間・応答時間・読み込まれた重いモジュールを返す"""
+    workdir = tempfile.mkdtemp(prefix='lesson_import_budget_')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (BACKEND_DIR, env.get('PYTHONPATH')) if p)
+    env.setdefault('MONITOR_DB_PATH', os.path.join(workdir, 'monitoring.db'))
+    env.setdefault('MONITOR_LEADER_LOCK', os.path.join(workdir, 'monitor_leader.lock'))
+    env.setdefault('SESSION_VAULT_KEY_FILE', os.path.join(workdir, 'session_vault.key'))
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    code = PROBE.format(module=module, paths=list(paths), heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, '-c', code], cwd=workdir, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{module} の読み込みに失敗しました:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APIプロセスのimport時間の予算チェック")
+    parser.add_argument('--module', default='app', help="計測するモジュール")
+    parser.add_argument('--budget', type=float, default=float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5")),
+                        help="import時間の上限(秒)")
+    parser.add_argument('--paths', default='/api/monitoring_status,/,/style.css',
+                        help="読み込み後に応答を確認するパス（カンマ区切り）")
+    parser.add_argument('--repeat', type=int, default=3, help="計測回数（最小値で判定）")
+    args = parser.parse_args()
+
+    paths = [p.strip() for p in args.paths.split(',') if p.strip()]
+    runs = [measure(args.module, paths) for _ in range(max(1, args.repeat))]
+    best = min(runs, key=lambda r: r['importSeconds'])
+    heavy = sorted({name for r in runs for name in r['heavyModules']})
+    failures = []
+    if best['importSeconds'] > args.budget:
+        failures.append(f"import時間が予算を超えています: {best['importSeconds']:.3f}秒 > {args.budget:.3f}秒")
+    if heavy:
+        failures.append(f"スクレイピング用のモジュールが読み込まれています: {', '.join(heavy)}")
+    for path, (status, _) in best['requests'].items():
+        if status >= 500:
+            failures.append(f"{path} がエラーを返しました: {status}")
+
+    print(json.dumps({'module': args.module, 'budgetSeconds': args.budget,
+                      'importSeconds': round(best['importSeconds'], 4),
+                      'requests': {path: {'status': status, 'seconds': round(seconds, 4)}
+                                   for path, (status, seconds) in best['requests'].items()},
+                      'heavyModules': heavy, 'failures': failures}, ensure_ascii=False, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+from concurrent.futures import Future
+import hashlib
+import os
+import threading
+import time
+
+
+def credential_key(user_id, password):
+    """認証情報のキー（パスワードそのものは保持しない）"""
+    return (user_id, hashlib.sha256(password.encode('utf-8')).hexdigest())
+
+
+class CalendarCache:
+    """日付ごとのカレンダー取得結果をTTL付きで共有し、同時取得を1回にまとめるキャッシュ
+
+    他の会員が取得した結果は、呼び出し元のログインを確認してから返す
+    （確認できた認証情報は auth_ttl 秒の間は確認を省略）。
+    """
+
+    def __init__(self, ttl=None, auth_ttl=None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("CALENDAR_CACHE_TTL", "30"))
+        self.auth_ttl = auth_ttl if auth_ttl is not None else float(os.getenv("CALENDAR_AUTH_TTL", "300"))
+        self._entries = {}   # 日付 → (取得時刻, レッスン一覧)
+        self._inflight = {}  # 日付 → 取得中のFuture
+        self._verified = {}  # 認証情報のキー → ログインを確認した時刻
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, date_str, fetch):
+        """1日分を取得（fetch() はその日のレッスン一覧を返す関数）"""
+        return self.get_many([date_str], lambda dates: {date_str: fetch()})[date_str]
+
+    def get_many(self, date_strs, fetch_many, principal=None, authenticate=None):
+        """複数日分を取得。キャッシュ済みの日付は即返却、取得中の日付は完了を待ち、
+        残りの日付だけを fetch_many(日付リスト) の1回の呼び出しでまとめて取得する
+
+        principal は呼び出し元の認証情報のキー。他の呼び出し元の結果を返す前に
+        authenticate() でログインを確認する（失敗時の例外はそのまま送出）。
+        """
+        results = {}
+        waits = {}
+        mine = []
+        with self._lock:
+            now = time.time()
+            for date_str in date_strs:
+                entry = self._entries.get(date_str)
+                if entry and now - entry[0] < self.ttl:
+                    self.hits += 1
+                    results[date_str] = list(entry[1])
+                elif date_str in self._inflight:
+                    self.coalesced += 1
+                    waits[date_str] = self._inflight[date_str]
+                elif date_str not in mine:
+                    mine.append(date_str)
+
+            if mine:
+                future = Future()
+                for date_str in mine:
+                    self._inflight[date_str] = future
+                self.misses += 1
+        cached = bool(results)
+
+        if mine:
+            try:
+                fetched = fetch_many(mine)
+            except BaseException as e:
+                with self._lock:
+                    for date_str in mine:
+                        del self._inflight[date_str]
+                    self._verified.pop(principal, None)
+                future.set_exception(e)
+                raise
+
+            with self._lock:
+                # 取得できた日付は（依頼外の日付も含めて）キャッシュ。取得失敗時の空リストはキャッシュしない
+                fetched_at = time.time()
+                for date_str, lessons in fetched.items():
+                    if lessons:
+                        self._entries[date_str] = (fetched_at, list(lessons))
+                for date_str in mine:
+                    del self._inflight[date_str]
+                # 自分の認証情報で取得できた＝ログインを確認済み
+                self._mark_verified_locked(principal, fetched_at)
+            future.set_result(fetched)
+            for date_str in mine:
+                results[date_str] = list(fetched.get(date_str, []))
+
+        # 他の呼び出し元の結果（キャッシュ済み・取得中）は、呼び出し元のログインを確認してから返す
+        if (cached or waits) and authenticate is not None and not self._is_verified(principal):
+            authenticate()
+            with self._lock:
+                self._mark_verified_locked(principal, time.time())
+
+        for date_str, waiting in waits.items():
+            try:
+                results[date_str] = list(waiting.result().get(date_str, []))
+            except Exception:
+                # 他の呼び出し元の取得失敗（ログイン失敗など）は自分の認証情報で取り直す
+                results.update(self.get_many([date_str], fetch_many, principal, authenticate))
+
+        return results
+
+    def _is_verified(self, principal):
+        with self._lock:
+            verified_at = self._verified.get(principal)
+            return verified_at is not None and time.time() - verified_at < self.auth_ttl
+
+    def _mark_verified_locked(self, principal, now):
+        if principal is None:
+            return
+        # 期限切れの確認結果はここでまとめて削除
+        for key in [k for k, verified_at in self._verified.items() if now - verified_at >= self.auth_ttl]:
+            del self._verified[key]
+        self._verified[principal] = now
+
+    def invalidate(self, date_str=None):
+        """キャッシュを破棄（日付指定なしで全件）"""
+        with self._lock:
+            if date_str is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(date_str, None)
+
+    def purge_expired(self):
+        """期限切れのエントリを削除"""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (fetched_at, _) in self._entries.items() if now - fetched_at >= self.ttl]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'inflight': len(self._inflight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced
+            }
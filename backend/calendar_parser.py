@@ -0,0 +1,81 @@
+from html.parser import HTMLParser
+import os
+
+# スポーツクラブ マイページの入口URL（ローカルの代替サーバーで試験する場合は環境変数で差し替え）
+MYPAGE_URL = os.getenv("GUNZE_MYPAGE_URL", "https://www1.nesty-gcloud.net/gunzesports_mypage/")
+
+CALENDAR_DATE_PREFIX = "Q060CalendarDate__"
+PANEL_CLASS = "Q060_calendar_panel_yotei"
+
+# テキストを改行で区切るブロック要素
+_BLOCK_TAGS = {'br', 'div', 'p', 'li', 'tr', 'td', 'th', 'dt', 'dd'}
+_VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+              'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+
+class CalendarHTMLParser(HTMLParser):
+    """プログラムページのHTMLから日付ごとのパネルテキストを抽出"""
+
+    def __init__(self, date_prefix=CALENDAR_DATE_PREFIX, panel_class=PANEL_CLASS):
+        super().__init__(convert_charrefs=True)
+        self.date_prefix = date_prefix
+        self.panel_class = panel_class
+        self.panels = {}
+        self._stack = []
+        self._date = None
+        self._date_depth = None
+        self._panel_depth = None
+        self._chunks = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self._panel_depth is not None and tag in _BLOCK_TAGS:
+            self._chunks.append('\n')
+        if tag in _VOID_TAGS:
+            return
+
+        self._stack.append(tag)
+        depth = len(self._stack)
+        element_id = attrs.get('id') or ''
+        classes = (attrs.get('class') or '').split()
+
+        if element_id.startswith(self.date_prefix):
+            self._date = element_id[len(self.date_prefix):]
+            self._date_depth = depth
+            self.panels.setdefault(self._date, [])
+        elif self._date is not None and self._panel_depth is None and self.panel_class in classes:
+            self._panel_depth = depth
+            self._chunks = []
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS or tag not in self._stack:
+            return
+        # 閉じ忘れのタグは対応する開始タグまでまとめて閉じる
+        while self._stack:
+            depth = len(self._stack)
+            closed = self._stack.pop()
+            if self._panel_depth is not None and depth == self._panel_depth:
+                self._finish_panel()
+            if self._date_depth is not None and depth == self._date_depth:
+                self._date = None
+                self._date_depth = None
+            if closed == tag:
+                break
+
+    def handle_data(self, data):
+        if self._panel_depth is not None:
+            self._chunks.append(data)
+
+    def _finish_panel(self):
+        lines = [' '.join(line.split()) for line in ''.join(self._chunks).split('\n')]
+        self.panels[self._date].append('\n'.join(line for line in lines if line))
+        self._panel_depth = None
+        self._chunks = []
+
+
+def extract_panel_texts(html, date_prefix=CALENDAR_DATE_PREFIX, panel_class=PANEL_CLASS):
+    """HTMLから {YYYYMMDD: [パネルテキスト, ...]} を取得"""
+    parser = CalendarHTMLParser(date_prefix, panel_class)
+    parser.feed(html)
+    parser.close()
+    return parser.panels
@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from metrics import CIRCUIT_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """接続先の障害が続いているため、アクセスせずに失敗させた"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """連続した失敗で遮断し、一定時間後に1件だけ試行して復旧を確認するサーキットブレーカー
+
+    遮断中は before_call() が即座に CircuitOpen を送出する。試行が失敗するたびに
+    遮断時間を倍にし（最大 max_reset_timeout 秒）、成功すれば元に戻す。
+    shared（site_state.SiteStateStore）を指定すると、同じ name の状態を同じホストの他のプロセスと共有する。
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60.0, max_reset_timeout=900.0, shared=None):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.max_reset_timeout = max(self.reset_timeout, float(max_reset_timeout))
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._timeout = self.reset_timeout
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._shared = shared
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _synced(self, write=True):
+        """状態を読み込んで操作し、書き戻す（共有しない場合はロックを取るだけ）"""
+        with self._lock:
+            if self._shared is None:
+                yield
+                return
+            with self._shared.transaction() as conn:
+                row = conn.execute(
+                    "SELECT state, failures, trips, timeout, opened_at, probe_started FROM breakers WHERE name = ?",
+                    (self.name,)).fetchone()
+                if row is not None:
+                    (self.state, self.failures, self.trips, self._timeout,
+                     self._opened_at, self._probe_started) = row
+                yield
+                if write:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO breakers "
+                        "(name, state, failures, trips, timeout, opened_at, probe_started) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (self.name, self.state, self.failures, self.trips, self._timeout,
+                         self._opened_at, self._probe_started))
+
+    def before_call(self):
+        """アクセス前に呼ぶ（遮断中ならCircuitOpen。復旧確認の試行は1件だけ通す）"""
+        error = None
+        with self._synced():
+            now = time.time()
+            if self.state == OPEN:
+                if now < self._opened_at + self._timeout:
+                    error = CircuitOpen(f"{self.name}への接続を一時停止しています", self._retry_after_locked(now))
+                else:
+                    self._transition_locked(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                # 試行が結果を返さずに終わった場合に備え、遮断時間が過ぎたら次の試行を許可
+                if self._probe_started is not None and now < self._probe_started + self._timeout:
+                    error = CircuitOpen(f"{self.name}の復旧を確認中です", self._probe_started + self._timeout - now)
+                else:
+                    self._probe_started = now
+        # 半開への切り替えは書き戻してから送出する
+        if error is not None:
+            raise error
+
+    def record_success(self):
+        with self._synced():
+            self.failures = 0
+            self._timeout = self.reset_timeout
+            self._probe_started = None
+            if self.state != CLOSED:
+                self._transition_locked(CLOSED)
+
+    def record_failure(self):
+        with self._synced():
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+                self._open_locked()
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self._open_locked()
+
+    def retry_after(self):
+        """遮断中なら再試行できるまでの秒数（遮断していなければ0）"""
+        with self._synced(write=False):
+            if self.state != OPEN:
+                return 0.0
+            return self._retry_after_locked(time.time())
+
+    def to_dict(self):
+        with self._synced(write=False):
+            return {'state': self.state, 'failures': self.failures, 'trips': self.trips,
+                    'retryAfter': round(self._retry_after_locked(time.time()), 1)
+                    if self.state == OPEN else 0}
+
+    def _retry_after_locked(self, now):
+        return max(0.0, self._opened_at + self._timeout - now)
+
+    def _open_locked(self):
+        self._opened_at = time.time()
+        self._probe_started = None
+        self.trips += 1
+        self._transition_locked(OPEN)
+        logger.warning(f"{self.name}への接続を{self._timeout:.0f}秒間停止します（連続失敗{self.failures}回）")
+
+    def _transition_locked(self, state):
+        if state == CLOSED and self.state != CLOSED:
+            logger.info(f"{self.name}への接続が復旧しました")
+        self.state = state
+        CIRCUIT_TRANSITIONS.inc(breaker=self.name, state=state)
@@ -0,0 +1,104 @@
+OPENED = 'opened'        # 満員 → 空きあり
+FILLED = 'filled'        # 空きあり → 満員
+THRESHOLD = 'threshold'  # 残り枠数が閾値以上になった
+ADDED = 'added'          # カレンダーにレッスンが追加された
+REMOVED = 'removed'      # カレンダーからレッスンが消えた
+
+EVENT_TYPES = (OPENED, FILLED, THRESHOLD, ADDED, REMOVED)
+
+
+class LessonEvent:
+    """スナップショット間で検出した1件の変化"""
+
+    __slots__ = ('type', 'lesson', 'previous', 'threshold')
+
+    def __init__(self, type, lesson, previous=None, threshold=None):
+        self.type = type
+        self.lesson = lesson
+        self.previous = previous
+        self.threshold = threshold
+
+    @property
+    def lesson_id(self):
+        return self.lesson.key
+
+    def to_dict(self):
+        return {
+            'type': self.type,
+            'lessonId': self.lesson.key,
+            'lesson': self.lesson.to_dict(),
+            'previousRemaining': self.previous.remaining if self.previous else None,
+            'threshold': self.threshold
+        }
+
+
+def diff_snapshots(previous, current, thresholds=()):
+    """2つのスナップショット（ID → Lesson）を1回の走査で比較してイベント一覧を返す"""
+    events = []
+    thresholds = sorted(set(thresholds))
+    matched = 0
+    for key, lesson in current.items():
+        prev = previous.get(key)
+        if prev is None:
+            events.append(LessonEvent(ADDED, lesson))
+            continue
+        matched += 1
+
+        before, after = prev.remaining, lesson.remaining
+        if before is None or after is None or before == after:
+            continue
+        if before == 0 and after > 0:
+            events.append(LessonEvent(OPENED, lesson, prev))
+        elif before > 0 and after == 0:
+            events.append(LessonEvent(FILLED, lesson, prev))
+        for threshold in thresholds:
+            if before < threshold <= after:
+                events.append(LessonEvent(THRESHOLD, lesson, prev, threshold))
+
+    if matched < len(previous):
+        for key, prev in previous.items():
+            if key not in current:
+                events.append(LessonEvent(REMOVED, prev, prev))
+    return events
+
+
+class WatchRule:
+    """監視ごとの通知条件（例: 残り枠が2以上になったら通知）"""
+
+    def __init__(self, min_remaining=1, events=None, notify_initial=True):
+        self.min_remaining = max(1, int(min_remaining))
+        self.events = set(events) if events else {THRESHOLD}
+        unknown = self.events - set(EVENT_TYPES)
+        if unknown:
+            raise ValueError(f"不明なイベント種別: {', '.join(sorted(unknown))}")
+        self.notify_initial = notify_initial
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(data.get('minRemaining', 1), data.get('events'), data.get('notifyInitial', True))
+
+    def to_dict(self):
+        return {
+            'minRemaining': self.min_remaining,
+            'events': sorted(self.events),
+            'notifyInitial': self.notify_initial
+        }
+
+    @property
+    def thresholds(self):
+        return (self.min_remaining,)
+
+    def is_available(self, lesson):
+        """残り枠が通知条件を満たしているか"""
+        return lesson.remaining is not None and lesson.remaining >= self.min_remaining
+
+    def matches(self, event):
+        """通知対象のイベントか"""
+        if event.type not in self.events:
+            return False
+        if event.type == THRESHOLD:
+            return event.threshold == self.min_remaining
+        if event.type == ADDED:
+            return self.is_available(event.lesson)
+        return True
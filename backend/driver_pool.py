@@ -0,0 +1,282 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from governor import GOVERNOR, BrowserLimitReached, cleanup_stale_profiles
+from metrics import SESSION_RESTORES
+from sites import get_site
+
+logger = logging.getLogger(__name__)
+
+
+class LoginError(Exception):
+    """ログイン失敗を表す例外"""
+
+
+class _PooledDriver:
+    """プール内の1ブラウザ分の管理情報"""
+
+    def __init__(self, key, user_id, site):
+        self.key = key
+        self.user_id = user_id
+        self.site = site
+        self.scraper = None
+        self.password = None
+        self.uses = 0
+        self.created_at = 0.0
+        self.last_used = time.time()
+        self.in_use = False
+
+
+class DriverPool:
+    """サイト・会員番号ごとにログイン済みブラウザ（またはHTTPセッション）を保持するプール"""
+
+    def __init__(self, factory=None, max_size=None, max_uses=None,
+                 max_memory_mb=None, idle_timeout=None, reap_interval=60, vault=None):
+        # factory(site) でスクレイパーを生成（既定はサイトのアダプターに任せる）
+        self.factory = factory or (lambda site: site.create_scraper())
+        self.vault = vault
+        # HTTPセッションも含めたエントリ数の上限。ブラウザを使うエントリは GOVERNOR の上限で抑え、
+        # 枠が埋まっていれば待機中のブラウザを終了して譲る（_reclaim_idle_browser）
+        self.max_size = max_size or int(os.getenv("DRIVER_POOL_MAX_SIZE", "4"))
+        self.max_uses = max_uses or int(os.getenv("DRIVER_POOL_MAX_USES", "50"))
+        self.max_memory_mb = max_memory_mb or float(os.getenv("DRIVER_POOL_MAX_MEMORY_MB", "600"))
+        self.idle_timeout = idle_timeout or int(os.getenv("DRIVER_POOL_IDLE_SECONDS", "900"))
+        self._entries = {}
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # 前回のプロセスが残したブラウザを終了してからプロファイルを掃除
+        GOVERNOR.kill_orphans()
+        cleanup_stale_profiles()
+
+        # ブラウザの枠が足りない時は、このプールで待機中のブラウザを終了して譲る
+        GOVERNOR.add_reclaimer(self._reclaim_idle_browser)
+
+        self._reaper = threading.Thread(target=self._reap_loop, args=(reap_interval,))
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    @contextmanager
+    def session(self, user_id, password, site=None):
+        """ログイン済みのスクレイパーを貸し出す（with文で使用。サイトごとの同時アクセス数・頻度の上限内で実行）
+
+        ログイン・取得の成否をサイトのサーキットブレーカーに記録し、失敗が続けば以降は即座に失敗させる。
+        """
+        site = site or get_site()
+        # サイトの枠を先に確保し、枠待ちの間はプールのエントリを占有しない
+        with site.slot():
+            entry = self._checkout(user_id, site)
+            healthy = False
+            try:
+                scraper = self._prepare(entry, user_id, password)
+                yield scraper
+                healthy = True
+            except (BrowserLimitReached, LoginError):
+                # このホストの混雑・会員のパスワード誤りであり、サイトの障害ではない
+                raise
+            except Exception:
+                site.breaker.record_failure()
+                raise
+            else:
+                site.breaker.record_success()
+            finally:
+                self._checkin(entry, healthy)
+
+    def _checkout(self, user_id, site):
+        """エントリを取得して使用中にする（空きが無ければ待機）"""
+        key = (site.site_id, user_id)
+        evicted = []
+        try:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("WebDriverプールは停止しています")
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        if not entry.in_use:
+                            entry.in_use = True
+                            return entry
+                    elif len(self._entries) < self.max_size or self._pop_lru_locked(evicted):
+                        entry = _PooledDriver(key, user_id, site)
+                        entry.in_use = True
+                        self._entries[key] = entry
+                        return entry
+                    self._cond.wait()
+        finally:
+            # ブラウザの終了は時間がかかることがあるため、ロックを外してから行う
+            self._destroy_all(evicted)
+
+    def _prepare(self, entry, user_id, password):
+        """ブラウザの健全性を確認し、必要ならば起動・再ログイン"""
+        if entry.scraper is not None and not entry.scraper.is_alive():
+            logger.warning(f"応答しないブラウザを破棄: {user_id}")
+            self._destroy(entry)
+
+        restored = False
+        if entry.scraper is None:
+            entry.scraper = self.factory(entry.site)
+            entry.created_at = time.time()
+            entry.uses = 0
+            entry.password = None
+            restored = self._restore_session(entry, user_id, password)
+
+        if entry.password != password:
+            # パスワード変更時は既存セッションを信用しない
+            entry.scraper.logged_in = False
+
+        # 復元直後はメニュー表示を確認済みなので確認を省略
+        if not restored:
+            logins = entry.scraper.logins
+            if not entry.scraper.ensure_logged_in(user_id, password):
+                if self.vault is not None:
+                    self.vault.discard(self._vault_key(entry))
+                raise LoginError("ログイン失敗")
+            if self.vault is not None and entry.scraper.logins != logins:
+                self.vault.save(self._vault_key(entry), password, entry.scraper.export_cookies())
+        entry.password = password
+        return entry.scraper
+
+    @staticmethod
+    def _vault_key(entry):
+        """保存済みセッションのキー（サイトごとに別の会員番号体系のため区別する）"""
+        return f"{entry.site.site_id}:{entry.user_id}"
+
+    def _restore_session(self, entry, user_id, password):
+        """保存済みのCookieでログインを省略（無効な場合はFalseを返し通常のログインへ）"""
+        if self.vault is None:
+            return False
+        cookies = self.vault.load(self._vault_key(entry), password)
+        if not cookies:
+            return False
+        try:
+            restored = entry.scraper.restore_session(cookies)
+        except Exception as e:
+            # ページを表示できない場合はセッションの有効・無効が分からないので保存済みのまま残す
+            logger.warning(f"保存済みセッションの復元に失敗: {user_id}: {e}")
+            SESSION_RESTORES.inc(result='error')
+            return False
+        SESSION_RESTORES.inc(result='restored' if restored else 'expired')
+        if not restored:
+            logger.info(f"保存済みセッションが期限切れ → ログイン: {user_id}")
+            self.vault.discard(self._vault_key(entry))
+            return False
+        logger.info(f"保存済みセッションでログインを省略: {user_id}")
+        entry.password = password
+        return True
+
+    def _checkin(self, entry, healthy):
+        """使用後のエントリを返却し、必要に応じてリサイクル"""
+        entry.uses += 1
+        entry.last_used = time.time()
+
+        recycle = not healthy or entry.uses >= self.max_uses
+        if not recycle and entry.scraper is not None:
+            memory_mb = entry.scraper.memory_usage_mb()
+            if memory_mb > self.max_memory_mb:
+                logger.info(f"メモリ上限超過のためブラウザを再起動: {entry.user_id} ({memory_mb:.0f}MB)")
+                recycle = True
+        if recycle:
+            self._destroy(entry)
+
+        with self._cond:
+            entry.in_use = False
+            closed = self._closed
+            self._cond.notify_all()
+        if closed:
+            self._destroy(entry)
+
+    def _destroy(self, entry):
+        """エントリのブラウザを終了"""
+        if entry.scraper is not None:
+            entry.scraper.quit()
+            entry.scraper = None
+            entry.password = None
+
+    def _destroy_all(self, entries):
+        for entry in entries:
+            self._destroy(entry)
+
+    def _pop_lru_locked(self, evicted):
+        """最も長く使われていない未使用エントリを1件プールから外して evicted に追加（ロック取得済み前提）
+
+        ブラウザの終了は呼び出し元がロックを外してから行う。
+        """
+        idle = [e for e in self._entries.values() if not e.in_use]
+        if not idle:
+            return False
+        victim = min(idle, key=lambda e: e.last_used)
+        del self._entries[victim.key]
+        evicted.append(victim)
+        return True
+
+    def _reclaim_idle_browser(self):
+        """最も長く使われていない待機中のブラウザを1つ終了（ブラウザの枠が足りない時にGOVERNORから呼ばれる）"""
+        with self._cond:
+            # HTTPセッション（プロセスIDなし）はブラウザの枠を使わないので対象外
+            idle = [e for e in self._entries.values()
+                    if not e.in_use and e.scraper is not None and getattr(e.scraper, 'pid', None) is not None]
+            if self._closed or not idle:
+                return False
+            victim = min(idle, key=lambda e: e.last_used)
+            del self._entries[victim.key]
+            self._cond.notify_all()
+        self._destroy(victim)
+        logger.info(f"ブラウザの枠を空けるため待機中のブラウザを終了: {victim.user_id}")
+        return True
+
+    def _reap_loop(self, interval):
+        """アイドル状態が続いたブラウザを定期的に終了"""
+        while not self._closed:
+            time.sleep(interval)
+            now = time.time()
+            with self._cond:
+                expired = [e for e in self._entries.values()
+                           if not e.in_use and now - e.last_used > self.idle_timeout]
+                for entry in expired:
+                    del self._entries[entry.key]
+                if expired:
+                    self._cond.notify_all()
+            if expired:
+                self._destroy_all(expired)
+                logger.info(f"アイドルブラウザを終了: {len(expired)}件")
+            GOVERNOR.kill_orphans()
+            cleanup_stale_profiles()
+
+    def discard(self, user_id, site_id=None):
+        """指定会員のブラウザを破棄"""
+        key = (get_site(site_id).site_id, user_id)
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is None or entry.in_use:
+                return
+            del self._entries[key]
+            self._cond.notify_all()
+        self._destroy(entry)
+
+    def stats(self):
+        """プールの状態を取得"""
+        with self._cond:
+            return {
+                'size': len(self._entries),
+                'in_use': sum(1 for e in self._entries.values() if e.in_use),
+                'max_size': self.max_size,
+                'drivers': [
+                    {'site': e.site.site_id, 'user_id': e.user_id, 'uses': e.uses, 'in_use': e.in_use,
+                     'alive': e.scraper is not None}
+                    for e in self._entries.values()
+                ]
+            }
+
+    def shutdown(self):
+        """全ブラウザを終了"""
+        with self._cond:
+            self._closed = True
+            # 使用中のエントリは返却時に終了する
+            idle = [e for e in self._entries.values() if not e.in_use]
+            self._entries.clear()
+            self._cond.notify_all()
+        GOVERNOR.remove_reclaimer(self._reclaim_idle_browser)
+        self._destroy_all(idle)
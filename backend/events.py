@@ -0,0 +1,114 @@
+from collections import deque
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+
+
+def format_sse(type, data, event_id=None):
+    """Server-Sent Events形式の文字列"""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class MonitorEvent:
+    """ブラウザへ配信する1件のイベント"""
+
+    __slots__ = ('id', 'type', 'job_id', 'user_id', 'data', 'created_at')
+
+    def __init__(self, id, type, job_id, user_id, data):
+        self.id = id
+        self.type = type
+        self.job_id = job_id
+        self.user_id = user_id
+        self.data = data
+        self.created_at = time.time()
+
+    def to_sse(self):
+        payload = dict(self.data, jobId=self.job_id) if self.job_id else self.data
+        return format_sse(self.type, payload, self.id)
+
+
+class Subscription:
+    """1接続分の購読（ジョブID・会員番号で絞り込み）"""
+
+    def __init__(self, job_id=None, user_id=None, queue_size=100):
+        self.job_id = job_id
+        self.user_id = user_id
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def accepts(self, event):
+        if self.job_id and event.job_id != self.job_id:
+            return False
+        if self.user_id and event.user_id != self.user_id:
+            return False
+        return True
+
+    def put(self, event):
+        """読み出しが追いつかない接続は古いイベントから捨てる（配信側を待たせない）"""
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        """次のイベント（timeout秒以内に無ければNone）"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    """監視ジョブのイベントを購読中の全接続へ配信する"""
+
+    def __init__(self, history_size=None, queue_size=None):
+        self.queue_size = queue_size or int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+        self._history = deque(maxlen=history_size or int(os.getenv("EVENT_HISTORY_SIZE", "200")))
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def publish(self, type, data, job_id=None, user_id=None, event_id=None):
+        """イベントを発行（event_id省略時はこのプロセス内で採番）"""
+        with self._lock:
+            event = MonitorEvent(event_id or next(self._ids), type, job_id, user_id, data)
+            self._history.append(event)
+            self.published += 1
+            subscribers = [s for s in self._subscribers if s.accepts(event)]
+        for subscription in subscribers:
+            subscription.put(event)
+        return event
+
+    def subscribe(self, job_id=None, user_id=None, last_event_id=None):
+        """購読を開始（Last-Event-ID以降の取りこぼしたイベントは再送）"""
+        subscription = Subscription(job_id, user_id, self.queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._history:
+                    if event.id > last_event_id and subscription.accepts(event):
+                        subscription.put(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'dropped': sum(s.dropped for s in self._subscribers)
+            }
@@ -0,0 +1,304 @@
+import glob
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+from leader import LeaderLock
+from metrics import BROWSER_KILLS
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR_PREFIX = "chrome_profile_"
+
+
+class BrowserLimitReached(Exception):
+    """同時に起動できるブラウザ数の上限に達し、空きを待ちきれなかった"""
+
+
+def _read_proc_stats():
+    """/proc から PID → (親PID, コマンド名) の対応表を作成"""
+    stats = {}
+    for stat_path in glob.glob('/proc/[0-9]*/stat'):
+        try:
+            with open(stat_path, 'r') as f:
+                stat = f.read()
+            # comm にスペースや括弧が含まれる場合に備えて最後の ')' 以降を解析
+            fields = stat[stat.rfind(')') + 2:].split()
+            comm = stat[stat.find('(') + 1:stat.rfind(')')]
+            stats[int(stat_path.split('/')[2])] = (int(fields[1]), comm)
+        except (OSError, ValueError, IndexError):
+            continue
+    return stats
+
+
+def _read_proc_children():
+    """/proc から 親PID → 子PIDリスト の対応表を作成"""
+    children = {}
+    for pid, (ppid, _) in _read_proc_stats().items():
+        children.setdefault(ppid, []).append(pid)
+    return children
+
+
+def _read_cmdline(pid):
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            return f.read().decode('utf-8', 'ignore').split('\0')
+    except OSError:
+        return []
+
+
+def process_tree_pids(root_pid):
+    """指定PIDとその子孫プロセスのPID一覧を取得（Linuxのみ）"""
+    children = _read_proc_children()
+    pids = []
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def count_browser_processes(root_pid):
+    """指定PIDの子孫のうちChrome・ChromeDriverのプロセス数（Linuxのみ）"""
+    count = 0
+    for pid in process_tree_pids(root_pid)[1:]:
+        try:
+            with open(f'/proc/{pid}/comm', 'r') as f:
+                if 'chrom' in f.read():
+                    count += 1
+        except OSError:
+            continue
+    return count
+
+
+def process_tree_rss_mb(root_pid):
+    """指定PIDとその子孫プロセスの合計RSS(MB)を取得（Linuxのみ）"""
+    total_kb = 0
+    for pid in process_tree_pids(root_pid):
+        try:
+            with open(f'/proc/{pid}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024
+
+
+def kill_process_tree(root_pid, grace=3.0):
+    """指定PIDと子孫プロセスを終了（SIGTERMで終わらなければSIGKILL）"""
+    pids = [pid for pid in process_tree_pids(root_pid) if pid != os.getpid()]
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    deadline = time.time() + grace
+    alive = pids
+    while alive and time.time() < deadline:
+        time.sleep(0.1)
+        alive = [pid for pid in alive if os.path.exists(f'/proc/{pid}')]
+    for pid in alive:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    return len(pids)
+
+
+def find_orphan_browsers(exclude=()):
+    """親プロセスが終了して取り残されたChromeDriver・Chromeの最上位PID一覧
+
+    親がinit（PID 1）に付け替えられたもののうち、chromedriverと
+    このアプリの一時プロファイルを使うChromeだけを対象にする。
+    このプロセス自身がPID 1の場合は自分の子と区別できないため何もしない。
+    """
+    if os.getpid() == 1:
+        return []
+    profile_prefix = os.path.join(tempfile.gettempdir(), PROFILE_DIR_PREFIX)
+    orphans = []
+    for pid, (ppid, comm) in _read_proc_stats().items():
+        if ppid != 1 or pid in exclude:
+            continue
+        if comm == 'chromedriver':
+            orphans.append(pid)
+        elif 'chrom' in comm and any(arg.startswith(f'--user-data-dir={profile_prefix}')
+                                     for arg in _read_cmdline(pid)):
+            orphans.append(pid)
+    return orphans
+
+
+def kill_orphan_browsers(exclude=()):
+    """取り残されたブラウザプロセスを終了（終了させたプロセス数を返す）"""
+    if not os.path.isdir('/proc'):
+        return 0
+    killed = sum(kill_process_tree(pid, grace=1.0) for pid in find_orphan_browsers(exclude))
+    if killed:
+        BROWSER_KILLS.inc(killed, reason='orphan')
+        logger.warning(f"取り残されたブラウザプロセスを終了しました: {killed}件")
+    return killed
+
+
+def cleanup_stale_profiles():
+    """どのChromeプロセスからも参照されていない一時プロファイルを削除"""
+    pattern = os.path.join(tempfile.gettempdir(), f'{PROFILE_DIR_PREFIX}*')
+    candidates = glob.glob(pattern)
+    if not candidates:
+        return 0
+
+    in_use = set()
+    if os.path.isdir('/proc'):
+        for pid in _read_proc_stats():
+            for arg in _read_cmdline(pid):
+                if arg.startswith('--user-data-dir='):
+                    in_use.add(os.path.normpath(arg.split('=', 1)[1]))
+    else:
+        # /proc が無い環境では1時間以上更新のないものだけを対象にする
+        threshold = time.time() - 3600
+        in_use = {os.path.normpath(p) for p in candidates if os.path.getmtime(p) >= threshold}
+
+    removed = 0
+    for path in candidates:
+        if os.path.normpath(path) in in_use:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+
+    if removed:
+        logger.info(f"未使用のChromeプロファイルを削除しました: {removed}件")
+    return removed
+
+
+class BrowserGovernor:
+    """ホスト全体のChrome同時起動数・1ブラウザあたりのメモリ上限・孤立プロセスを管理する
+
+    同時起動数はロックファイル（プロセス終了時にOSが解放）で数えるため、
+    gunicornの複数ワーカーと監視プロセスをまたいで上限が効く。
+    """
+
+    def __init__(self, max_browsers=None, max_memory_mb=None, check_interval=None,
+                 acquire_timeout=None, lock_dir=None):
+        self.max_browsers = max_browsers or int(os.getenv("GOVERNOR_MAX_BROWSERS", "3"))
+        self.max_memory_mb = max_memory_mb or float(os.getenv("GOVERNOR_BROWSER_MAX_MEMORY_MB", "800"))
+        self.check_interval = check_interval or float(os.getenv("GOVERNOR_CHECK_SECONDS", "15"))
+        self.acquire_timeout = acquire_timeout or float(os.getenv("GOVERNOR_ACQUIRE_TIMEOUT", "120"))
+        self.lock_dir = lock_dir or os.getenv("GOVERNOR_LOCK_DIR", tempfile.gettempdir())
+        self._local = threading.BoundedSemaphore(self.max_browsers)
+        self._browsers = {}  # id(スクレイパー) → (スクレイパー, ロック)
+        self._reclaimers = []
+        self._lock = threading.Lock()
+        self._watcher = None
+        self.killed = 0
+
+    def add_reclaimer(self, reclaim):
+        """枠が足りない時に呼ぶ関数を登録（待機中のブラウザを1つ終了できたらTrueを返す。例: プールのアイドルブラウザ）"""
+        with self._lock:
+            self._reclaimers.append(reclaim)
+
+    def remove_reclaimer(self, reclaim):
+        """登録済みの関数を解除（停止したプールを呼び出さないようにする）"""
+        with self._lock:
+            if reclaim in self._reclaimers:
+                self._reclaimers.remove(reclaim)
+
+    def _reclaim(self):
+        with self._lock:
+            reclaimers = list(self._reclaimers)
+        for reclaim in reclaimers:
+            try:
+                if reclaim():
+                    return True
+            except Exception as e:
+                logger.warning(f"待機中のブラウザの終了に失敗: {e}")
+        return False
+
+    def acquire(self, owner):
+        """ブラウザ1つ分の枠を確保して枠番号を返す（空きが出るまで待ち、待ちきれなければBrowserLimitReached）
+
+        枠が埋まっている間は、登録済みの関数で使われていないブラウザを終了して枠を空ける。
+        """
+        deadline = time.time() + self.acquire_timeout
+        while not self._local.acquire(blocking=False):
+            if self._reclaim():
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise BrowserLimitReached(f"ブラウザの同時起動数が上限({self.max_browsers})に達しています")
+            if self._local.acquire(timeout=min(1.0, remaining)):
+                break
+        try:
+            while True:
+                for i in range(self.max_browsers):
+                    slot = LeaderLock(os.path.join(self.lock_dir, f'lesson_monitor_browser_{i}.lock'))
+                    if slot.acquire():
+                        with self._lock:
+                            self._browsers[id(owner)] = (owner, slot)
+                        self._start_watcher()
+                        return i
+                if time.time() >= deadline:
+                    raise BrowserLimitReached(
+                        f"ブラウザの同時起動数が上限({self.max_browsers})に達しています（他プロセス使用中）")
+                # 他プロセスに枠を取られている場合も、このプロセスの待機中のブラウザがあれば譲る
+                if not self._reclaim():
+                    time.sleep(0.2)
+        except Exception:
+            self._local.release()
+            raise
+
+    def release(self, owner):
+        """ブラウザの枠を返却"""
+        with self._lock:
+            entry = self._browsers.pop(id(owner), None)
+        if entry is None:
+            return
+        entry[1].release()
+        self._local.release()
+
+    def stats(self):
+        with self._lock:
+            return {'browsers': len(self._browsers), 'maxBrowsers': self.max_browsers,
+                    'maxMemoryMb': self.max_memory_mb, 'killed': self.killed}
+
+    def enforce(self):
+        """メモリ上限を超えたブラウザと取り残されたプロセスを終了"""
+        with self._lock:
+            owners = [owner for owner, _ in self._browsers.values()]
+        for owner in owners:
+            memory_mb = owner.memory_usage_mb()
+            if memory_mb > self.max_memory_mb:
+                logger.warning(f"ブラウザのメモリ上限超過のため強制終了: {memory_mb:.0f}MB > {self.max_memory_mb:.0f}MB")
+                owner.kill()
+                self.killed += 1
+                BROWSER_KILLS.inc(reason='memory')
+        self.kill_orphans()
+
+    def kill_orphans(self):
+        """このプロセスが管理中のブラウザを除き、取り残されたブラウザプロセスを終了"""
+        with self._lock:
+            own = {getattr(owner, 'pid', None) for owner, _ in self._browsers.values()}
+        return kill_orphan_browsers(own)
+
+    def _start_watcher(self):
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch_loop, name='browser-governor')
+            self._watcher.daemon = True
+            self._watcher.start()
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"ブラウザの監視に失敗: {e}")
+
+
+GOVERNOR = BrowserGovernor()
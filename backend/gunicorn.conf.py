@@ -0,0 +1,20 @@
+# gunicorn設定（環境変数で上書き可）
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+
+# SSE接続が1スレッドを占有するため、スレッドワーカーで多めに確保
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+# ブラウザ起動・ログインを含むレッスン取得はバックグラウンドで行うが、長めに設定
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# スケジューラー等のスレッドはワーカーごとに起動するため、fork前に読み込まない
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
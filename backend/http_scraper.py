@@ -0,0 +1,330 @@
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+import logging
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from sites import get_site
+from lessons import parse_panel_text
+from metrics import StepTimer
+
+logger = logging.getLogger(__name__)
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_SCRAPER_TIMEOUT", "10"))
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36")
+
+
+class HttpFlowError(Exception):
+    """HTTPだけではページ遷移を再現できないことを表す例外（Seleniumへ切り替える）"""
+
+
+class _PageParser(HTMLParser):
+    """ログインフォームとid付き要素の属性を収集"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.forms = []
+        self.elements = {}
+        self._form = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if attrs.get('id'):
+            self.elements[attrs['id']] = (tag, attrs)
+        if tag == 'form':
+            self._form = {'action': attrs.get('action') or '',
+                          'method': (attrs.get('method') or 'get').lower(),
+                          'inputs': []}
+            self.forms.append(self._form)
+        elif tag in ('input', 'button', 'select', 'textarea') and self._form is not None:
+            self._form['inputs'].append(attrs)
+
+    def handle_endtag(self, tag):
+        if tag == 'form':
+            self._form = None
+
+
+def _parse_page(html):
+    parser = _PageParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+def create_http_session():
+    """接続プール・リトライ付きのrequests.Sessionを作成"""
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                  allowed_methods=frozenset(['GET']))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'User-Agent': USER_AGENT, 'Accept-Language': 'ja-JP,ja;q=0.9'})
+    return session
+
+
+class HttpGunzeScraper:
+    """ブラウザを使わずHTTPだけでカレンダーを取得するスクレイパー"""
+
+    def __init__(self, site=None):
+        self.site = site or get_site()
+        self.session = create_http_session()
+        self.logged_in = False
+        self.menu_url = None
+        self.menu_html = None
+        self.last_timings = {}
+        self.logins = 0  # ログインフォームを送信して成功した回数
+
+    def _get(self, url):
+        response = self.session.get(url, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return response
+
+    def login(self, username, password):
+        """ログインフォームをHTTPで送信（フォームが見つからなければHttpFlowError）"""
+        self.logged_in = False
+        timer = StepTimer('http')
+        with timer.step('login_page'):
+            response = self._get(self.site.mypage_url)
+        page = _parse_page(response.text)
+
+        site = self.site
+        form = next((f for f in page.forms
+                     if any(i.get('name') == site.user_field for i in f['inputs'])), None)
+        if form is None:
+            raise HttpFlowError("ログインフォームが見つかりません")
+
+        data = {}
+        for field in form['inputs']:
+            name = field.get('name')
+            if not name:
+                continue
+            if name == site.user_field:
+                data[name] = username
+            elif name == site.password_field:
+                data[name] = password
+            elif field.get('id') == site.login_button_id or field.get('type') not in ('submit', 'button', 'image'):
+                data[name] = field.get('value', '')
+
+        action = urljoin(response.url, form['action'])
+        with timer.step('submit'):
+            if form['method'] == 'post':
+                response = self.session.post(action, data=data, timeout=HTTP_TIMEOUT)
+            else:
+                response = self.session.get(action, params=data, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+
+        result = _parse_page(response.text)
+        if site.menu_anchor_id not in result.elements:
+            if any(i.get('name') == site.user_field for f in result.forms for i in f['inputs']):
+                logger.error(f"ログイン失敗(HTTP): {username}")
+                return False
+            raise HttpFlowError("ログイン後のページを解釈できません")
+
+        self.menu_url = response.url
+        self.menu_html = response.text
+        self.logged_in = True
+        self.logins += 1
+        self.last_timings = timer.as_dict()
+        logger.info(f"ログイン成功(HTTP): {username} ({timer.summary()})",
+                    extra={'fields': {'timings': timer.as_dict()}})
+        return True
+
+    def is_alive(self):
+        """HTTPセッションは常に利用可能"""
+        return True
+
+    def ensure_logged_in(self, username, password):
+        """セッションが有効ならそのまま使い、期限切れの場合のみ再ログイン"""
+        if self.logged_in:
+            response = self._get(self.menu_url or self.site.mypage_url)
+            if self.site.menu_anchor_id in _parse_page(response.text).elements:
+                self.menu_url = response.url
+                self.menu_html = response.text
+                return True
+            logger.info(f"セッション期限切れ(HTTP) → 再ログイン: {username}")
+        return self.login(username, password)
+
+    def export_cookies(self):
+        """ログイン済みセッションのCookie（Selenium版と共通の形式）"""
+        return [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+                 'secure': bool(c.secure), 'expiry': c.expires}
+                for c in self.session.cookies]
+
+    def restore_session(self, cookies):
+        """保存済みのCookieでログイン済み状態を復元（メニューが表示されればTrue）"""
+        for cookie in cookies:
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain') or '',
+                                     path=cookie.get('path') or '/', secure=cookie.get('secure', False),
+                                     expires=cookie.get('expiry'))
+        timer = StepTimer('http')
+        with timer.step('restore_session'):
+            response = self._get(self.site.mypage_url)
+        if self.site.menu_anchor_id not in _parse_page(response.text).elements:
+            self.session.cookies.clear()
+            return False
+        self.menu_url = response.url
+        self.menu_html = response.text
+        self.logged_in = True
+        self.last_timings = timer.as_dict()
+        return True
+
+    def memory_usage_mb(self):
+        """外部プロセスを持たないため0"""
+        return 0.0
+
+    def _follow_anchor(self, base_url, html, element_id):
+        """id指定のリンク先を取得（JavaScript遷移の場合はHttpFlowError）"""
+        element = _parse_page(html).elements.get(element_id)
+        href = element[1].get('href') if element else None
+        if not href or href.startswith('javascript:') or href == '#':
+            raise HttpFlowError(f"{element_id} のリンク先を解決できません")
+        return self._get(urljoin(base_url, href))
+
+    def go_to_program_page_and_scrape(self, date_str):
+        """指定日のレッスン情報を取得（Selenium版と同じ戻り値）"""
+        return self.go_to_program_page_and_scrape_dates([date_str]).get(date_str, [])
+
+    def go_to_program_page_and_scrape_dates(self, date_strs=None):
+        """1回のページ取得で複数日のレッスン情報を取得（None指定で表示中の全日付）"""
+        if not self.logged_in:
+            raise Exception("ログインが必要です")
+
+        timer = StepTimer('http')
+        with timer.step('personal_menu'):
+            personal = self._follow_anchor(self.menu_url, self.menu_html, self.site.menu_anchor_id)
+        with timer.step('program_page'):
+            program = self._follow_anchor(personal.url, personal.text, self.site.program_anchor_id)
+        logger.info("プログラムページに到達(HTTP) → スクレイピング準備完了")
+
+        with timer.step('extract'):
+            results = self._extract_calendar(program.text, date_strs)
+        self.last_timings = timer.as_dict()
+        logger.info(f"取得時間(HTTP): {timer.summary()}",
+                    extra={'fields': {'timings': timer.as_dict()}})
+        return results
+
+    def _extract_calendar(self, html, date_strs):
+        """プログラムページのHTMLから日付ごとのレッスン一覧を抽出"""
+        panels = self.site.extract_panel_texts(html)
+        if not panels:
+            raise HttpFlowError("カレンダー要素が見つかりません")
+
+        results = {}
+        for date_str, texts in panels.items():
+            if date_strs and date_str not in date_strs:
+                continue
+            logger.info(f"指定日({date_str})のパネル数: {len(texts)}")
+            lessons = []
+            for text in texts:
+                lesson = parse_panel_text(text, date_str)
+                if lesson:
+                    lessons.append(lesson)
+
+            for lesson in lessons:
+                logger.debug(f"{lesson.date} {lesson.time} {lesson.name}")
+            results[date_str] = lessons
+
+        return results
+
+    def quit(self):
+        """HTTPセッションを閉じる"""
+        self.session.close()
+
+
+class FallbackScraper:
+    """HTTP版を優先し、HTTPで再現できない場合のみSelenium版へ切り替えるスクレイパー"""
+
+    def __init__(self, site=None):
+        self.site = site or get_site()
+        self.active = HttpGunzeScraper(self.site)
+        self.using_selenium = False
+        self._credentials = None
+        self._retired_logins = 0
+
+    @property
+    def logged_in(self):
+        return self.active.logged_in
+
+    @logged_in.setter
+    def logged_in(self, value):
+        self.active.logged_in = value
+
+    @property
+    def logins(self):
+        return self._retired_logins + self.active.logins
+
+    def _switch_to_selenium(self, reason):
+        """Selenium版へ切り替え（以後このセッションはSeleniumを使い続ける）"""
+        logger.warning(f"HTTPスクレイピング失敗 → Seleniumへ切り替え: {reason}")
+        from scraper import SeleniumGunzeScraper
+        self._retired_logins += self.active.logins
+        self.active.quit()
+        self.active = SeleniumGunzeScraper(self.site)
+        self.using_selenium = True
+
+    def _call(self, method, *args):
+        if self.using_selenium:
+            return getattr(self.active, method)(*args)
+        try:
+            return getattr(self.active, method)(*args)
+        # 画面構成がHTTPで再現できない場合のみ切り替える。接続エラー・タイムアウトはサイト側の障害なので
+        # ブラウザを起動せずにそのまま失敗させる（サーキットブレーカーに記録される）
+        except HttpFlowError as e:
+            self._switch_to_selenium(e)
+            if method.startswith('go_to_program_page_and_scrape'):
+                if not self._credentials or not self.active.login(*self._credentials):
+                    return [] if method == 'go_to_program_page_and_scrape' else {}
+            return getattr(self.active, method)(*args)
+
+    def login(self, username, password):
+        self._credentials = (username, password)
+        return self._call('login', username, password)
+
+    def ensure_logged_in(self, username, password):
+        self._credentials = (username, password)
+        return self._call('ensure_logged_in', username, password)
+
+    def go_to_program_page_and_scrape(self, date_str):
+        return self._call('go_to_program_page_and_scrape', date_str)
+
+    def go_to_program_page_and_scrape_dates(self, date_strs=None):
+        return self._call('go_to_program_page_and_scrape_dates', date_strs)
+
+    def export_cookies(self):
+        return self.active.export_cookies()
+
+    def restore_session(self, cookies):
+        return self._call('restore_session', cookies)
+
+    @property
+    def pid(self):
+        """Selenium版へ切り替えた後のChromeDriverのプロセスID（HTTP版ではNone）"""
+        return getattr(self.active, 'pid', None)
+
+    def is_alive(self):
+        return self.active.is_alive()
+
+    def memory_usage_mb(self):
+        return self.active.memory_usage_mb()
+
+    def quit(self):
+        self.active.quit()
+
+
+SCRAPER_BACKENDS = ('auto', 'http', 'selenium')
+
+
+def create_scraper(backend=None, site=None):
+    """環境変数 SCRAPER_BACKEND (auto/http/selenium) に応じたスクレイパーを生成"""
+    backend = backend or os.getenv("SCRAPER_BACKEND", "auto")
+    if backend == 'selenium':
+        from scraper import SeleniumGunzeScraper
+        return SeleniumGunzeScraper(site)
+    if backend == 'http':
+        return HttpGunzeScraper(site)
+    return FallbackScraper(site)
@@ -0,0 +1,291 @@
+from abc import ABC, abstractmethod
+import importlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    grp TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker_id TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    error_type TEXT,
+    error_details TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, created_at);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    info TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+
+class TaskFailed(Exception):
+    """ワーカーがタスクの実行に失敗した（error_type は元の例外のクラス名）"""
+
+    def __init__(self, message, error_type=None, details=None):
+        super().__init__(message)
+        self.error_type = error_type
+        self.details = details or {}
+
+
+class TaskTimeout(Exception):
+    """待ち時間内にタスクの結果が返らなかった"""
+
+
+class JobQueue(ABC):
+    """取得タスクのキュー（依頼側が put / wait、ワーカーが lease / complete / fail）
+
+    ワーカーは借り受けたタスクの期限を extend で延長し続ける。期限が切れたタスク
+    （ワーカーの異常終了）は別のワーカーが借り受け直す。別のバックエンドはこのクラスを
+    継承して実装し、JOB_QUEUE_BACKEND=モジュール:クラス で指定する。
+    """
+
+    @abstractmethod
+    def put(self, kind, payload, group=None):
+        """タスクを追加してIDを返す（group ごとに同時実行数を制限できる）"""
+
+    @abstractmethod
+    def lease(self, worker_id, kinds, lease_seconds, group_limits=None):
+        """実行待ちのタスクを1件借り受ける（(タスクID, 種類, 内容) または None）"""
+
+    @abstractmethod
+    def extend(self, task_id, worker_id, lease_seconds):
+        """借り受け中のタスクの期限を延長（既に他のワーカーへ移っていればFalse）"""
+
+    @abstractmethod
+    def complete(self, task_id, worker_id, result):
+        """タスクの結果を書き込んで完了にする（借り受けが他のワーカーへ移っていればFalse）"""
+
+    @abstractmethod
+    def fail(self, task_id, worker_id, error, error_type=None, details=None):
+        """タスクを失敗にする（借り受けが他のワーカーへ移っていればFalse）"""
+
+    @abstractmethod
+    def result(self, task_id):
+        """完了していれば結果を返し、失敗していればTaskFailed、未完了ならNone"""
+
+    @abstractmethod
+    def cancel(self, task_id):
+        """結果を待たなくなったタスクを取り消す"""
+
+    @abstractmethod
+    def heartbeat_worker(self, worker_id, info):
+        """ワーカーの生存と状況を記録（初回は登録）"""
+
+    @abstractmethod
+    def remove_worker(self, worker_id):
+        """ワーカーの登録を削除"""
+
+    @abstractmethod
+    def workers(self, max_age):
+        """max_age秒以内に生存確認できたワーカーの一覧"""
+
+    @abstractmethod
+    def stats(self):
+        """状態ごとのタスク数"""
+
+    @abstractmethod
+    def prune(self, max_age):
+        """終了から max_age 秒以上経ったタスク・誰にも借り受けられないまま古くなったタスクを削除"""
+
+    def wait(self, task_id, timeout, poll_interval=0.2):
+        """タスクの結果を待つ（timeout秒を過ぎたらTaskTimeout）"""
+        deadline = time.time() + timeout
+        while True:
+            result = self.result(task_id)
+            if result is not None:
+                return result
+            if time.time() >= deadline:
+                raise TaskTimeout(f"タスクの結果が{timeout:.0f}秒以内に返りませんでした: {task_id}")
+            time.sleep(poll_interval)
+
+
+class SqliteJobQueue(JobQueue):
+    """1台のホスト内で使うSQLiteのキュー（API・監視プロセスとワーカーが同じファイルを共有）"""
+
+    def __init__(self, path=None, max_attempts=None):
+        self.path = path or os.getenv("JOB_QUEUE_PATH", "job_queue.db")
+        self.max_attempts = max_attempts or int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+        self._local = threading.local()
+        created = not os.path.exists(self.path)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        if created:
+            # 依頼内容にパスワードを含むため所有者のみ読み書き可能にする
+            try:
+                os.chmod(self.path, 0o600)
+            except OSError:
+                pass
+
+    def _conn(self):
+        """スレッドごとの接続（WALモード、トランザクションは明示的に開始）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, sql, params=()):
+        return self._conn().execute(sql, params)
+
+    def put(self, kind, payload, group=None):
+        task_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO tasks (task_id, kind, grp, payload, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task_id, kind, group, json.dumps(payload, ensure_ascii=False), QUEUED, now, now)
+        )
+        return task_id
+
+    def lease(self, worker_id, kinds, lease_seconds, group_limits=None):
+        conn = self._conn()
+        now = time.time()
+        placeholders = ','.join('?' * len(kinds))
+        # 複数のワーカーが同じタスクを借りないよう、書き込みロックを取ってから選ぶ
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            running = {row['grp']: row['n'] for row in conn.execute(
+                "SELECT grp, COUNT(*) AS n FROM tasks WHERE status = ? AND lease_until >= ? GROUP BY grp",
+                (LEASED, now))}
+            candidates = conn.execute(
+                f"SELECT task_id, kind, grp, payload, status, attempts FROM tasks "
+                f"WHERE kind IN ({placeholders}) AND (status = ? OR (status = ? AND lease_until < ?)) "
+                f"ORDER BY created_at LIMIT 100",
+                (*kinds, QUEUED, LEASED, now)).fetchall()
+            for row in candidates:
+                if row['status'] == LEASED and row['attempts'] >= self.max_attempts:
+                    # 借り受けたワーカーが何度も応答しなくなったタスクは失敗として終える
+                    conn.execute(
+                        "UPDATE tasks SET status = ?, payload = '{}', error = ?, error_type = ?, updated_at = ? "
+                        "WHERE task_id = ?",
+                        (FAILED, "ワーカーが応答しなくなりました", 'WorkerLost', now, row['task_id']))
+                    continue
+                limit = (group_limits or {}).get(row['grp'])
+                if limit is not None and running.get(row['grp'], 0) >= limit:
+                    continue
+                if row['status'] == LEASED:
+                    logger.warning(f"期限切れのタスクを借り受け直します: {row['task_id']}")
+                conn.execute(
+                    "UPDATE tasks SET status = ?, worker_id = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE task_id = ?",
+                    (LEASED, worker_id, now + lease_seconds, now, row['task_id']))
+                conn.execute("COMMIT")
+                return row['task_id'], row['kind'], json.loads(row['payload'])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return None
+
+    def extend(self, task_id, worker_id, lease_seconds):
+        cursor = self._execute(
+            "UPDATE tasks SET lease_until = ?, updated_at = ? WHERE task_id = ? AND worker_id = ? AND status = ?",
+            (time.time() + lease_seconds, time.time(), task_id, worker_id, LEASED))
+        return cursor.rowcount > 0
+
+    def complete(self, task_id, worker_id, result):
+        # 結果を書いた時点でパスワードを含む依頼内容は消す
+        cursor = self._execute(
+            "UPDATE tasks SET status = ?, result = ?, payload = '{}', updated_at = ? "
+            "WHERE task_id = ? AND worker_id = ? AND status = ?",
+            (DONE, json.dumps(result, ensure_ascii=False), time.time(), task_id, worker_id, LEASED))
+        return cursor.rowcount > 0
+
+    def fail(self, task_id, worker_id, error, error_type=None, details=None):
+        cursor = self._execute(
+            "UPDATE tasks SET status = ?, error = ?, error_type = ?, error_details = ?, payload = '{}', "
+            "updated_at = ? WHERE task_id = ? AND worker_id = ? AND status = ?",
+            (FAILED, error, error_type, json.dumps(details or {}), time.time(), task_id, worker_id, LEASED))
+        return cursor.rowcount > 0
+
+    def result(self, task_id):
+        row = self._execute(
+            "SELECT status, result, error, error_type, error_details FROM tasks WHERE task_id = ?",
+            (task_id,)).fetchone()
+        if row is None:
+            raise TaskFailed(f"タスクが見つかりません: {task_id}", 'TaskNotFound')
+        if row['status'] == DONE:
+            return json.loads(row['result'])
+        if row['status'] == FAILED:
+            raise TaskFailed(row['error'] or "タスクの実行に失敗しました", row['error_type'],
+                             json.loads(row['error_details']) if row['error_details'] else None)
+        return None
+
+    def cancel(self, task_id):
+        self._execute("DELETE FROM tasks WHERE task_id = ? AND status IN (?, ?)", (task_id, QUEUED, LEASED))
+
+    def heartbeat_worker(self, worker_id, info):
+        now = time.time()
+        self._execute(
+            "INSERT INTO workers (worker_id, info, started_at, heartbeat_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(worker_id) DO UPDATE SET info=excluded.info, heartbeat_at=excluded.heartbeat_at",
+            (worker_id, json.dumps(info, ensure_ascii=False), now, now))
+
+    def remove_worker(self, worker_id):
+        self._execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    def workers(self, max_age):
+        cutoff = time.time() - max_age
+        self._execute("DELETE FROM workers WHERE heartbeat_at < ?", (cutoff,))
+        rows = self._execute("SELECT worker_id, info, started_at, heartbeat_at FROM workers "
+                             "ORDER BY started_at").fetchall()
+        return [dict(json.loads(row['info']), workerId=row['worker_id'], startedAt=row['started_at'],
+                     heartbeatAt=row['heartbeat_at']) for row in rows]
+
+    def stats(self):
+        counts = {row['status']: row['n'] for row in self._execute(
+            "SELECT status, COUNT(*) AS n FROM tasks GROUP BY status")}
+        return {status: counts.get(status, 0) for status in (QUEUED, LEASED, DONE, FAILED)}
+
+    def prune(self, max_age):
+        # 依頼元が待つのをやめた古い実行待ちのタスクも（パスワードごと）削除
+        cutoff = time.time() - max_age
+        self._execute("DELETE FROM tasks WHERE (status IN (?, ?) AND updated_at < ?) "
+                      "OR (status = ? AND created_at < ?)", (DONE, FAILED, cutoff, QUEUED, cutoff))
+
+
+# キューのバックエンド（JOB_QUEUE_BACKEND。独自実装は「モジュール:クラス」で指定）
+QUEUE_BACKENDS = {'sqlite': SqliteJobQueue}
+
+
+def create_queue(backend=None):
+    """環境変数 JOB_QUEUE_BACKEND に応じたキューを生成"""
+    backend = backend or os.getenv("JOB_QUEUE_BACKEND", "sqlite")
+    if backend in QUEUE_BACKENDS:
+        return QUEUE_BACKENDS[backend]()
+    module, _, name = backend.partition(':')
+    if not name:
+        raise ValueError(f"未対応のキューです: {backend}（sqlite または モジュール:クラス を指定）")
+    cls = getattr(importlib.import_module(module), name)
+    if not (isinstance(cls, type) and issubclass(cls, JobQueue)):
+        raise TypeError(f"{backend} は JobQueue を継承したクラスではありません")
+    # 未実装のメソッドがあればここでTypeErrorとなり、実行の途中で失敗しない
+    return cls()
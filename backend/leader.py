@@ -0,0 +1,45 @@
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows等（単一プロセスでの実行を想定）
+    fcntl = None
+
+
+class LeaderLock:
+    """ファイルロックで、複数プロセスのうち1つだけを監視ジョブの実行役にする"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("MONITOR_LEADER_LOCK", "monitor_leader.lock")
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self, blocking=False):
+        """ロックを取得（プロセス終了時にOSが自動で解放する）"""
+        if self._file is not None:
+            return True
+        f = open(self.path, 'a+')
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except OSError:
+                f.close()
+                return False
+        # 調査用に保持しているプロセスIDを書いておく
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
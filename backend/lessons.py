@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# 括弧内は残り枠数 例: 30メガダンス(37) → 37が残り枠数
+REMAINING_PATTERN = re.compile(r'\((\d+)\)')
+TIME_PATTERN = re.compile(r'^\s*(\d{1,2}):(\d{2})')
+
+
+def format_date(date_str):
+    """YYYYMMDD → YYYY-MM-DD"""
+    return f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:8]}"
+
+
+def lesson_key(date, time, name):
+    """日付・開始時刻・レッスン名から安定したIDを生成（パネルの並び順に依存しない）"""
+    digest = hashlib.sha1(f"{date}|{time}|{name}".encode('utf-8')).hexdigest()[:8]
+    return f"{date.replace('-', '')}-{time.replace(':', '')}-{digest}"
+
+
+def status_for(remaining):
+    """残り枠数から空き状況を判定"""
+    if remaining is None:
+        return 'unknown'
+    if remaining == 0:
+        return '満員'
+    if remaining <= 3:
+        return '残りわずか'
+    return '空きあり'
+
+
+class Lesson:
+    """1コマ分のレッスン情報"""
+
+    __slots__ = ('key', 'date', 'time', 'name', 'remaining', 'status', 'booking')
+
+    def __init__(self, date, time, name, remaining=None, booking=None):
+        self.date = date
+        self.time = time
+        self.name = name
+        self.remaining = remaining
+        self.status = status_for(remaining)
+        # 予約画面へ進むための識別子（パネルのid・リンク・data属性。取得できた場合のみ）
+        self.booking = booking
+        self.key = lesson_key(date or '', time, name)
+
+    @property
+    def id(self):
+        return self.key
+
+    def to_dict(self):
+        """API応答・保存用の辞書"""
+        data = {
+            'id': self.key,
+            'date': self.date,
+            'time': self.time,
+            'name': self.name,
+            'remaining': self.remaining,
+            'status': self.status
+        }
+        if self.booking:
+            data['booking'] = self.booking
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('date'), data['time'], data['name'], data.get('remaining'), data.get('booking'))
+
+    def __repr__(self):
+        return f"Lesson({self.date} {self.time} {self.name} 残り{self.remaining})"
+
+
+def index_lessons(lessons):
+    """ID → Lesson の索引を作成"""
+    return {lesson.key: lesson for lesson in lessons}
+
+
+def parse_panel_text(text, date_str=None):
+    """パネルのテキストからLessonを生成（短すぎる場合はNone）"""
+    text = text.strip()
+    if len(text) < 5:
+        return None
+
+    match = TIME_PATTERN.match(text)
+    if match:
+        time_part = f"{int(match.group(1)):02d}:{match.group(2)}"
+        rest = text[match.end():]
+    else:
+        time_part = text[:5]
+        rest = text[5:]
+
+    # 括弧内の数字（残り枠数）はレッスン名から除き、数値として保持
+    remaining = None
+    match = REMAINING_PATTERN.search(rest)
+    if match:
+        remaining = int(match.group(1))
+        rest = rest[:match.start()] + rest[match.end():]
+    else:
+        logger.debug(f"括弧内数字が見つからない - テキスト: '{text}'")
+    name_part = ' '.join(rest.split())
+
+    return Lesson(format_date(date_str) if date_str else None, time_part, name_part, remaining)
@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+from datetime import datetime
+import contextvars
+import json
+import logging
+import os
+import sys
+
+# 実行中の監視ジョブなど、ログに自動で付与する項目
+_log_fields = contextvars.ContextVar('log_fields', default={})
+
+
+@contextmanager
+def log_context(**fields):
+    """このブロック内のログに項目（job_id・user_id等）を付与"""
+    token = _log_fields.set(dict(_log_fields.get(), **fields))
+    try:
+        yield
+    finally:
+        _log_fields.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1件のJSON形式でログを出力"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        entry.update(_log_fields.get())
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """従来の [INFO] 形式（開発時の目視用）"""
+
+    def format(self, record):
+        fields = dict(_log_fields.get(), **(getattr(record, 'fields', None) or {}))
+        extra = ' '.join(f"{k}={v}" for k, v in fields.items())
+        text = f"[{record.levelname}] {record.getMessage()}" + (f" ({extra})" if extra else "")
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+
+def configure_logging():
+    """ルートロガーを設定（LOG_FORMAT=json|text, LOG_LEVEL）"""
+    handler = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "json") == "text":
+        handler.setFormatter(TextFormatter())
+    else:
+        handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    # Seleniumの通信ログは多すぎるため抑える
+    logging.getLogger('selenium').setLevel(logging.WARNING)
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
@@ -0,0 +1,253 @@
+from contextlib import contextmanager
+import math
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def collect(self):
+        """ラベル値 → 値 の一覧"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    """単調増加するカウンター"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """現在値（関数を登録すると出力時に値を取得）"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """出力時に呼ぶ関数を登録（ラベル無しなら数値、ラベル有りなら {ラベル値タプル: 数値} を返す）"""
+        self._function = function
+
+    def collect(self):
+        if self._function is None:
+            return super().collect()
+        try:
+            value = self._function()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [[list(key if isinstance(key, tuple) else (key,)), v] for key, v in value.items()]
+        return [[[], value]]
+
+
+class Histogram(_Metric):
+    """所要時間などの分布（累積バケット・合計・件数）"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self):
+        with self._lock:
+            return [[list(key), list(state)] for key, state in self._values.items()]
+
+
+class Registry:
+    """メトリクスの登録先。プロセスごとのスナップショットを合算してテキスト形式で出力"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self):
+        """このプロセスの全メトリクス（JSONにそのまま変換できる形式）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            m.name: {
+                'type': m.type,
+                'help': m.help,
+                'labels': list(m.labelnames),
+                'buckets': [b for b in getattr(m, 'buckets', ()) if b != math.inf],
+                'values': m.collect()
+            }
+            for m in metrics
+        }
+
+    def render(self, snapshots=None):
+        """Prometheusのテキスト形式で出力（複数プロセス分は同じラベルごとに合算）"""
+        merged = {}
+        for snapshot in (snapshots if snapshots is not None else [self.snapshot()]):
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, dict(metric, values={}))
+                for key, value in metric['values']:
+                    key = tuple(key)
+                    current = target['values'].get(key)
+                    if current is None:
+                        target['values'][key] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        target['values'][key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        target['values'][key] = current + value
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in sorted(metric['values'].items()):
+                if metric['type'] != 'histogram':
+                    lines.append(f"{name}{_format_labels(metric['labels'], key)} {_format_value(value)}")
+                    continue
+                bounds = list(metric['buckets']) + [math.inf]
+                for bound, count in zip(bounds, value):
+                    labels = _format_labels(metric['labels'], key, [('le', _format_value(bound))])
+                    lines.append(f"{name}_bucket{labels} {_format_value(count)}")
+                lines.append(f"{name}_sum{_format_labels(metric['labels'], key)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(metric['labels'], key)} {_format_value(value[-1])}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# ブラウザ処理（Chrome起動・ログイン・ページ遷移・抽出）のステップごとの所要時間と失敗
+SCRAPE_PHASE_SECONDS = REGISTRY.histogram(
+    'lesson_monitor_scrape_phase_seconds', 'Duration of each scraping phase', ('backend', 'phase'))
+SCRAPE_PHASE_FAILURES = REGISTRY.counter(
+    'lesson_monitor_scrape_phase_failures_total', 'Scraping failures by phase', ('backend', 'phase'))
+
+# 監視ジョブ1回分のチェック
+CHECK_SECONDS = REGISTRY.histogram(
+    'lesson_monitor_check_seconds', 'Duration of one monitor check', ('result',))
+CHECKS = REGISTRY.counter(
+    'lesson_monitor_checks_total', 'Monitor checks by result', ('result',))
+SEAT_EVENTS = REGISTRY.counter(
+    'lesson_monitor_seat_events_total', 'Detected seat change events', ('type',))
+
+# 通知
+NOTIFICATIONS = REGISTRY.counter(
+    'lesson_monitor_notifications_total', 'Notification deliveries by method and result', ('method', 'result'))
+NOTIFICATION_SECONDS = REGISTRY.histogram(
+    'lesson_monitor_notification_send_seconds', 'Duration of one notification delivery', ('method',),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20))
+
+# 現在の状態
+ACTIVE_JOBS = REGISTRY.gauge(
+    'lesson_monitor_jobs', 'Monitor jobs by state', ('state',))
+BROWSER_PROCESSES = REGISTRY.gauge(
+    'lesson_monitor_browser_processes', 'Live Chrome/ChromeDriver processes')
+POOLED_DRIVERS = REGISTRY.gauge(
+    'lesson_monitor_pooled_drivers', 'WebDrivers held by the pool', ('state',))
+SESSION_RESTORES = REGISTRY.counter(
+    'lesson_monitor_session_restores_total', 'Attempts to reuse saved login cookies by result', ('result',))
+BROWSER_KILLS = REGISTRY.counter(
+    'lesson_monitor_browser_kills_total', 'Browser processes killed by the resource governor', ('reason',))
+CIRCUIT_TRANSITIONS = REGISTRY.counter(
+    'lesson_monitor_circuit_transitions_total', 'Circuit breaker state changes by target site', ('breaker', 'state'))
+
+
+class StepTimer:
+    """処理ステップごとの所要時間を記録し、メトリクスにも反映"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.steps = []
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            SCRAPE_PHASE_FAILURES.inc(backend=self.backend, phase=name)
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.steps.append((name, seconds))
+            SCRAPE_PHASE_SECONDS.observe(seconds, backend=self.backend, phase=name)
+
+    def as_dict(self):
+        """ステップ名 → 秒（total は全体の経過時間）"""
+        timings = {name: round(seconds, 3) for name, seconds in self.steps}
+        timings['total'] = round(time.perf_counter() - self._started, 3)
+        return timings
+
+    def summary(self):
+        return ' '.join(f"{name}={seconds:.2f}s" for name, seconds in self.as_dict().items())
@@ -0,0 +1,23 @@
+# 監視ジョブ専用プロセス: python monitor_service.py
+# Webワーカーを MONITOR_ROLE=web で起動すると、監視ジョブの実行はこのプロセスだけが行う
+import logging
+import signal
+import threading
+
+from app import start_services
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+    signal.signal(signal.SIGINT, lambda *args: stopped.set())
+
+    start_services('leader')
+    stopped.wait()
+    logger.info("監視プロセスを停止します")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import logging
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+
+from metrics import NOTIFICATIONS, NOTIFICATION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+LINE_NOTIFY_URL = os.getenv("LINE_NOTIFY_URL", "https://notify-api.line.me/api/notify")
+
+
+class PermanentNotificationError(Exception):
+    """再送しても成功しない通知エラー（認証失敗・無効なトークンなど）"""
+
+
+class SmtpConnection:
+    """ログイン済みSMTP接続を保持し、複数メッセージで使い回す"""
+
+    def __init__(self):
+        self.host = os.getenv("SMTP_HOST", "smtp.gmail.com")
+        self.port = int(os.getenv("SMTP_PORT", "587"))
+        self.use_starttls = os.getenv("SMTP_STARTTLS", "1") == "1"
+        self.use_auth = os.getenv("SMTP_AUTH", "1") == "1"
+        self.timeout = float(os.getenv("SMTP_TIMEOUT", "20"))
+        self.idle_check_seconds = 60
+        self._server = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self, from_email, from_password):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_starttls:
+            server.starttls()
+        if self.use_auth:
+            server.login(from_email, from_password)
+        logger.info(f"SMTP接続を確立しました: {self.host}:{self.port}")
+        return server
+
+    def _is_usable(self):
+        if self._server is None:
+            return False
+        if time.time() - self._last_used < self.idle_check_seconds:
+            return True
+        # しばらく使っていない接続はNOOPで生存確認
+        try:
+            return self._server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def send(self, msg, from_email, from_password):
+        """メッセージを送信（切断されていれば1回だけ再接続）"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if not self._is_usable():
+                        self.close_locked()
+                        self._server = self._connect(from_email, from_password)
+                    self._server.send_message(msg)
+                    self._last_used = time.time()
+                    return
+                except smtplib.SMTPAuthenticationError as e:
+                    self.close_locked()
+                    raise PermanentNotificationError(f"SMTP認証失敗: {e}")
+                except smtplib.SMTPRecipientsRefused as e:
+                    raise PermanentNotificationError(f"宛先拒否: {e}")
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    self.close_locked()
+                    if attempt:
+                        raise
+
+    def close_locked(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+    def close(self):
+        with self._lock:
+            self.close_locked()
+
+
+class NotificationService:
+    """通知サービスクラス（SMTP接続・HTTPセッションを使い回す）"""
+
+    def __init__(self):
+        self.smtp = SmtpConnection()
+        self._http = None
+        self._http_lock = threading.Lock()
+        self.timeout = float(os.getenv("LINE_NOTIFY_TIMEOUT", "10"))
+
+    @property
+    def http(self):
+        """LINE通知用のHTTPセッション（requestsは初回の送信時に読み込む）"""
+        with self._http_lock:
+            if self._http is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                self._http = requests.Session()
+                self._http.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+                self._http.mount('http://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+            return self._http
+
+    def deliver_email(self, to_email, subject, body):
+        """メール通知を送信（失敗時は例外）"""
+        from_email = os.getenv("GMAIL_EMAIL")
+        from_password = os.getenv("GMAIL_PASSWORD")
+
+        if not from_email or (self.smtp.use_auth and not from_password):
+            raise PermanentNotificationError("メール認証情報が設定されていません")
+
+        msg = MIMEMultipart()
+        msg['From'] = from_email
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain', 'utf-8'))
+
+        with NOTIFICATION_SECONDS.time(method='email'):
+            self.smtp.send(msg, from_email, from_password)
+        logger.info(f"メール通知送信成功: {to_email}")
+
+    def deliver_line(self, message, line_token):
+        """LINE通知を送信（失敗時は例外）"""
+        if not line_token:
+            raise PermanentNotificationError("LINE Notifyトークンが設定されていません")
+
+        headers = {"Authorization": f"Bearer {line_token}"}
+        with NOTIFICATION_SECONDS.time(method='line'):
+            response = self.http.post(LINE_NOTIFY_URL, headers=headers,
+                                      data={"message": message}, timeout=self.timeout)
+
+        if response.status_code == 200:
+            logger.info("LINE通知送信成功")
+            return
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            raise PermanentNotificationError(f"LINE通知送信失敗: {response.status_code}")
+        raise RuntimeError(f"LINE通知送信失敗: {response.status_code}")
+
+    def send_email(self, to_email, subject, body):
+        """メール通知を同期送信"""
+        try:
+            self.deliver_email(to_email, subject, body)
+            return True
+        except Exception as e:
+            logger.error(f"メール送信失敗: {e}")
+            return False
+
+    def send_line(self, message, line_token):
+        """LINE通知を同期送信"""
+        try:
+            self.deliver_line(message, line_token)
+            return True
+        except Exception as e:
+            logger.error(f"LINE通知送信失敗: {e}")
+            return False
+
+    def close(self):
+        self.smtp.close()
+        with self._http_lock:
+            if self._http is not None:
+                self._http.close()
+                self._http = None
+
+
+class NotificationDispatcher:
+    """通知をキューに積み、バックグラウンドのワーカーが再送付きで送信する"""
+
+    def __init__(self, service=None, workers=None, max_attempts=None, backoff_base=None):
+        self.service = service or NotificationService()
+        self.max_attempts = max_attempts or int(os.getenv("NOTIFY_MAX_ATTEMPTS", "4"))
+        self.backoff_base = backoff_base or float(os.getenv("NOTIFY_BACKOFF_SECONDS", "5"))
+        self._queue = queue.Queue()
+        self._pending_retries = 0
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self._workers = []
+        for i in range(workers or int(os.getenv("NOTIFY_WORKERS", "1"))):
+            worker = threading.Thread(target=self._work, name=f'notify-worker-{i}')
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def notify(self, method, subject, message, email=None, line_token=None):
+        """通知をキューに追加（送信完了を待たない）"""
+        if method == "email" and email:
+            self._queue.put(('email', (email, subject, message), 1))
+        elif method == "line" and line_token:
+            self._queue.put(('line', (message, line_token), 1))
+        else:
+            return False
+        return True
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            kind, args, attempt = item
+            try:
+                if kind == 'email':
+                    self.service.deliver_email(*args)
+                else:
+                    self.service.deliver_line(*args)
+                with self._lock:
+                    self.sent += 1
+                NOTIFICATIONS.inc(method=kind, result='sent')
+            except PermanentNotificationError as e:
+                logger.error(f"通知送信失敗（再送なし）: {e}")
+                with self._lock:
+                    self.failed += 1
+                NOTIFICATIONS.inc(method=kind, result='failed')
+            except Exception as e:
+                self._retry(kind, args, attempt, e)
+            finally:
+                self._queue.task_done()
+
+    def _retry(self, kind, args, attempt, error):
+        """指数バックオフ＋ジッターで再送を予約"""
+        if attempt >= self.max_attempts:
+            logger.error(f"通知送信失敗（{attempt}回試行）: {error}")
+            with self._lock:
+                self.failed += 1
+            NOTIFICATIONS.inc(method=kind, result='failed')
+            return
+        NOTIFICATIONS.inc(method=kind, result='retried')
+        delay = self.backoff_base * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+        logger.warning(f"通知送信失敗 → {delay:.1f}秒後に再送({attempt + 1}/{self.max_attempts}): {error}")
+
+        def requeue():
+            with self._lock:
+                self._pending_retries -= 1
+            self._queue.put((kind, args, attempt + 1))
+
+        with self._lock:
+            self._pending_retries += 1
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        timer.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'retrying': self._pending_retries,
+                'sent': self.sent,
+                'failed': self.failed
+            }
+
+    def shutdown(self, timeout=10):
+        """キュー内の通知を送信し終えてから停止"""
+        for _ in self._workers:
+            self._queue.put(None)
+        deadline = time.time() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.time()))
+        self.service.close()
@@ -0,0 +1,70 @@
+from datetime import datetime
+import os
+import random
+
+
+def lesson_start(lesson, default_date):
+    """レッスンの開始日時（date: YYYY-MM-DD, time: HH:MM）。解釈できなければNone"""
+    try:
+        return datetime.strptime(f"{lesson.date or default_date} {lesson.time}", '%Y-%m-%d %H:%M')
+    except ValueError:
+        return None
+
+
+class AdaptivePoller:
+    """レッスン開始までの残り時間と空き状況の変動から次回チェックまでの秒数を決める"""
+
+    def __init__(self, base_seconds, min_seconds=None, max_seconds=None, error_max_seconds=None):
+        self.base_seconds = base_seconds
+        self.min_seconds = min(base_seconds, min_seconds or float(os.getenv("ADAPTIVE_MIN_SECONDS", "60")))
+        self.max_seconds = max(base_seconds, max_seconds or float(os.getenv("ADAPTIVE_MAX_SECONDS", "1800")))
+        self.error_max_seconds = error_max_seconds or float(os.getenv("ADAPTIVE_ERROR_MAX_SECONDS", "1800"))
+        self.enabled = os.getenv("ADAPTIVE_POLLING", "1") == "1"
+        self.quiet_checks = 0
+        self.errors = 0
+        self._last_signature = None
+
+    def next_delay(self, lessons, default_date, now=None):
+        """正常なチェック後の待機秒数。監視対象が全て開始済みならNone"""
+        now = now or datetime.now()
+        self.errors = 0
+
+        starts = [s for s in (lesson_start(l, default_date) for l in lessons) if s is not None]
+        upcoming = [s for s in starts if s > now]
+        if starts and not upcoming:
+            return None
+
+        # 残り枠が前回から動いたかどうか
+        signature = tuple(sorted((l.key, l.remaining if l.remaining is not None else -1) for l in lessons))
+        changed = self._last_signature is not None and signature != self._last_signature
+        self._last_signature = signature
+
+        if not self.enabled:
+            return self.base_seconds
+
+        if changed:
+            self.quiet_checks = 0
+            delay = self.min_seconds
+        else:
+            self.quiet_checks += 1
+            # 変化が無い間は少しずつ間隔を広げる
+            delay = self.base_seconds * (1.5 ** min(self.quiet_checks - 1, 6))
+
+        if upcoming:
+            until_start = (min(upcoming) - now).total_seconds()
+            if until_start <= 3600:
+                delay = self.min_seconds
+            elif until_start <= 3 * 3600:
+                delay = min(delay, self.base_seconds / 2)
+            elif until_start <= 24 * 3600:
+                delay = min(delay, self.base_seconds)
+            # 開始時刻を大きく過ぎて次のチェックをしないようにする
+            delay = min(delay, max(self.min_seconds, until_start))
+
+        return max(self.min_seconds, min(delay, self.max_seconds))
+
+    def error_delay(self):
+        """サイトエラー時の待機秒数（指数バックオフ＋ジッター）"""
+        self.errors += 1
+        delay = min(self.error_max_seconds, 60 * (2 ** (self.errors - 1)))
+        return delay * random.uniform(0.75, 1.25)
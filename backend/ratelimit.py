@@ -0,0 +1,83 @@
+from contextlib import contextmanager
+import threading
+import time
+
+
+class TokenBucket:
+    """トークンバケット方式のレート制限（rate件/秒、最大capacity件まで連続で許可）
+
+    shared（site_state.SiteStateStore）を指定すると、同じ name のバケットを
+    同じホストの他のプロセスと共有する（指定しなければこのプロセス内だけで数える）。
+    """
+
+    def __init__(self, rate, capacity=None, name=None, shared=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.name = name
+        self._shared = shared if name is not None else None
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _synced(self, write=True):
+        """トークン数を読み込んで操作し、書き戻す（ロック取得済みの状態で実行）"""
+        with self._lock:
+            if self._shared is None:
+                yield
+                return
+            with self._shared.transaction() as conn:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+                if row is None:
+                    self._tokens, self._updated = self.capacity, time.time()
+                else:
+                    self._tokens, self._updated = min(self.capacity, row[0]), row[1]
+                yield
+                if write:
+                    conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                                 (self.name, self._tokens, self._updated))
+
+    def _refill_locked(self):
+        now = time.time()
+        # 時計が戻った場合は補充しない
+        self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """トークンがあれば消費してTrue（待たない）"""
+        with self._synced():
+            self._refill_locked()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """トークンが貯まるまで待って消費（timeout秒以内に得られなければFalse）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._synced():
+                self._refill_locked()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate if self.rate > 0 else 1.0
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def wait_time(self, tokens=1):
+        """トークンが貯まるまでの秒数（消費しない。すぐに得られれば0）"""
+        with self._synced(write=False):
+            self._refill_locked()
+            if self._tokens >= tokens:
+                return 0.0
+            return (tokens - self._tokens) / self.rate if self.rate > 0 else 1.0
+
+    def available(self):
+        with self._synced():
+            self._refill_locked()
+            return self._tokens
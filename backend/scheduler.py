@@ -0,0 +1,494 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+
+from logging_config import log_context
+from sites import DEFAULT_SITE, UnknownSite, get_site
+
+logger = logging.getLogger(__name__)
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+def _same_scope(old_state, new_state):
+    """会員・サイト・監視日付が同じ定義か（同じならスナップショットを引き継げる）"""
+    keys = ('user_id', 'site', 'date', 'dates')
+    return all(old_state.get(key) == new_state.get(key) for key in keys)
+
+
+class MonitorJob:
+    """スケジューラーに登録された1件の監視ジョブ"""
+
+    def __init__(self, job_id, monitor):
+        self.job_id = job_id
+        self.monitor = monitor
+        self.user_id = monitor.user_id
+        self.site_id = getattr(monitor, 'site_id', None)
+        self.active = True
+        self.running = False
+        self.next_run = None
+        self.last_check = None
+        self.last_error = None
+        self.checks = 0
+        self.finished = False
+        self.created_at = time.time()
+        self.token = None
+        self.version = None  # ストアに保存済みの定義の版数
+
+    def to_dict(self):
+        """API応答用の状態"""
+        return {
+            'jobId': self.job_id,
+            'userId': self.user_id,
+            'site': self.site_id,
+            'date': self.monitor.date,
+            'dates': self.monitor.dates,
+            'interval': self.monitor.interval_minutes,
+            'notifyMethod': self.monitor.notify_method,
+            'lessonCount': len(self.monitor.selected_lessons),
+            'rule': self.monitor.rule.to_dict(),
+            'isRunning': self.active,
+            'finished': self.finished,
+            'checking': self.running,
+            'checks': self.checks,
+            'nextCheck': _format_time(self.next_run) if self.active else None,
+            'lastCheck': _format_time(self.last_check),
+            'lastError': self.last_error,
+            'createdAt': _format_time(self.created_at)
+        }
+
+
+class MonitorScheduler:
+    """多数のLessonMonitorを限られたワーカーで締切順に実行するスケジューラー"""
+
+    def __init__(self, max_workers=None, per_user_limit=None, on_change=None, on_check=None, on_event=None):
+        self.max_workers = max_workers or int(os.getenv("SCHEDULER_MAX_WORKERS", "2"))
+        self.per_user_limit = per_user_limit or int(os.getenv("SCHEDULER_PER_USER_LIMIT", "1"))
+        self.on_change = on_change
+        self.on_check = on_check
+        self.on_event = on_event
+        self._jobs = {}
+        self._queue = []  # (次回実行時刻, 登録番号, ジョブID) のヒープ
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._running_by_user = {}
+        self._waiting_by_user = {}
+        self._running_by_site = {}
+        self._waiting_by_site = {}
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix='monitor-worker')
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name='monitor-dispatcher')
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+
+    # ジョブ管理
+
+    def add(self, monitor, job_id=None, delay=0, active=True):
+        """監視ジョブを登録して開始（active=Falseなら一時停止状態で登録）"""
+        job = MonitorJob(job_id or uuid.uuid4().hex[:12], monitor)
+        job.active = active
+        with self._cond:
+            old = self._jobs.get(job.job_id)
+            if old is not None:
+                old.active = False
+            self._jobs[job.job_id] = job
+            if active:
+                self._push_locked(job, time.time() + delay)
+            self._cond.notify_all()
+        logger.info(f"監視ジョブ登録: {job.job_id} ({monitor.user_id}, {monitor.date}, 間隔{monitor.interval_minutes}分)")
+        self._changed(job, 'added')
+        return job
+
+    def update(self, job_id, monitor, active=None):
+        """登録済みジョブの定義を差し替え（実行回数・次回予定・差分判定の状態を引き継ぎ、他のジョブは止めない）
+
+        会員・サイトが変わる場合は別のジョブとして登録し直す。active=Noneなら実行・一時停止の状態は変えない。
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            replace = (monitor.user_id != job.user_id
+                       or getattr(monitor, 'site_id', None) != job.site_id)
+            if not replace:
+                carry_over = getattr(monitor, 'carry_over', None)
+                if carry_over is not None:
+                    carry_over(job.monitor)
+                job.monitor = monitor
+                if active is not None and active != job.active:
+                    job.active = active
+                    job.token = None
+                    if active:
+                        job.finished = False
+                        if not job.running:
+                            self._push_locked(job, time.time())
+                elif job.active and not job.running and job.next_run:
+                    # 間隔が短くなった場合は次回予定を前倒し
+                    run_at = time.time() + monitor.interval_minutes * 60
+                    if run_at < job.next_run:
+                        self._push_locked(job, run_at)
+                self._cond.notify_all()
+        if replace:
+            return self.add(monitor, job_id=job_id, active=job.active if active is None else active)
+        logger.info(f"監視ジョブ変更: {job_id} ({monitor.user_id}, {monitor.date}, 間隔{monitor.interval_minutes}分)")
+        self._changed(job, 'updated')
+        return job
+
+    def apply(self, add=(), update=(), remove=()):
+        """複数ジョブの追加・変更・削除をまとめて反映（対象外のジョブはそのまま実行を続ける）
+
+        add: LessonMonitorの一覧 / update: (ジョブID, LessonMonitor, active) の一覧 / remove: ジョブIDの一覧
+        戻り値: (追加したジョブ, 変更したジョブ, 削除したジョブID)
+        """
+        added = [self.add(monitor) for monitor in add]
+        updated = [job for job in (self.update(job_id, monitor, active) for job_id, monitor, active in update)
+                   if job is not None]
+        removed = [job_id for job_id in remove if self.remove(job_id)]
+        return added, updated, removed
+
+    def remove(self, job_id):
+        """監視ジョブを削除（実行中のチェックは完了後に破棄）"""
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return False
+            job.active = False
+            job.token = None
+            self._cond.notify_all()
+        logger.info(f"監視ジョブ削除: {job_id}")
+        self._changed(job, 'removed')
+        return True
+
+    def stop(self, job_id):
+        """監視ジョブを一時停止"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.active = False
+            job.token = None
+            self._cond.notify_all()
+        self._changed(job, 'stopped')
+        return job
+
+    def start(self, job_id):
+        """一時停止中の監視ジョブを再開"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if not job.active:
+                job.active = True
+                job.finished = False
+                if not job.running:
+                    self._push_locked(job, time.time())
+                self._cond.notify_all()
+        self._changed(job, 'started')
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def jobs(self, user_id=None):
+        """登録済みジョブ一覧（会員番号で絞り込み可）"""
+        with self._cond:
+            return [j for j in self._jobs.values() if user_id is None or j.user_id == user_id]
+
+    def find(self, user_id, date, site_id=None):
+        """会員番号・日付（・サイト）が一致するジョブを取得"""
+        for job in self.jobs(user_id):
+            if job.monitor.date == date and (site_id is None or job.site_id == site_id):
+                return job
+        return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'jobs': len(self._jobs),
+                'active': sum(1 for j in self._jobs.values() if j.active),
+                'running': self._in_flight,
+                'maxWorkers': self.max_workers
+            }
+
+    def shutdown(self):
+        """スケジューラーを停止"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False)
+
+    # 内部処理
+
+    def _changed(self, job, kind):
+        if self.on_change:
+            try:
+                self.on_change()
+            except Exception as e:
+                logger.error(f"監視状態の保存に失敗: {e}")
+        self._emit(kind, job)
+
+    def _emit(self, kind, job):
+        """ジョブの状態変化を通知（added/removed/stopped/started/finished/check_started/check_finished）"""
+        if self.on_event:
+            try:
+                self.on_event(kind, job)
+            except Exception as e:
+                logger.error(f"イベント通知に失敗({job.job_id}): {e}")
+
+    def _push_locked(self, job, run_at):
+        job.next_run = run_at
+        job.token = next(self._seq)
+        heapq.heappush(self._queue, (run_at, job.token, job.job_id))
+
+    def _dispatch_loop(self):
+        """実行時刻が来たジョブを締切順にワーカーへ割り当て"""
+        with self._cond:
+            while not self._closed:
+                now = time.time()
+                while self._queue and self._in_flight < self.max_workers:
+                    run_at, token, job_id = self._queue[0]
+                    if run_at > now:
+                        break
+                    heapq.heappop(self._queue)
+                    job = self._jobs.get(job_id)
+                    if job is None or job.token != token or not job.active:
+                        continue
+                    # 同じ会員のチェックが実行中なら、その完了まで待たせる（公平性の確保）
+                    if self._running_by_user.get(job.user_id, 0) >= self.per_user_limit:
+                        self._waiting_by_user.setdefault(job.user_id, []).append(job)
+                        continue
+                    # サイトの同時アクセス数の上限に達していれば待たせ、他のサイトのジョブを先に実行
+                    if job.site_id and self._running_by_site.get(job.site_id, 0) >= self._site_limit(job.site_id):
+                        self._waiting_by_site.setdefault(job.site_id, []).append(job)
+                        continue
+                    # 遮断中・アクセス頻度の上限に達したサイトはワーカーで待たせず、アクセスできる時刻に実行し直す
+                    wait = self._site_wait(job.site_id) if job.site_id else 0.0
+                    if wait > 0:
+                        self._push_locked(job, now + wait)
+                        continue
+                    self._launch_locked(job)
+
+                timeout = None
+                if self._queue and self._in_flight < self.max_workers:
+                    timeout = max(0.0, self._queue[0][0] - now)
+                self._cond.wait(timeout=min(timeout, 5.0) if timeout is not None else 5.0)
+
+    def _launch_locked(self, job):
+        job.running = True
+        self._in_flight += 1
+        self._running_by_user[job.user_id] = self._running_by_user.get(job.user_id, 0) + 1
+        if job.site_id:
+            self._running_by_site[job.site_id] = self._running_by_site.get(job.site_id, 0) + 1
+        self._executor.submit(self._run, job)
+
+    def _site_limit(self, site_id):
+        """サイトごとの同時実行数の上限（1つのサイトでワーカーを使い切らないよう、ワーカー数未満に抑える。未登録のサイトは制限なし）"""
+        try:
+            limit = get_site(site_id).max_concurrency
+        except UnknownSite:
+            return float('inf')
+        return max(1, min(limit, self.max_workers - 1))
+
+    @staticmethod
+    def _site_wait(site_id):
+        """サイトへアクセスできるまでの秒数（取得できなければ0として実行し、ワーカー側の待機に任せる）"""
+        try:
+            return get_site(site_id).wait_time()
+        except UnknownSite:
+            return 0.0
+        except Exception as e:
+            logger.warning(f"サイトの状態を取得できません({site_id}): {e}")
+            return 0.0
+
+    def _run(self, job):
+        """1回分のチェックを実行し、次回実行を予約（ログにはジョブIDを付与）"""
+        with log_context(job_id=job.job_id, user_id=job.user_id):
+            self._run_job(job)
+
+    def _run_job(self, job):
+        delay = None
+        self._emit('check_started', job)
+        monitor = job.monitor
+        try:
+            delay = monitor.run_check()
+            job.last_error = getattr(monitor, 'last_error', None)
+        except Exception as e:
+            logger.error(f"監視ジョブ実行エラー({job.job_id}): {e}")
+            job.last_error = str(e)
+            delay = 60
+
+        with self._cond:
+            if job.monitor is not monitor and hasattr(job.monitor, 'carry_over'):
+                # チェック中に定義が変更された場合は、今回の取得結果を新しい定義へ引き継ぐ
+                job.monitor.carry_over(monitor)
+            job.running = False
+            job.last_check = time.time()
+            job.checks += 1
+            self._in_flight -= 1
+            self._running_by_user[job.user_id] -= 1
+            if not self._running_by_user[job.user_id]:
+                del self._running_by_user[job.user_id]
+            waiting_jobs = self._waiting_by_user.pop(job.user_id, [])
+            if job.site_id:
+                self._running_by_site[job.site_id] -= 1
+                if not self._running_by_site[job.site_id]:
+                    del self._running_by_site[job.site_id]
+                waiting_jobs += self._waiting_by_site.pop(job.site_id, [])
+
+            # 待たされていた同じ会員・同じサイトのジョブをキューへ戻す
+            for waiting in waiting_jobs:
+                if self._jobs.get(waiting.job_id) is waiting and waiting.active:
+                    self._push_locked(waiting, waiting.next_run)
+
+            if delay is None:
+                job.active = False
+                job.finished = True
+                logger.info(f"監視ジョブ完了: {job.job_id}")
+            elif self._jobs.get(job.job_id) is job and job.active:
+                self._push_locked(job, job.last_check + delay)
+            self._cond.notify_all()
+
+        if self.on_check:
+            try:
+                self.on_check(job)
+            except Exception as e:
+                logger.error(f"チェック後処理に失敗({job.job_id}): {e}")
+        self._emit('check_finished', job)
+        if delay is None:
+            self._changed(job, 'finished')
+
+
+class StoredJob:
+    """別プロセスの監視スケジューラーが実行中のジョブ（ストア上の定義と実行状況）"""
+
+    def __init__(self, row, monitor_factory):
+        self.job_id = row['job_id']
+        self.user_id = row['user_id']
+        self.active = row['active']
+        self.state = row['state']
+        self.site_id = self.state.get('site') or DEFAULT_SITE
+        self.status = row['status']
+        self._monitor_factory = monitor_factory
+        self._monitor = None
+
+    @property
+    def monitor(self):
+        if self._monitor is None:
+            self._monitor = self._monitor_factory(self.state)
+        return self._monitor
+
+    def to_dict(self):
+        """API応答用の状態（監視プロセスが未反映なら定義から組み立てる）"""
+        if self.status:
+            return dict(self.status, isRunning=self.active)
+        job = MonitorJob(self.job_id, self.monitor)
+        job.active = self.active
+        job.next_run = time.time() if self.active else None
+        return job.to_dict()
+
+
+class StoreBackedScheduler:
+    """MonitorSchedulerと同じ操作をストア経由で監視プロセスへ依頼する（Webワーカー用）"""
+
+    def __init__(self, store, monitor_factory, on_change=None):
+        self.store = store
+        self.monitor_factory = monitor_factory
+        self.on_change = on_change
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def add(self, monitor, job_id=None, delay=0, active=True):
+        job_id = job_id or uuid.uuid4().hex[:12]
+        self.store.save_job(job_id, monitor.user_id, monitor.to_state(), active)
+        logger.info(f"監視ジョブ登録: {job_id} ({monitor.user_id}, {monitor.date}, 間隔{monitor.interval_minutes}分)")
+        self._changed()
+        return self.get(job_id)
+
+    def update(self, job_id, monitor, active=None):
+        row = self.store.load_job(job_id)
+        if row is None:
+            return None
+        state = monitor.to_state()
+        self.store.save_job(job_id, monitor.user_id, state, row['active'] if active is None else active,
+                            keep_snapshot=_same_scope(row['state'], state))
+        logger.info(f"監視ジョブ変更: {job_id} ({monitor.user_id}, {monitor.date}, 間隔{monitor.interval_minutes}分)")
+        self._changed()
+        return self.get(job_id)
+
+    def apply(self, add=(), update=(), remove=()):
+        """複数ジョブの追加・変更・削除を1回の書き込みで反映（監視プロセスは変わったジョブだけを差し替える）"""
+        saves, added_ids, updated_ids = [], [], []
+        for monitor in add:
+            job_id = uuid.uuid4().hex[:12]
+            saves.append((job_id, monitor.user_id, monitor.to_state(), True, False))
+            added_ids.append(job_id)
+        for job_id, monitor, active in update:
+            row = self.store.load_job(job_id)
+            if row is None:
+                continue
+            state = monitor.to_state()
+            saves.append((job_id, monitor.user_id, state, row['active'] if active is None else active,
+                          _same_scope(row['state'], state)))
+            updated_ids.append(job_id)
+        _, removed = self.store.apply_jobs(saves, remove)
+        logger.info(f"監視ジョブ一括反映: 追加{len(added_ids)}件 変更{len(updated_ids)}件 削除{len(removed)}件")
+        self._changed()
+        updated = [job for job in (self.get(job_id) for job_id in updated_ids) if job is not None]
+        return [self.get(job_id) for job_id in added_ids], updated, removed
+
+    def remove(self, job_id):
+        if not self.store.delete_job(job_id):
+            return False
+        logger.info(f"監視ジョブ削除: {job_id}")
+        self._changed()
+        return True
+
+    def stop(self, job_id):
+        if not self.store.set_job_active(job_id, False):
+            return None
+        self._changed()
+        return self.get(job_id)
+
+    def start(self, job_id):
+        if not self.store.set_job_active(job_id, True):
+            return None
+        self._changed()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        row = self.store.load_job(job_id)
+        return StoredJob(row, self.monitor_factory) if row else None
+
+    def jobs(self, user_id=None):
+        return [StoredJob(row, self.monitor_factory) for row in self.store.load_jobs(user_id)]
+
+    def find(self, user_id, date, site_id=None):
+        for job in self.jobs(user_id):
+            if job.state.get('date') == date and (site_id is None or job.site_id == site_id):
+                return job
+        return None
+
+    def stats(self):
+        jobs = self.jobs()
+        return {
+            'jobs': len(jobs),
+            'active': sum(1 for j in jobs if j.active),
+            'running': sum(1 for j in jobs if j.status and j.status.get('checking')),
+            'maxWorkers': None
+        }
+
+    def shutdown(self):
+        pass
@@ -0,0 +1,250 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+from logging_config import log_context
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class ScrapeError(Exception):
+    """利用者に返すHTTPステータス付きの取得エラー"""
+
+    def __init__(self, message, http_status=500):
+        super().__init__(message)
+        self.http_status = http_status
+
+
+class ScrapeQueueFull(Exception):
+    """取得待ちのジョブが上限に達している"""
+
+
+class ScrapeJob:
+    """1件のレッスン取得ジョブ"""
+
+    def __init__(self, job_id, key):
+        self.job_id = job_id
+        self.key = key
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.error_status = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cached = False
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def wait(self, timeout):
+        """完了までtimeout秒待つ（完了していればTrue）"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        """API応答用の状態"""
+        data = {
+            'jobId': self.job_id,
+            'status': self.status,
+            'cached': self.cached,
+            'createdAt': datetime.fromtimestamp(self.created_at).isoformat(),
+            'finishedAt': datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None
+        }
+        if self.status == DONE:
+            data.update(self.result)
+        elif self.status == FAILED:
+            data['error'] = self.error
+        return data
+
+    def to_state(self):
+        """ストアに保存する状態（他のWebワーカーが StoredScrapeJob として読み込む）"""
+        return {'status': self.status, 'result': self.result, 'error': self.error,
+                'errorStatus': self.error_status, 'createdAt': self.created_at,
+                'finishedAt': self.finished_at, 'cached': self.cached}
+
+
+class StoredScrapeJob(ScrapeJob):
+    """別のWebワーカーが受け付けたジョブ（ストアの状態を参照し、完了はポーリングで待つ）"""
+
+    def __init__(self, job_id, state, store, poll_interval=0.2):
+        super().__init__(job_id, None)
+        self._store = store
+        self.poll_interval = poll_interval
+        self._apply(state)
+
+    def _apply(self, state):
+        self.status = state['status']
+        self.result = state['result']
+        self.error = state['error']
+        self.error_status = state['errorStatus']
+        self.created_at = state['createdAt']
+        self.finished_at = state['finishedAt']
+        self.cached = state['cached']
+        if self.status in (DONE, FAILED):
+            self._done.set()
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        while not self.finished:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+            state = self._store.load_scrape_job(self.job_id)
+            if state is None:
+                return False
+            self._apply(state)
+        return True
+
+
+class ScrapeJobManager:
+    """レッスン取得をバックグラウンドで実行し、同じ条件の取得は実行中・直近の結果を共有する
+
+    store（MonitorStore）を指定すると、ジョブの状態・結果を保存し、受け付けたWebワーカー以外の
+    プロセスからも get() で参照できるようにする（gunicornの複数ワーカーで状態確認が別のワーカーに届く場合）。
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, result_ttl=None, retention=None, store=None):
+        self.max_workers = max_workers or int(os.getenv("SCRAPE_MAX_WORKERS", "2"))
+        self.max_pending = max_pending or int(os.getenv("SCRAPE_MAX_PENDING", "20"))
+        self.result_ttl = result_ttl if result_ttl is not None else float(os.getenv("SCRAPE_RESULT_TTL", "60"))
+        self.retention = retention or float(os.getenv("SCRAPE_JOB_RETENTION", "300"))
+        self._jobs = {}     # ジョブID → ScrapeJob
+        self._by_key = {}   # 取得条件 → 最新のScrapeJob
+        self._pending = 0
+        self.store = store
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix='scrape-worker')
+        self.hits = 0
+        self.submitted = 0
+
+    @staticmethod
+    def make_key(user_id, password, dates):
+        """取得条件のキー（別のパスワードで結果を共有しないようパスワードのハッシュを含める）"""
+        digest = hashlib.sha256(password.encode('utf-8')).hexdigest()[:16]
+        return (user_id, digest, tuple(sorted(dates)))
+
+    def submit(self, key, fetch):
+        """取得ジョブを登録（同じ条件の実行中ジョブ・TTL内の結果があればそれを返す）"""
+        with self._lock:
+            self._purge_locked()
+            job = self._by_key.get(key)
+            if job is not None:
+                if not job.finished:
+                    self.hits += 1
+                    return job
+                if job.status == DONE and time.time() - job.finished_at < self.result_ttl:
+                    self.hits += 1
+                    job = self._cached_copy_locked(job)
+                    self._save(job)
+                    return job
+
+            if self._pending >= self.max_pending:
+                raise ScrapeQueueFull(f"取得待ちのジョブが上限({self.max_pending}件)に達しています")
+
+            job = ScrapeJob(uuid.uuid4().hex[:12], key)
+            self._jobs[job.job_id] = job
+            self._by_key[key] = job
+            self._pending += 1
+            self.submitted += 1
+        if self.store is not None:
+            self._save(job)
+            self._prune_store()
+        self._executor.submit(self._run, job, fetch)
+        return job
+
+    def get(self, job_id):
+        """ジョブを取得（このプロセスに無ければストアに保存された他のWebワーカーのジョブ）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            try:
+                state = self.store.load_scrape_job(job_id)
+            except Exception as e:
+                logger.warning(f"取得ジョブの読み込みに失敗({job_id}): {e}")
+                state = None
+            if state is not None:
+                job = StoredScrapeJob(job_id, state, self.store)
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {
+                'jobs': len(self._jobs),
+                'pending': self._pending,
+                'submitted': self.submitted,
+                'hits': self.hits,
+                'maxWorkers': self.max_workers
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job, fetch):
+        with log_context(scrape_job_id=job.job_id):
+            self._run_job(job, fetch)
+
+    def _run_job(self, job, fetch):
+        job.status = RUNNING
+        self._save(job)
+        try:
+            job.result = fetch()
+            job.status = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.error_status = e.http_status if isinstance(e, ScrapeError) else 500
+            job.status = FAILED
+            logger.error(f"レッスン取得ジョブ失敗({job.job_id}): {e}")
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+            with self._lock:
+                self._pending -= 1
+            job._done.set()
+
+    def _save(self, job):
+        """ジョブの状態をストアへ保存（保存できなくてもこのプロセス内の取得は続ける）"""
+        if self.store is None:
+            return
+        try:
+            self.store.save_scrape_job(job.job_id, job.to_state())
+        except Exception as e:
+            logger.warning(f"取得ジョブの保存に失敗({job.job_id}): {e}")
+
+    def _prune_store(self):
+        try:
+            self.store.prune_scrape_jobs(self.retention)
+        except Exception as e:
+            logger.warning(f"古い取得ジョブの削除に失敗: {e}")
+
+    def _cached_copy_locked(self, job):
+        """直近の結果を新しいジョブIDで返す（取得済みなので即完了）"""
+        copy = ScrapeJob(uuid.uuid4().hex[:12], job.key)
+        copy.status = DONE
+        copy.result = job.result
+        copy.cached = True
+        copy.finished_at = job.finished_at
+        copy._done.set()
+        self._jobs[copy.job_id] = copy
+        return copy
+
+    def _purge_locked(self):
+        """保持期間を過ぎた完了済みジョブを削除"""
+        cutoff = time.time() - self.retention
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self._jobs[job_id]
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
@@ -0,0 +1,431 @@
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException
+from selenium_stealth import stealth
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+
+from governor import GOVERNOR, PROFILE_DIR_PREFIX, kill_process_tree, process_tree_rss_mb
+from lessons import parse_panel_text
+from metrics import StepTimer
+from sites import SiteUnavailable, get_site
+
+logger = logging.getLogger(__name__)
+
+# ページ要素・新しいウィンドウを待つ最大秒数
+PAGE_TIMEOUT = float(os.getenv("SCRAPER_PAGE_TIMEOUT", "15"))
+WINDOW_TIMEOUT = float(os.getenv("SCRAPER_WINDOW_TIMEOUT", "10"))
+
+# 取得に不要なリソース（画像・フォント・CSS・解析タグ）を読み込まない
+BLOCK_RESOURCES = os.getenv("SCRAPER_BLOCK_RESOURCES", "1") == "1"
+DEFAULT_BLOCKED_URLS = (
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot", "*.css",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*facebook.net*",
+)
+BLOCKED_URLS = [p.strip() for p in os.getenv("SCRAPER_BLOCKED_URLS", ",".join(DEFAULT_BLOCKED_URLS)).split(",")
+                if p.strip()]
+
+# 保存済みセッションの復元時に設定するCookieの項目
+COOKIE_FIELDS = ('name', 'value', 'path', 'domain', 'secure', 'httpOnly', 'expiry', 'sameSite')
+
+# 省メモリ設定（表示サイズ・ディスクキャッシュ・レンダラー数）
+WINDOW_SIZE = os.getenv("SCRAPER_WINDOW_SIZE", "1024,768")
+DISK_CACHE_DIR = os.getenv("SCRAPER_DISK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "chrome_cache"))
+DISK_CACHE_MB = int(os.getenv("SCRAPER_DISK_CACHE_MB", "64"))
+RENDERER_PROCESS_LIMIT = int(os.getenv("SCRAPER_RENDERER_PROCESS_LIMIT", "2"))
+DISABLED_FEATURES = (
+    "Translate", "MediaRouter", "OptimizationHints", "AutofillServerCommunication",
+    "InterestFeedContentSuggestions", "CalculateNativeWinOcclusion", "BackForwardCache",
+)
+LEAN_ARGUMENTS = (
+    '--disable-background-networking', '--disable-component-update', '--disable-default-apps',
+    '--disable-sync', '--disable-breakpad', '--disable-client-side-phishing-detection',
+    '--disable-hang-monitor', '--disable-popup-blocking', '--disable-prompt-on-repost',
+    '--disable-domain-reliability', '--disable-software-rasterizer', '--metrics-recording-only',
+    '--no-first-run', '--no-default-browser-check', '--mute-audio', '--hide-scrollbars',
+    '--password-store=basic',
+)
+
+# カレンダーの全パネルを1回のスクリプト実行で取得（パネルごとのWebDriver通信をしない）
+# 戻り値: {"YYYYMMDD": [[パネルのテキスト, {予約用の識別子}?], ...]} のJSON文字列
+EXTRACT_CALENDAR_SCRIPT = """
+var prefix = arguments[0], panelClass = arguments[1], wanted = arguments[2];
+var containers = document.querySelectorAll('[id^="' + prefix + '"]');
+var result = {};
+for (var i = 0; i < containers.length; i++) {
+  var date = containers[i].id.slice(prefix.length);
+  if (wanted && wanted.indexOf(date) < 0) continue;
+  var panels = containers[i].getElementsByClassName(panelClass);
+  var items = [];
+  for (var j = 0; j < panels.length; j++) {
+    var panel = panels[j], refs = {}, found = false;
+    var nodes = [panel].concat(Array.prototype.slice.call(panel.querySelectorAll('a,button,input,[onclick]')));
+    for (var k = 0; k < nodes.length; k++) {
+      var node = nodes[k];
+      ['id', 'href', 'onclick'].forEach(function (name) {
+        var value = node.getAttribute(name);
+        if (value && !(name in refs)) { refs[name] = value; found = true; }
+      });
+      for (var key in node.dataset) {
+        if (!(('data-' + key) in refs)) { refs['data-' + key] = node.dataset[key]; found = true; }
+      }
+    }
+    var text = panel.innerText || panel.textContent || '';
+    items.push(found ? [text, refs] : [text]);
+  }
+  result[date] = items;
+}
+return JSON.stringify(result);
+"""
+
+# カレンダーの表示状態（日付枠の有無・パネルの有無・読み込み完了）を1回で確認
+CALENDAR_STATE_SCRIPT = """
+var prefix = arguments[0], panelClass = arguments[1];
+var dates = document.querySelectorAll('[id^="' + prefix + '"]').length;
+var panels = dates ? document.querySelectorAll('[id^="' + prefix + '"] .' + panelClass).length : 0;
+return [dates, panels, document.readyState];
+"""
+
+
+class SeleniumGunzeScraper:
+    """スポーツクラブサイトのスクレイパークラス"""
+
+    def __init__(self, site=None):
+        """Chrome WebDriverを初期化"""
+        self.site = site or get_site()
+        # ホスト全体の同時起動数の上限内で起動（枠番号ごとにディスクキャッシュを使い回す）
+        self.killed = False
+        self.slot = GOVERNOR.acquire(self)
+        # ユニークなuser-data-dirを指定して競合を回避（quit時に削除）
+        self.profile_dir = os.path.join(tempfile.gettempdir(), f'{PROFILE_DIR_PREFIX}{uuid.uuid4()}')
+        self.driver = None
+        try:
+            chrome_options = self._build_options()
+            timer = StepTimer('selenium')
+            with timer.step('chrome_start'):
+                try:
+                    self.driver = webdriver.Chrome(options=chrome_options)
+                except Exception as e:
+                    logger.error(f"ChromeDriver初期化失敗: {e}")
+                    # システムのchromedriver-autoinstallerを使用
+                    import chromedriver_autoinstaller
+                    chromedriver_autoinstaller.install()
+                    self.driver = webdriver.Chrome(options=chrome_options)
+
+            # 自動化検出回避のためのステルス設定
+            self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+            stealth(
+                self.driver,
+                languages=["ja-JP", "en-US"],
+                vendor="Google Inc.",
+                platform="Win32",
+                webgl_vendor="Intel Inc.",
+                renderer="Intel Iris OpenGL Engine",
+                fix_hairline=True
+            )
+            self.main_window = self.driver.current_window_handle
+        except Exception:
+            # 起動済みのブラウザは終了し、プロファイルと枠を返す（孤立プロセスの掃除を待たない）
+            if self.driver is not None:
+                self.quit()
+            else:
+                shutil.rmtree(self.profile_dir, ignore_errors=True)
+                GOVERNOR.release(self)
+            raise
+
+        self.logged_in = False
+        self.logins = 0  # ログインフォームを送信して成功した回数
+        self.last_timings = timer.as_dict()
+        self._block_resources()
+
+    def _build_options(self):
+        """省メモリのChrome起動オプション（quit失敗時にプロセスが残らないようdetachは使わない）"""
+        chrome_options = Options()
+        chrome_options.add_argument('--no-sandbox')
+        chrome_options.add_argument('--disable-dev-shm-usage')
+        chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+        chrome_options.add_argument('--disable-extensions')
+        chrome_options.add_argument('--disable-plugins')
+        for argument in LEAN_ARGUMENTS:
+            chrome_options.add_argument(argument)
+        chrome_options.add_argument(f'--disable-features={",".join(DISABLED_FEATURES)}')
+        chrome_options.add_argument(f'--renderer-process-limit={RENDERER_PROCESS_LIMIT}')
+
+        chrome_options.add_argument(f'--user-data-dir={self.profile_dir}')
+        # キャッシュはプロファイル外に置き、同じ枠を使う次のブラウザと共有する
+        chrome_options.add_argument(f'--disk-cache-dir={os.path.join(DISK_CACHE_DIR, str(self.slot))}')
+        chrome_options.add_argument(f'--disk-cache-size={DISK_CACHE_MB * 1024 * 1024}')
+
+        # 本番環境: ヘッドレスモードで安定動作を優先
+        chrome_options.add_argument('--headless')
+        chrome_options.add_argument('--disable-gpu')
+        chrome_options.add_argument(f'--window-size={WINDOW_SIZE}')
+        chrome_options.add_argument('--remote-debugging-port=0')  # ポート競合を回避
+
+        # DOM構築完了で制御を戻し、以降は要素ごとの待機条件で判定する
+        chrome_options.page_load_strategy = 'eager'
+        if BLOCK_RESOURCES:
+            chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+            chrome_options.add_experimental_option("prefs", {
+                "profile.managed_default_content_settings.images": 2
+            })
+        return chrome_options
+
+    def _block_resources(self):
+        """現在のウィンドウで不要なリソースの読み込みを止める（CDPの設定はウィンドウごと）"""
+        if not BLOCK_RESOURCES or not BLOCKED_URLS:
+            return
+        try:
+            self.driver.execute_cdp_cmd('Network.enable', {})
+            self.driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
+        except Exception as e:
+            logger.warning(f"リソースブロック設定失敗: {e}")
+
+    def login(self, username, password):
+        """スポーツクラブサイトにログイン
+
+        ログイン画面が会員番号・パスワードを受け付けなかった場合のみFalseを返す。
+        ページの表示待ちのタイムアウト・遷移の失敗はサイト側の障害としてSiteUnavailableを送出する。
+        """
+        site = self.site
+        timer = StepTimer('selenium')
+        self.logged_in = False
+        try:
+            with timer.step('login_page'):
+                self.driver.get(site.mypage_url)
+                user_input = WebDriverWait(self.driver, PAGE_TIMEOUT).until(
+                    EC.presence_of_element_located((By.NAME, site.user_field))
+                )
+
+            with timer.step('submit'):
+                user_input.send_keys(username)
+                self.driver.find_element(By.NAME, site.password_field).send_keys(password)
+                self.driver.find_element(By.ID, site.login_button_id).click()
+                # メニューが表示されるか、ログイン画面が表示し直されるまで待つ
+                WebDriverWait(self.driver, PAGE_TIMEOUT).until(
+                    lambda d: d.find_elements(By.ID, site.menu_anchor_id) or EC.staleness_of(user_input)(d)
+                )
+                logged_in = bool(self.driver.find_elements(By.ID, site.menu_anchor_id))
+                rejected = not logged_in and bool(self.driver.find_elements(By.NAME, site.user_field))
+        except Exception as e:
+            self.last_timings = timer.as_dict()
+            logger.error(f"ログインページの表示・送信に失敗: {e} ({timer.summary()})",
+                         extra={'fields': {'timings': timer.as_dict()}})
+            raise SiteUnavailable(f"{site.name}のログインページを表示できませんでした") from e
+
+        self.last_timings = timer.as_dict()
+        if rejected:
+            logger.error(f"ログイン失敗: {username}")
+            return False
+        if not logged_in:
+            raise SiteUnavailable(f"{site.name}のログイン後のページを解釈できませんでした")
+
+        self.logged_in = True
+        self.logins += 1
+        logger.info(f"ログイン成功: {username} ({timer.summary()})",
+                    extra={'fields': {'timings': timer.as_dict()}})
+        return True
+
+    def export_cookies(self):
+        """ログイン済みセッションのCookie"""
+        return self.driver.get_cookies()
+
+    def restore_session(self, cookies):
+        """保存済みのCookieでログイン済み状態を復元（メニューが表示されればTrue）"""
+        timer = StepTimer('selenium')
+        with timer.step('restore_session'):
+            # Cookieは同じドメインのページを開いてからでないと設定できない
+            self.driver.get(self.site.mypage_url)
+            for cookie in cookies:
+                cookie = {k: v for k, v in cookie.items() if k in COOKIE_FIELDS and v is not None}
+                try:
+                    self.driver.add_cookie(cookie)
+                except Exception:
+                    # ドメイン指定が現在のページと合わない場合はページのドメインで設定
+                    cookie.pop('domain', None)
+                    try:
+                        self.driver.add_cookie(cookie)
+                    except Exception as e:
+                        logger.warning(f"Cookieの設定に失敗: {cookie.get('name')}: {e}")
+            self.driver.get(self.site.mypage_url)
+            WebDriverWait(self.driver, PAGE_TIMEOUT).until(
+                lambda d: d.find_elements(By.ID, self.site.menu_anchor_id)
+                or d.find_elements(By.NAME, self.site.user_field)
+            )
+        if not self.driver.find_elements(By.ID, self.site.menu_anchor_id):
+            self.driver.delete_all_cookies()
+            return False
+        self.logged_in = True
+        self.last_timings = timer.as_dict()
+        return True
+
+    def is_alive(self):
+        """ブラウザが応答するか確認"""
+        if self.killed:
+            return False
+        try:
+            self.driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    def reset(self):
+        """メインウィンドウ以外を閉じてマイページのトップへ戻る"""
+        for handle in self.driver.window_handles:
+            if handle != self.main_window:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+        self.driver.switch_to.window(self.main_window)
+        self.driver.get(self.site.mypage_url)
+
+    def ensure_logged_in(self, username, password):
+        """セッションが有効ならそのまま使い、期限切れの場合のみ再ログイン"""
+        if self.logged_in:
+            try:
+                self.reset()
+                WebDriverWait(self.driver, 5).until(
+                    lambda d: d.find_elements(By.ID, self.site.menu_anchor_id)
+                    or d.find_elements(By.NAME, self.site.user_field)
+                )
+                if self.driver.find_elements(By.ID, self.site.menu_anchor_id):
+                    return True
+                logger.info(f"セッション期限切れ → 再ログイン: {username}")
+            except Exception as e:
+                logger.warning(f"セッション確認失敗 → 再ログイン: {e}")
+            self.logged_in = False
+        return self.login(username, password)
+
+    def memory_usage_mb(self):
+        """ChromeDriverとChrome子プロセスの合計メモリ使用量(MB)"""
+        try:
+            return process_tree_rss_mb(self.pid)
+        except Exception:
+            return 0.0
+
+    def _open_program_page(self, timer):
+        """マイページからプログラム（カレンダー）ページへ遷移"""
+        program_anchor_id = self.site.program_anchor_id
+        with timer.step('personal_menu'):
+            known = set(self.driver.window_handles)
+            self.driver.find_element(By.ID, self.site.menu_anchor_id).click()
+
+            # 新しいウィンドウが開くか、同じウィンドウにメニューが表示されるまで待つ
+            def menu_ready(driver):
+                opened = [h for h in driver.window_handles if h not in known]
+                if opened:
+                    return opened[-1]
+                if driver.find_elements(By.ID, program_anchor_id):
+                    return driver.current_window_handle
+                return False
+
+            handle = WebDriverWait(self.driver, WINDOW_TIMEOUT).until(menu_ready)
+            if handle != self.driver.current_window_handle:
+                self.driver.switch_to.window(handle)
+                self._block_resources()
+
+        with timer.step('program_page'):
+            prog_anchor = WebDriverWait(self.driver, PAGE_TIMEOUT).until(
+                EC.element_to_be_clickable((By.ID, program_anchor_id))
+            )
+            prog_anchor.click()
+            WebDriverWait(self.driver, PAGE_TIMEOUT).until(self._calendar_ready)
+
+        logger.info("プログラムページに到達 → スクレイピング準備完了")
+
+    def _calendar_ready(self, driver):
+        """カレンダーの日付枠が表示され、レッスンのパネルが描画された（または読み込み完了）か"""
+        dates, panels, ready_state = driver.execute_script(
+            CALENDAR_STATE_SCRIPT, self.site.calendar_date_prefix, self.site.panel_class)
+        if not dates:
+            return False
+        # レッスンが1件も無い週は読み込み完了をもって準備完了とする
+        return panels > 0 or ready_state == 'complete'
+
+    def go_to_program_page_and_scrape(self, date_str):
+        """指定日のレッスン情報を取得（scraper.pyと同じ構造）"""
+        return self.go_to_program_page_and_scrape_dates([date_str]).get(date_str, [])
+
+    def go_to_program_page_and_scrape_dates(self, date_strs=None):
+        """1回のページ表示で複数日のレッスン情報を取得（None指定で表示中の全日付）"""
+        if not self.logged_in:
+            raise Exception("ログインが必要です")
+
+        timer = StepTimer('selenium')
+        try:
+            self._open_program_page(timer)
+
+            with timer.step('extract'):
+                results = self._extract_calendar(date_strs)
+            self.last_timings = timer.as_dict()
+            logger.info(f"取得時間: {timer.summary()}",
+                        extra={'fields': {'timings': timer.as_dict()}})
+            return results
+
+        except TimeoutException:
+            self.last_timings = timer.as_dict()
+            logger.error(f"プログラムページの表示待ちがタイムアウト ({timer.summary()})",
+                         extra={'fields': {'timings': timer.as_dict()}})
+            return {}
+        except Exception as e:
+            self.last_timings = timer.as_dict()
+            logger.error(f"プログラムページ遷移・取得失敗: {e}")
+            return {}
+
+    def _extract_calendar(self, date_strs):
+        """表示中のカレンダーから日付ごとのレッスン一覧を抽出（全パネルを1回のスクリプト実行で取得）"""
+        payload = self.driver.execute_script(
+            EXTRACT_CALENDAR_SCRIPT, self.site.calendar_date_prefix, self.site.panel_class,
+            list(date_strs) if date_strs else None)
+        results = {}
+        for date_str, panels in json.loads(payload or '{}').items():
+            logger.info(f"指定日({date_str})のパネル数: {len(panels)}")
+            lessons = []
+            for panel in panels:
+                try:
+                    lesson = parse_panel_text(panel[0], date_str)
+                except Exception as ex:
+                    logger.warning(f"パネル処理エラー: {ex}")
+                    continue
+                if lesson:
+                    lesson.booking = panel[1] if len(panel) > 1 else None
+                    lessons.append(lesson)
+
+            for lesson in lessons:
+                logger.debug(f"{lesson.date} {lesson.time} {lesson.name}")
+            results[date_str] = lessons
+
+        return results
+
+    @property
+    def pid(self):
+        """ChromeDriverのプロセスID（起動前はNone）"""
+        try:
+            return self.driver.service.process.pid
+        except AttributeError:
+            return None
+
+    def kill(self):
+        """ChromeDriverとChromeのプロセスを強制終了（以後is_aliveはFalse）"""
+        self.killed = True
+        try:
+            kill_process_tree(self.pid)
+        except Exception as e:
+            logger.warning(f"ブラウザの強制終了に失敗: {e}")
+
+    def quit(self):
+        """WebDriverを終了し一時プロファイルを削除（終了できなければプロセスを強制終了）"""
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.warning(f"WebDriverの終了に失敗 → 強制終了: {e}")
+            self.kill()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        GOVERNOR.release(self)
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from metrics import SESSION_RESTORES
+
+logger = logging.getLogger(__name__)
+
+
+def _load_key(path, generate, wait=5.0):
+    """暗号鍵を読み込む（ファイルが無ければ生成。複数プロセスが同時に起動しても同じ鍵になる）
+
+    鍵は一時ファイルに書き切ってからリンクで配置するため、他のプロセスが書きかけの鍵を読むことはない。
+    """
+    if not os.path.exists(path):
+        fd, tmp_path = tempfile.mkstemp(prefix='.session_vault_key_', dir=os.path.dirname(path) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(generate())
+                f.flush()
+                os.fsync(f.fileno())
+            # 既に他のプロセスが配置していればFileExistsErrorとなり、そちらの鍵を使う
+            os.link(tmp_path, path)
+            logger.info(f"セッション保存用の暗号鍵を作成しました: {path}")
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+
+    # 旧バージョンが作成中の空ファイルを読んだ場合に備えて、中身が揃うまで待つ
+    deadline = time.time() + wait
+    while True:
+        with open(path, 'rb') as f:
+            key = f.read().strip()
+        if key or time.time() >= deadline:
+            break
+        time.sleep(0.05)
+    if not key:
+        raise ValueError(f"暗号鍵のファイルが空です: {path}")
+    return key
+
+
+class SecretBox:
+    """鍵ファイルの鍵による暗号化（Cookie・監視ジョブのパスワードで共通。cryptographyは初回の使用時に読み込む）"""
+
+    def __init__(self, key=None):
+        self._key = key
+        self._fernet = None
+        self._invalid_token = None
+        self._available = True
+        self._lock = threading.Lock()
+
+    def _cipher(self):
+        """暗号化器（cryptographyはAPIだけのプロセスで読み込まないよう、初回の暗号化・復号時に読み込む）"""
+        if self._fernet is not None or not self._available:
+            return self._fernet
+        with self._lock:
+            if self._fernet is None and self._available:
+                try:
+                    from cryptography.fernet import Fernet, InvalidToken
+                except ImportError:  # 未インストールの場合は暗号化しない（呼び出し元で平文・保存なしを選ぶ）
+                    logger.warning("cryptographyが未インストールのため、暗号化を利用できません")
+                    self._available = False
+                    return None
+                key = self._key or os.getenv("SESSION_VAULT_KEY") or _load_key(
+                    os.getenv("SESSION_VAULT_KEY_FILE", "session_vault.key"), Fernet.generate_key)
+                self._invalid_token = InvalidToken
+                self._fernet = Fernet(key)
+        return self._fernet
+
+    @property
+    def enabled(self):
+        return self._cipher() is not None
+
+    def encrypt(self, data):
+        return self._cipher().encrypt(data)
+
+    def decrypt(self, token, ttl=None):
+        """復号（鍵の変更・改ざん・期限切れ、暗号化を利用できない場合はValueError）"""
+        cipher = self._cipher()
+        if cipher is None:
+            raise ValueError("暗号化を利用できません")
+        try:
+            return cipher.decrypt(bytes(token), ttl=ttl)
+        except self._invalid_token:
+            raise ValueError("暗号化されたデータを復号できません")
+
+    def encrypt_text(self, text):
+        return self.encrypt(text.encode('utf-8')).decode('ascii')
+
+    def decrypt_text(self, token):
+        return self.decrypt(token.encode('ascii')).decode('utf-8')
+
+
+class SessionVault:
+    """会員ごとのログイン済みCookieを暗号化してストアに保存し、次回の起動時に再利用する"""
+
+    def __init__(self, store, key=None, max_age=None, box=None):
+        self.store = store
+        self.max_age = max_age or float(os.getenv("SESSION_VAULT_MAX_AGE", "21600"))
+        self.box = box or SecretBox(key)
+        self._available = os.getenv("SESSION_VAULT_ENABLED", "1") == "1"
+
+    @property
+    def enabled(self):
+        return self._available and self.box.enabled
+
+    @staticmethod
+    def _fingerprint(user_id, password):
+        """パスワードが変わった場合に古いCookieを使わないための照合値"""
+        return hashlib.sha256(f"{user_id}\0{password}".encode('utf-8')).hexdigest()
+
+    def load(self, user_id, password):
+        """保存済みのCookie一覧（無い・期限切れ・パスワード不一致ならNone）"""
+        if not self.enabled:
+            return None
+        token = self.store.load_session(user_id, self.max_age)
+        if token is None:
+            SESSION_RESTORES.inc(result='missing')
+            return None
+        try:
+            payload = json.loads(self.box.decrypt(token, ttl=int(self.max_age)))
+        except ValueError:
+            # 鍵の変更・期限切れ
+            self.store.delete_session(user_id)
+            SESSION_RESTORES.inc(result='invalid')
+            return None
+        if payload.get('fingerprint') != self._fingerprint(user_id, password):
+            SESSION_RESTORES.inc(result='invalid')
+            return None
+        return payload.get('cookies') or None
+
+    def save(self, user_id, password, cookies):
+        """ログイン直後のCookieを保存"""
+        if not self.enabled or not cookies:
+            return
+        payload = {'fingerprint': self._fingerprint(user_id, password), 'cookies': cookies,
+                   'saved_at': time.time()}
+        try:
+            self.store.save_session(user_id, self.box.encrypt(json.dumps(payload).encode('utf-8')))
+        except Exception as e:
+            logger.warning(f"ログイン済みセッションの保存に失敗: {e}")
+
+    def discard(self, user_id):
+        """保存済みのCookieを破棄（ログイン失敗・セッション無効時）"""
+        if self.enabled:
+            self.store.delete_session(user_id)
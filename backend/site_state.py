@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+import os
+import sqlite3
+import tempfile
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS breakers (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    failures INTEGER NOT NULL,
+    trips INTEGER NOT NULL,
+    timeout REAL NOT NULL,
+    opened_at REAL NOT NULL,
+    probe_started REAL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class SiteStateStore:
+    """サーキットブレーカーとトークンバケットの状態を、同じホストのプロセス間で共有するSQLiteファイル
+
+    gunicornの各ワーカー・監視プロセス・取得ワーカーが同じファイルを読み書きするため、
+    サイトへのアクセス頻度の上限と遮断状態はホスト全体で1つになる。ファイルは初回の使用時に作成する。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv(
+            "SITE_STATE_PATH", os.path.join(tempfile.gettempdir(), 'lesson_monitor_sites.db'))
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self):
+        """スレッドごとの接続（WALモード、トランザクションは明示的に開始）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(SCHEMA)
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """書き込みロックを取ったトランザクション（読み込みから書き戻しまで他のプロセスを待たせる）"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+SITE_STATE = SiteStateStore()
@@ -0,0 +1,143 @@
+from contextlib import contextmanager
+import importlib
+import logging
+import os
+import threading
+import time
+
+from calendar_parser import CALENDAR_DATE_PREFIX, PANEL_CLASS, extract_panel_texts
+from circuit import CircuitBreaker
+from ratelimit import TokenBucket
+from site_state import SITE_STATE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SITE = os.getenv("DEFAULT_SITE", "gunze")
+SITE_ACQUIRE_TIMEOUT = float(os.getenv("SITE_ACQUIRE_TIMEOUT", "120"))
+
+# ログイン・ページ遷移の失敗がこの回数続いたらサイトへのアクセスを一時停止し、時間をおいて1件だけ試す
+SITE_BREAKER_FAILURES = int(os.getenv("SITE_BREAKER_FAILURES", "5"))
+SITE_BREAKER_RESET_SECONDS = float(os.getenv("SITE_BREAKER_RESET_SECONDS", "60"))
+SITE_BREAKER_MAX_RESET_SECONDS = float(os.getenv("SITE_BREAKER_MAX_RESET_SECONDS", "900"))
+
+
+class UnknownSite(ValueError):
+    """登録されていないサイトIDが指定された"""
+
+
+class SiteBusy(Exception):
+    """サイトへの同時アクセス数・アクセス頻度の上限に達し、空きを待ちきれなかった"""
+
+
+class SiteUnavailable(Exception):
+    """サイトからカレンダーを取得できなかった（タイムアウト・ページ遷移の失敗）"""
+
+
+class Site:
+    """1つのクラブ（マイページ）のアダプター
+
+    ログイン・メニュー遷移で使う要素、カレンダーの抽出方法、同時アクセス数と
+    アクセス頻度の上限、障害時にアクセスを止めるサーキットブレーカーを持つ。nesty-gcloud系の標準画面と異なるサイトは
+    このクラスを継承して create_scraper / extract_panel_texts を差し替える。
+    """
+
+    def __init__(self, site_id, name, mypage_url, max_concurrency=2, rate_per_minute=30, burst=None,
+                 backend=None, user_field='会員番号', password_field='パスワード',
+                 login_button_id='DN10BtnLogin', menu_anchor_id='menuItemAnchorWebPersonal',
+                 program_anchor_id='menuItemAnchor__sisetu3',
+                 calendar_date_prefix=CALENDAR_DATE_PREFIX, panel_class=PANEL_CLASS):
+        self.site_id = site_id
+        self.name = name
+        self.mypage_url = mypage_url
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.rate_per_minute = float(rate_per_minute)
+        self.backend = backend
+        self.user_field = user_field
+        self.password_field = password_field
+        self.login_button_id = login_button_id
+        self.menu_anchor_id = menu_anchor_id
+        self.program_anchor_id = program_anchor_id
+        self.calendar_date_prefix = calendar_date_prefix
+        self.panel_class = panel_class
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        # アクセス頻度と遮断状態はホスト内の全プロセスで共有（同時アクセス数はプロセスごと）
+        self._bucket = TokenBucket(self.rate_per_minute / 60, burst or self.max_concurrency,
+                                   name=site_id, shared=SITE_STATE)
+        self.breaker = CircuitBreaker(site_id, SITE_BREAKER_FAILURES, SITE_BREAKER_RESET_SECONDS,
+                                      SITE_BREAKER_MAX_RESET_SECONDS, shared=SITE_STATE)
+
+    def create_scraper(self, backend=None):
+        """このサイト用のスクレイパーを生成"""
+        from http_scraper import create_scraper
+        return create_scraper(backend or self.backend, site=self)
+
+    def extract_panel_texts(self, html):
+        """プログラムページのHTMLから {YYYYMMDD: [パネルテキスト, ...]} を取得"""
+        return extract_panel_texts(html, self.calendar_date_prefix, self.panel_class)
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """このサイトへのアクセス枠を確保（同時アクセス数とアクセス頻度の上限内で実行。遮断中はCircuitOpen）"""
+        self.breaker.before_call()
+        timeout = SITE_ACQUIRE_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise SiteBusy(f"{self.name}への同時アクセス数が上限({self.max_concurrency})に達しています")
+        try:
+            if not self._bucket.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise SiteBusy(f"{self.name}へのアクセス頻度が上限({self.rate_per_minute:g}回/分)に達しています")
+            yield self
+        finally:
+            self._slots.release()
+
+    def wait_time(self):
+        """アクセスできるまでの秒数（遮断中・アクセス頻度の上限に達していれば0より大きい。枠は確保しない）"""
+        return max(self.breaker.retry_after(), self._bucket.wait_time())
+
+    def to_dict(self):
+        return {
+            'id': self.site_id,
+            'name': self.name,
+            'url': self.mypage_url,
+            'maxConcurrency': self.max_concurrency,
+            'ratePerMinute': self.rate_per_minute,
+            'circuit': self.breaker.to_dict()
+        }
+
+
+# サイトID → アダプターのモジュール（SITE を定義）。使われるまで読み込まない
+_ADAPTERS = {'gunze': 'sites.gunze'}
+_loaded = {}
+_lock = threading.Lock()
+
+# 追加のアダプター（例: SITE_ADAPTERS="club2=mysites.club2,club3=mysites.club3"）
+for _item in os.getenv("SITE_ADAPTERS", "").split(','):
+    if '=' in _item:
+        _site_id, _module = _item.split('=', 1)
+        _ADAPTERS[_site_id.strip()] = _module.strip()
+
+
+def register(site_id, module):
+    """アダプターのモジュールを登録"""
+    with _lock:
+        _ADAPTERS[site_id] = module
+        _loaded.pop(site_id, None)
+
+
+def site_ids():
+    return sorted(_ADAPTERS)
+
+
+def get_site(site_id=None):
+    """サイトIDのアダプター（省略時は既定のサイト。初回のみモジュールを読み込む）"""
+    site_id = site_id or DEFAULT_SITE
+    with _lock:
+        site = _loaded.get(site_id)
+        if site is not None:
+            return site
+        module = _ADAPTERS.get(site_id)
+        if module is None:
+            raise UnknownSite(f"未対応のサイトです: {site_id}")
+        site = _loaded[site_id] = importlib.import_module(module).SITE
+    logger.info(f"サイトアダプターを読み込みました: {site_id} ({module})")
+    return site
@@ -0,0 +1,11 @@
+import os
+
+from calendar_parser import MYPAGE_URL
+from sites import Site
+
+# グンゼスポーツ（nesty-gcloud の標準画面）
+SITE = Site(
+    'gunze', 'グンゼスポーツ', MYPAGE_URL,
+    max_concurrency=int(os.getenv("GUNZE_MAX_CONCURRENCY", "2")),
+    rate_per_minute=float(os.getenv("GUNZE_RATE_PER_MINUTE", "30"))
+)
@@ -0,0 +1,414 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from lessons import Lesson
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    status TEXT,
+    version INTEGER NOT NULL DEFAULT 1,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    job_id TEXT NOT NULL,
+    lesson_id TEXT NOT NULL,
+    date TEXT,
+    time TEXT NOT NULL,
+    name TEXT NOT NULL,
+    remaining INTEGER,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, lesson_id)
+);
+CREATE TABLE IF NOT EXISTS lessons (
+    lesson_id TEXT PRIMARY KEY,
+    date TEXT,
+    time TEXT NOT NULL,
+    name TEXT NOT NULL,
+    remaining INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lesson_id TEXT NOT NULL,
+    remaining INTEGER,
+    observed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    job_id TEXT,
+    user_id TEXT,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    pid INTEGER PRIMARY KEY,
+    role TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scrape_jobs (
+    job_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_lesson ON history (lesson_id, observed_at);
+CREATE INDEX IF NOT EXISTS lessons_slot ON lessons (name, time);
+"""
+
+
+class MonitorStore:
+    """監視ジョブ定義・最新スナップショット・残り枠履歴を保持するSQLiteストア"""
+
+    def __init__(self, path=None, secrets=None):
+        self.path = path or os.getenv("MONITOR_DB_PATH", "monitoring.db")
+        # ジョブ定義のパスワードの暗号化（session_vault.SecretBox。暗号化できない場合は平文で保存）
+        self.secrets = secrets
+        self._local = threading.local()
+        created = not os.path.exists(self.path)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+        if created:
+            # パスワード等を含むため所有者のみ読み書き可能にする
+            try:
+                os.chmod(self.path, 0o600)
+            except OSError:
+                pass
+
+    def _conn(self):
+        """スレッドごとの接続（WALモード）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self, conn):
+        """旧バージョンで作成したテーブルに列を追加"""
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if 'status' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN status TEXT")
+        if 'version' not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+    # ジョブ定義
+
+    def save_job(self, job_id, user_id, state, active, status=None, keep_snapshot=False):
+        """ジョブ定義を保存し、新しい版数を返す（定義が変わるたびに版数が上がる）
+
+        keep_snapshot: 監視範囲（会員・サイト・日付）が同じ定義変更なら、前回のスナップショットと
+        実行状況を残して差分判定を継続する
+        """
+        with self._conn() as conn:
+            return self._save_job(conn, job_id, user_id, state, active, status, keep_snapshot)
+
+    def apply_jobs(self, saves=(), deletes=()):
+        """複数ジョブの保存・削除を1つのトランザクションで反映
+
+        saves: (job_id, user_id, state, active, keep_snapshot) の一覧
+        戻り値: (ジョブID → 版数, 削除できたジョブIDの一覧)
+        """
+        versions, deleted = {}, []
+        with self._conn() as conn:
+            for job_id, user_id, state, active, keep_snapshot in saves:
+                versions[job_id] = self._save_job(conn, job_id, user_id, state, active, None, keep_snapshot)
+            for job_id in deletes:
+                if self._delete_job(conn, job_id):
+                    deleted.append(job_id)
+        return versions, deleted
+
+    def _save_job(self, conn, job_id, user_id, state, active, status, keep_snapshot):
+        conn.execute(
+            "INSERT INTO jobs (job_id, user_id, state, active, status, version, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, 1, ?) "
+            "ON CONFLICT(job_id) DO UPDATE SET user_id=excluded.user_id, state=excluded.state, "
+            "active=excluded.active, "
+            "status=CASE WHEN ? THEN COALESCE(excluded.status, jobs.status) ELSE excluded.status END, "
+            "version=jobs.version + 1, updated_at=excluded.updated_at",
+            (job_id, user_id, self._dump_state(state), 1 if active else 0,
+             json.dumps(status, ensure_ascii=False) if status else None, time.time(),
+             1 if keep_snapshot else 0)
+        )
+        if not keep_snapshot:
+            # 定義が変わったので前回のスナップショットは使わない
+            conn.execute("DELETE FROM snapshots WHERE job_id = ?", (job_id,))
+        return conn.execute("SELECT version FROM jobs WHERE job_id = ?", (job_id,)).fetchone()['version']
+
+    def set_job_active(self, job_id, active):
+        """ジョブの実行・一時停止を切り替え（版数が上がる。ジョブが無ければFalse）"""
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET active = ?, version = version + 1, updated_at = ? WHERE job_id = ?",
+                (1 if active else 0, time.time(), job_id)
+            )
+        return cursor.rowcount > 0
+
+    def update_job_status(self, job_id, status, active=None):
+        """監視プロセスから実行状況を更新（版数は変えず、削除済みのジョブは復活させない）"""
+        with self._conn() as conn:
+            if active is None:
+                conn.execute("UPDATE jobs SET status = ? WHERE job_id = ?",
+                             (json.dumps(status, ensure_ascii=False), job_id))
+            else:
+                conn.execute("UPDATE jobs SET status = ?, active = ? WHERE job_id = ?",
+                             (json.dumps(status, ensure_ascii=False), 1 if active else 0, job_id))
+
+    def job_versions(self):
+        """ジョブID → 定義の版数"""
+        return {row['job_id']: row['version']
+                for row in self._conn().execute("SELECT job_id, version FROM jobs")}
+
+    def delete_job(self, job_id):
+        """ジョブ定義をスナップショットごと削除（ジョブが無ければFalse）"""
+        with self._conn() as conn:
+            return self._delete_job(conn, job_id)
+
+    @staticmethod
+    def _delete_job(conn, job_id):
+        conn.execute("DELETE FROM snapshots WHERE job_id = ?", (job_id,))
+        return conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,)).rowcount > 0
+
+    def load_jobs(self, user_id=None):
+        """保存済みのジョブ一覧（会員番号で絞り込み可）"""
+        query = "SELECT job_id, user_id, state, active, status, version FROM jobs"
+        if user_id is None:
+            rows = self._conn().execute(query + " ORDER BY rowid").fetchall()
+        else:
+            rows = self._conn().execute(query + " WHERE user_id = ? ORDER BY rowid", (user_id,)).fetchall()
+        return [self._job_row(row) for row in rows]
+
+    def load_job(self, job_id):
+        row = self._conn().execute(
+            "SELECT job_id, user_id, state, active, status, version FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return self._job_row(row) if row else None
+
+    def encrypt_job_passwords(self):
+        """平文で保存されているジョブ定義のパスワードを暗号化（版数は変えない。暗号化した件数を返す）"""
+        if self.secrets is None or not self.secrets.enabled:
+            return 0
+        count = 0
+        with self._conn() as conn:
+            for row in conn.execute("SELECT job_id, state FROM jobs").fetchall():
+                state = json.loads(row['state'])
+                if state.get('password') is None:
+                    continue
+                conn.execute("UPDATE jobs SET state = ? WHERE job_id = ?",
+                             (self._dump_state(state), row['job_id']))
+                count += 1
+        return count
+
+    def _dump_state(self, state):
+        """ジョブ定義をJSONに変換（パスワードは password_enc として暗号化）"""
+        if self.secrets is not None and state.get('password') is not None and self.secrets.enabled:
+            state = dict(state)
+            state['password_enc'] = self.secrets.encrypt_text(state.pop('password'))
+        return json.dumps(state, ensure_ascii=False)
+
+    def _load_state(self, data):
+        state = json.loads(data)
+        token = state.pop('password_enc', None)
+        if token is not None:
+            try:
+                if self.secrets is None:
+                    raise ValueError("暗号鍵が設定されていません")
+                state['password'] = self.secrets.decrypt_text(token)
+            except ValueError as e:
+                # 鍵の変更・紛失時は再入力が必要（空のパスワードとして扱う）
+                logger.error(f"ジョブ定義のパスワードを復号できません: {e}")
+                state['password'] = ''
+        return state
+
+    def _job_row(self, row):
+        return {
+            'job_id': row['job_id'],
+            'user_id': row['user_id'],
+            'state': self._load_state(row['state']),
+            'active': bool(row['active']),
+            'status': json.loads(row['status']) if row['status'] else None,
+            'version': row['version']
+        }
+
+    # スナップショット
+
+    def save_snapshot(self, job_id, lessons):
+        """ジョブの最新スナップショット（ID → Lesson）を置き換え"""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("DELETE FROM snapshots WHERE job_id = ?", (job_id,))
+            conn.executemany(
+                "INSERT INTO snapshots (job_id, lesson_id, date, time, name, remaining, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(job_id, l.key, l.date, l.time, l.name, l.remaining, now) for l in lessons.values()]
+            )
+
+    def load_snapshot(self, job_id):
+        """ジョブの最新スナップショット（ID → Lesson）"""
+        rows = self._conn().execute(
+            "SELECT date, time, name, remaining FROM snapshots WHERE job_id = ?", (job_id,)
+        ).fetchall()
+        lessons = [Lesson(row['date'], row['time'], row['name'], row['remaining']) for row in rows]
+        return {lesson.key: lesson for lesson in lessons}
+
+    # イベント（監視プロセスからWebワーカーへの中継）
+
+    def append_event(self, type, job_id, user_id, data):
+        """イベントを追加し、採番したIDを返す"""
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "INSERT INTO events (type, job_id, user_id, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                (type, job_id, user_id, json.dumps(data, ensure_ascii=False), time.time())
+            )
+        return cursor.lastrowid
+
+    def events_since(self, last_id, limit=500):
+        """指定ID以降のイベント（古い順）"""
+        rows = self._conn().execute(
+            "SELECT id, type, job_id, user_id, data FROM events WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, limit)
+        ).fetchall()
+        return [dict(row, data=json.loads(row['data'])) for row in rows]
+
+    def last_event_id(self):
+        row = self._conn().execute("SELECT MAX(id) AS id FROM events").fetchone()
+        return row['id'] or 0
+
+    def prune_events(self, max_age):
+        """古いイベントを削除"""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM events WHERE created_at < ?", (time.time() - max_age,))
+
+    # メトリクス（プロセスごとの値を /metrics で合算）
+
+    def save_metrics(self, pid, role, snapshot):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO metrics (pid, role, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(pid) DO UPDATE SET role=excluded.role, data=excluded.data, "
+                "updated_at=excluded.updated_at",
+                (pid, role, json.dumps(snapshot), time.time())
+            )
+
+    def load_metrics(self, max_age):
+        """max_age秒以内に更新されたプロセスのメトリクス（古いものは削除）"""
+        cutoff = time.time() - max_age
+        with self._conn() as conn:
+            conn.execute("DELETE FROM metrics WHERE updated_at < ?", (cutoff,))
+            rows = conn.execute("SELECT pid, data FROM metrics").fetchall()
+        return {row['pid']: json.loads(row['data']) for row in rows}
+
+    # ログイン済みセッション（暗号化済みのCookie）
+
+    def save_session(self, user_id, data):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at",
+                (user_id, data, time.time())
+            )
+
+    def load_session(self, user_id, max_age):
+        """max_age秒以内に保存されたセッション（無ければNone）"""
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE user_id = ? AND updated_at >= ?",
+            (user_id, time.time() - max_age)
+        ).fetchone()
+        return row['data'] if row else None
+
+    def delete_session(self, user_id):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    # レッスン取得ジョブ（受け付けたWebワーカー以外からも状態・結果を参照できるようにする）
+
+    def save_scrape_job(self, job_id, data):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO scrape_jobs (job_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(job_id) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at",
+                (job_id, json.dumps(data, ensure_ascii=False), time.time())
+            )
+
+    def load_scrape_job(self, job_id):
+        row = self._conn().execute("SELECT data FROM scrape_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def prune_scrape_jobs(self, max_age):
+        """max_age秒以上更新されていない取得ジョブを削除"""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM scrape_jobs WHERE updated_at < ?", (time.time() - max_age,))
+
+    # 残り枠履歴
+
+    def record_observations(self, lessons, observed_at=None):
+        """取得したレッスンの残り枠を記録（前回から変化した場合のみ履歴に追加）"""
+        observed_at = observed_at or time.time()
+        with self._conn() as conn:
+            known = {}
+            keys = [l.key for l in lessons]
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT lesson_id, remaining FROM lessons WHERE lesson_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                known.update((row['lesson_id'], row['remaining']) for row in rows)
+
+            changed = [l for l in lessons if l.key not in known or known[l.key] != l.remaining]
+            conn.executemany(
+                "INSERT INTO lessons (lesson_id, date, time, name, remaining, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(lesson_id) DO UPDATE SET remaining=excluded.remaining, updated_at=excluded.updated_at",
+                [(l.key, l.date, l.time, l.name, l.remaining, observed_at) for l in changed]
+            )
+            conn.executemany(
+                "INSERT INTO history (lesson_id, remaining, observed_at) VALUES (?, ?, ?)",
+                [(l.key, l.remaining, observed_at) for l in changed]
+            )
+        return len(changed)
+
+    def lesson(self, lesson_id):
+        row = self._conn().execute(
+            "SELECT lesson_id, date, time, name, remaining, updated_at FROM lessons WHERE lesson_id = ?",
+            (lesson_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def lesson_history(self, lesson_id, since=None, limit=500):
+        """レッスン1件の残り枠の推移（古い順）"""
+        rows = self._conn().execute(
+            "SELECT remaining, observed_at FROM history WHERE lesson_id = ? AND observed_at >= ? "
+            "ORDER BY observed_at DESC LIMIT ?",
+            (lesson_id, since or 0, limit)
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def slot_history(self, name, time_str, since=None, limit=2000):
+        """同じレッスン名・開始時刻の全日付の残り枠の推移（空きが出やすい時間帯の分析用）"""
+        rows = self._conn().execute(
+            "SELECT l.lesson_id, l.date, h.remaining, h.observed_at FROM history h "
+            "JOIN lessons l ON l.lesson_id = h.lesson_id "
+            "WHERE l.name = ? AND l.time = ? AND h.observed_at >= ? "
+            "ORDER BY h.observed_at DESC LIMIT ?",
+            (name, time_str, since or 0, limit)
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# backend 直下のモジュールを読み込めるようにする
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# 監視DB・ロック・鍵ファイルはテスト用の一時ディレクトリに作る（app の読み込み前に設定）
+TEST_DIR = tempfile.mkdtemp(prefix='lesson_monitor_test_')
+os.environ.setdefault('MONITOR_DB_PATH', os.path.join(TEST_DIR, 'monitoring.db'))
+os.environ.setdefault('MONITOR_LEADER_LOCK', os.path.join(TEST_DIR, 'monitor_leader.lock'))
+os.environ.setdefault('SESSION_VAULT_KEY_FILE', os.path.join(TEST_DIR, 'session_vault.key'))
+os.environ.setdefault('JOB_QUEUE_PATH', os.path.join(TEST_DIR, 'job_queue.db'))
+os.environ.setdefault('GOVERNOR_LOCK_DIR', TEST_DIR)
+os.environ.setdefault('SITE_STATE_PATH', os.path.join(TEST_DIR, 'sites.db'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from bench.fake_site import FakeClubSite, SeatModel  # noqa: E402
+
+FAKE_PASSWORD = 'password'
+
+
+@pytest.fixture
+def fake_site():
+    """ローカルの偽サイト（残り枠は変動させない）"""
+    site = FakeClubSite(password=FAKE_PASSWORD, seat_model=SeatModel(days=3, churn_interval=0)).start()
+    yield site
+    site.stop()
+
+
+@pytest.fixture
+def club(fake_site, tmp_path, monkeypatch):
+    """偽サイトを指すサイトアダプター（アクセス頻度の上限は実質無し。遮断状態はテストごとに別）"""
+    import sites
+    from site_state import SiteStateStore
+    monkeypatch.setattr(sites, 'SITE_STATE', SiteStateStore(str(tmp_path / 'sites.db')))
+    return sites.Site('fake', '偽サイト', fake_site.mypage_url, max_concurrency=4, rate_per_minute=60000)
+
+
+@pytest.fixture
+def api(fake_site, monkeypatch):
+    """偽サイトに対してHTTP版で取得するAPI"""
+    import app as app_module
+    from circuit import CircuitBreaker
+    from ratelimit import TokenBucket
+    from scrape_jobs import ScrapeJobManager
+    from sites import get_site
+
+    site = get_site()
+    monkeypatch.setattr(site, 'mypage_url', fake_site.mypage_url)
+    monkeypatch.setattr(site, '_bucket', TokenBucket(1000, 100))
+    monkeypatch.setattr(site, 'breaker', CircuitBreaker(site.site_id))
+    monkeypatch.setenv('SCRAPER_BACKEND', 'http')
+    monkeypatch.setattr(app_module, 'calendar_caches', {})
+    monkeypatch.setattr(app_module, 'scrape_jobs', ScrapeJobManager())
+    monkeypatch.setattr(app_module, 'driver_pool', None)
+    yield app_module.app.test_client()
+    if app_module.driver_pool is not None:
+        app_module.driver_pool.shutdown()
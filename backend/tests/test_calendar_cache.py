@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from calendar_cache import CalendarCache, credential_key
+from driver_pool import LoginError
+
+from conftest import FAKE_PASSWORD
+
+
+def _deny():
+    raise LoginError("ログイン失敗")
+
+
+def test_cached_result_requires_caller_login():
+    cache = CalendarCache(ttl=60)
+    cache.get_many(['20300101'], lambda dates: {'20300101': ['A']}, credential_key('u1', 'pw'), _deny)
+
+    with pytest.raises(LoginError):
+        cache.get_many(['20300101'], lambda dates: pytest.fail("再取得した"), credential_key('u2', 'WRONG'), _deny)
+
+
+def test_verified_caller_skips_login_check():
+    cache = CalendarCache(ttl=60)
+    logins = []
+    principal = credential_key('u1', 'pw')
+    cache.get_many(['20300101'], lambda dates: {'20300101': ['A']}, principal, _deny)
+
+    # 自分で取得した認証情報はログイン確認を省略
+    assert cache.get_many(['20300101'], None, principal, _deny) == {'20300101': ['A']}
+    # 他の会員は初回だけ確認
+    other = credential_key('u2', 'pw2')
+    for _ in range(2):
+        assert cache.get_many(['20300101'], None, other, lambda: logins.append(1)) == {'20300101': ['A']}
+    assert logins == [1]
+
+
+def test_inflight_result_requires_caller_login():
+    cache = CalendarCache(ttl=60)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_fetch(dates):
+        started.set()
+        release.wait(5)
+        return {'20300101': ['A']}
+
+    fetcher = threading.Thread(target=cache.get_many,
+                               args=(['20300101'], slow_fetch, credential_key('u1', 'pw'), _deny))
+    fetcher.start()
+    started.wait(5)
+    try:
+        with pytest.raises(LoginError):
+            cache.get_many(['20300101'], slow_fetch, credential_key('u2', 'WRONG'), _deny)
+    finally:
+        release.set()
+        fetcher.join()
+
+
+def _scrape(client, user_id, password, date_str):
+    date = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}"
+    return client.post('/api/scrape_lessons?wait=30', json={'userId': user_id, 'password': password, 'date': date})
+
+
+def test_wrong_password_on_cached_date_returns_401(api, fake_site):
+    date_str = sorted(fake_site.seats.snapshot())[0]
+    assert _scrape(api, 'u1', FAKE_PASSWORD, date_str).status_code == 200
+
+    response = _scrape(api, 'u2', 'WRONG', date_str)
+    assert response.status_code == 401
+
+
+def test_cached_date_served_after_login_check(api, fake_site):
+    date_str = sorted(fake_site.seats.snapshot())[0]
+    assert _scrape(api, 'u1', FAKE_PASSWORD, date_str).status_code == 200
+
+    response = _scrape(api, 'u2', FAKE_PASSWORD, date_str)
+    assert response.status_code == 200
+    assert len(response.get_json()['lessons']) == len(fake_site.seats.snapshot()[date_str])
+    # u2はログインの確認だけで、カレンダーは取得し直さない
+    requests = fake_site.stats()['requests']
+    assert requests['/mypage/login'] == 2
+    assert requests['/mypage/program'] == 1
@@ -0,0 +1,89 @@
+import pytest
+
+import circuit
+from circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit, 'time', clock)
+    return clock
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('site', failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    clock.sleep(20)
+    with pytest.raises(CircuitOpen) as e:
+        breaker.before_call()
+    assert e.value.retry_after == 40
+
+
+def test_half_open_allows_one_probe(clock):
+    breaker = CircuitBreaker('site', failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    clock.sleep(60)
+
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    clock.sleep(15)
+    # 試行中の他の呼び出しは、試行の期限までの残り時間を返す
+    with pytest.raises(CircuitOpen) as e:
+        breaker.before_call()
+    assert e.value.retry_after == 45
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_doubles_timeout(clock):
+    breaker = CircuitBreaker('site', failure_threshold=1, reset_timeout=60, max_reset_timeout=100)
+    breaker.record_failure()
+    clock.sleep(60)
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert breaker.retry_after() == 100
+
+
+def test_state_is_shared_between_instances(clock, tmp_path):
+    from site_state import SiteStateStore
+    path = str(tmp_path / 'sites.db')
+    # 別のプロセスのブレーカーに相当（同じファイルを別の接続で読み書き）
+    first = CircuitBreaker('site', failure_threshold=2, reset_timeout=60, shared=SiteStateStore(path))
+    second = CircuitBreaker('site', failure_threshold=2, reset_timeout=60, shared=SiteStateStore(path))
+
+    first.record_failure()
+    second.record_failure()
+    with pytest.raises(CircuitOpen):
+        first.before_call()
+    assert second.to_dict()['state'] == OPEN
+
+    clock.sleep(60)
+    first.before_call()
+    # 1件目の試行中は他のインスタンスも待たせる
+    with pytest.raises(CircuitOpen):
+        second.before_call()
+    first.record_success()
+    second.before_call()
@@ -0,0 +1,129 @@
+import pytest
+
+from diff_engine import ADDED, FILLED, OPENED, REMOVED, THRESHOLD, WatchRule, diff_snapshots
+from lessons import Lesson, index_lessons
+
+
+def _lessons(*seats):
+    """(時刻, 残り枠) の一覧 → Lesson の一覧（同じ日付で時刻ごとに別のレッスン）"""
+    return [Lesson('2030-01-01', time, f"レッスン{time}", remaining) for time, remaining in seats]
+
+
+def _types(events):
+    return sorted((e.type, e.lesson.time) for e in events)
+
+
+def test_opened_and_filled():
+    before = index_lessons(_lessons(('09:30', 0), ('10:45', 3)))
+    after = index_lessons(_lessons(('09:30', 2), ('10:45', 0)))
+
+    assert _types(diff_snapshots(before, after)) == [(FILLED, '10:45'), (OPENED, '09:30')]
+
+
+def test_threshold_crossed_only_upwards():
+    before = index_lessons(_lessons(('09:30', 1), ('10:45', 5), ('12:00', 3)))
+    after = index_lessons(_lessons(('09:30', 2), ('10:45', 1), ('12:00', 4)))
+
+    events = diff_snapshots(before, after, thresholds=(2,))
+    assert _types(events) == [(THRESHOLD, '09:30')]
+    assert events[0].threshold == 2
+    assert events[0].previous.remaining == 1
+
+
+def test_added_and_removed():
+    before = index_lessons(_lessons(('09:30', 1)))
+    after = index_lessons(_lessons(('10:45', 1)))
+
+    assert _types(diff_snapshots(before, after)) == [(ADDED, '10:45'), (REMOVED, '09:30')]
+
+
+def test_unchanged_or_unknown_remaining_emits_nothing():
+    before = index_lessons(_lessons(('09:30', 1), ('10:45', None)))
+    after = index_lessons(_lessons(('09:30', 1), ('10:45', 4)))
+
+    assert diff_snapshots(before, after, thresholds=(1, 2)) == []
+
+
+def test_rule_defaults_to_threshold_one():
+    rule = WatchRule()
+    before = index_lessons(_lessons(('09:30', 0)))
+    after = index_lessons(_lessons(('09:30', 1)))
+
+    events = diff_snapshots(before, after, rule.thresholds)
+    assert [e.type for e in events if rule.matches(e)] == [THRESHOLD]
+
+
+def test_rule_min_remaining():
+    rule = WatchRule(min_remaining=2)
+    before = index_lessons(_lessons(('09:30', 0), ('10:45', 0)))
+    after = index_lessons(_lessons(('09:30', 1), ('10:45', 2)))
+
+    matched = [e for e in diff_snapshots(before, after, rule.thresholds) if rule.matches(e)]
+    assert _types(matched) == [(THRESHOLD, '10:45')]
+
+
+def test_rule_added_lesson_needs_enough_seats():
+    rule = WatchRule(min_remaining=2, events=[ADDED])
+    after = index_lessons(_lessons(('09:30', 1), ('10:45', 2)))
+
+    matched = [e for e in diff_snapshots({}, after, rule.thresholds) if rule.matches(e)]
+    assert _types(matched) == [(ADDED, '10:45')]
+
+
+def test_rule_rejects_unknown_event():
+    with pytest.raises(ValueError):
+        WatchRule(events=['opened', 'bogus'])
+
+
+def test_rule_round_trip():
+    rule = WatchRule.from_dict({'minRemaining': 3, 'events': [OPENED, FILLED], 'notifyInitial': False})
+    assert WatchRule.from_dict(rule.to_dict()).to_dict() == rule.to_dict()
+
+
+class TestMonitorNotifications:
+    """LessonMonitor の差分判定と通知（1回のチェック分は1通にまとめる）"""
+
+    @pytest.fixture
+    def monitor(self):
+        from app import LessonMonitor
+        monitor = LessonMonitor('u1', 'pw', '2030-01-01', 'line', 5, line_token='token',
+                                rule=WatchRule(events=[THRESHOLD, FILLED]))
+        monitor.sent = []
+        monitor._dispatch = lambda subject, message: monitor.sent.append((subject, message))
+        return monitor
+
+    def test_initial_check_notifies_available_lessons_once(self, monitor):
+        monitor._check_and_notify(_lessons(('09:30', 0), ('10:45', 2), ('12:00', 5)))
+
+        assert len(monitor.sent) == 1
+        assert "2件のレッスンに現在空きがあります" in monitor.sent[0][1]
+
+    def test_openings_in_one_check_become_one_message(self, monitor):
+        monitor._check_and_notify(_lessons(('09:30', 0), ('10:45', 0), ('12:00', 3)))
+        monitor.sent.clear()
+
+        events = monitor._check_and_notify(_lessons(('09:30', 1), ('10:45', 4), ('12:00', 0)))
+
+        assert _types(events) == [(FILLED, '12:00'), (OPENED, '09:30'), (OPENED, '10:45'),
+                                  (THRESHOLD, '09:30'), (THRESHOLD, '10:45')]
+        assert len(monitor.sent) == 1
+        subject, message = monitor.sent[0]
+        assert "空き通知" in subject
+        assert "2件の空きが出ました" in message
+        assert "満員になりました" in message
+
+    def test_no_change_sends_nothing(self, monitor):
+        monitor._check_and_notify(_lessons(('09:30', 0)))
+        monitor.sent.clear()
+
+        assert monitor._check_and_notify(_lessons(('09:30', 0))) == []
+        assert monitor.sent == []
+
+    def test_empty_fetch_keeps_previous_snapshot(self, monitor):
+        monitor._check_and_notify(_lessons(('09:30', 0)))
+        monitor.sent.clear()
+
+        monitor._check_and_notify([])
+        monitor._check_and_notify(_lessons(('09:30', 1)))
+
+        assert len(monitor.sent) == 1
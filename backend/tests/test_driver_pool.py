@@ -0,0 +1,314 @@
+import os
+import threading
+
+import pytest
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException
+
+import driver_pool
+from circuit import CLOSED, OPEN, CircuitBreaker
+from driver_pool import DriverPool, LoginError
+from governor import BrowserGovernor, BrowserLimitReached
+from scraper import SeleniumGunzeScraper
+from sites import SiteUnavailable
+
+
+class FakeBrowser:
+    """ブラウザの枠だけを確保するスクレイパー（ログインは常に成功）"""
+
+    def __init__(self, governor):
+        self.governor = governor
+        self.slot = governor.acquire(self)
+        self.pid = os.getpid()
+        self.logged_in = False
+        self.logins = 0
+        self.closed = False
+
+    def is_alive(self):
+        return not self.closed
+
+    def ensure_logged_in(self, user_id, password):
+        if not self.logged_in:
+            self.logins += 1
+            self.logged_in = True
+        return True
+
+    def memory_usage_mb(self):
+        return 0
+
+    def quit(self):
+        self.closed = True
+        self.governor.release(self)
+
+
+@pytest.fixture
+def governor(tmp_path, monkeypatch):
+    governor = BrowserGovernor(max_browsers=1, acquire_timeout=2, lock_dir=str(tmp_path))
+    monkeypatch.setattr(driver_pool, 'GOVERNOR', governor)
+    return governor
+
+
+def test_idle_browser_is_freed_for_another_member(governor, club):
+    pool = DriverPool(factory=lambda site: FakeBrowser(governor), max_size=4)
+    try:
+        with pool.session('u1', 'pw', club) as first:
+            pass
+        # u1のブラウザは待機中のまま枠を使っているが、u2のために終了される
+        with pool.session('u2', 'pw', club) as second:
+            assert second.slot == 0
+        assert first.closed
+        assert governor.stats()['browsers'] == 1
+    finally:
+        pool.shutdown()
+    assert governor.stats()['browsers'] == 0
+
+
+def test_browser_in_use_is_not_freed(governor, club):
+    pool = DriverPool(factory=lambda site: FakeBrowser(governor), max_size=4)
+    try:
+        with pool.session('u1', 'pw', club) as first:
+            with pytest.raises(BrowserLimitReached):
+                with pool.session('u2', 'pw', club):
+                    pass
+            assert not first.closed
+    finally:
+        pool.shutdown()
+
+
+class FakeHttpSession(FakeBrowser):
+    """ブラウザの枠を使わないHTTPセッション"""
+
+    def __init__(self):
+        self.pid = None
+        self.logged_in = False
+        self.logins = 0
+        self.closed = False
+
+    def quit(self):
+        self.closed = True
+
+
+def test_http_sessions_are_not_capped_by_browser_limit(governor, club, monkeypatch):
+    monkeypatch.setenv('DRIVER_POOL_MAX_SIZE', '4')
+    pool = DriverPool(factory=lambda site: FakeHttpSession())
+    try:
+        sessions = []
+        for i in range(4):
+            with pool.session(f"u{i}", 'pw', club) as scraper:
+                sessions.append(scraper)
+        assert pool.max_size == 4
+        assert pool.stats()['size'] == 4
+        assert not any(s.closed for s in sessions)
+    finally:
+        pool.shutdown()
+
+
+def test_browser_entries_are_capped_by_governor(governor, club):
+    pool = DriverPool(factory=lambda site: FakeBrowser(governor), max_size=4)
+    try:
+        for i in range(3):
+            with pool.session(f"u{i}", 'pw', club):
+                pass
+        # ブラウザの枠は1つなので、待機中のブラウザは1つだけ残る
+        assert pool.stats()['size'] == 1
+        assert governor.stats()['browsers'] == 1
+    finally:
+        pool.shutdown()
+
+
+def test_shutdown_unregisters_reclaimer(governor):
+    pool = DriverPool(factory=lambda site: FakeBrowser(governor), max_size=2)
+    assert len(governor._reclaimers) == 1
+    pool.shutdown()
+    assert governor._reclaimers == []
+
+
+def test_wrong_password_is_not_a_site_failure(club, monkeypatch):
+    monkeypatch.setattr(club, 'backend', 'http')
+    monkeypatch.setattr(club, 'breaker', CircuitBreaker(club.site_id, failure_threshold=2))
+    pool = DriverPool(max_size=2)
+    try:
+        for _ in range(5):
+            with pytest.raises(LoginError):
+                with pool.session('u1', 'WRONG', club):
+                    pass
+    finally:
+        pool.shutdown()
+    assert club.breaker.state == CLOSED
+    assert club.breaker.failures == 0
+
+
+def test_site_error_is_recorded(club, monkeypatch):
+    monkeypatch.setattr(club, 'breaker', CircuitBreaker(club.site_id, failure_threshold=2))
+
+    def broken(site):
+        raise RuntimeError("ページを開けません")
+
+    pool = DriverPool(factory=broken, max_size=2)
+    try:
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                with pool.session('u1', 'pw', club):
+                    pass
+    finally:
+        pool.shutdown()
+    assert club.breaker.state == OPEN
+
+
+class FakeElement:
+    def __init__(self, driver, on_click=None):
+        self.driver = driver
+        self.on_click = on_click
+        self.stale = False
+
+    def send_keys(self, text):
+        self.driver.typed.append(text)
+
+    def click(self):
+        self.on_click()
+
+    def is_enabled(self):
+        if self.stale:
+            raise StaleElementReferenceException("stale")
+        return True
+
+
+class FakeDriver:
+    """ログイン画面とメニューだけを持つWebDriverの代わり（down=Trueでページの表示がタイムアウト）"""
+
+    def __init__(self, site, password, down=False):
+        self.site = site
+        self.password = password
+        self.down = down
+        self.window_handles = ['main']
+        self.elements = {}
+        self.typed = []
+
+    def get(self, url):
+        if self.down:
+            raise TimeoutException("page load timeout")
+        self._show_login()
+
+    def _show_login(self):
+        for element in self.elements.values():
+            element.stale = True
+        self.typed = []
+        self.elements = {
+            self.site.user_field: FakeElement(self),
+            self.site.password_field: FakeElement(self),
+            self.site.login_button_id: FakeElement(self, self._submit),
+        }
+
+    def _submit(self):
+        if self.typed[-1] == self.password:
+            self.elements = {self.site.menu_anchor_id: FakeElement(self)}
+        else:
+            self._show_login()
+
+    def find_element(self, by, value):
+        if value not in self.elements:
+            raise NoSuchElementException(value)
+        return self.elements[value]
+
+    def find_elements(self, by, value):
+        return [self.elements[value]] if value in self.elements else []
+
+    def quit(self):
+        pass
+
+
+def _selenium_factory(password, down=False):
+    """Chromeを起動せずにSeleniumGunzeScraperのログイン処理を動かす"""
+    def factory(site):
+        scraper = object.__new__(SeleniumGunzeScraper)
+        scraper.site = site
+        scraper.driver = FakeDriver(site, password, down)
+        scraper.killed = False
+        scraper.profile_dir = os.devnull
+        scraper.main_window = 'main'
+        scraper.logged_in = False
+        scraper.logins = 0
+        return scraper
+    return factory
+
+
+def test_site_down_during_selenium_login_opens_breaker(club, monkeypatch):
+    monkeypatch.setattr(club, 'breaker', CircuitBreaker(club.site_id, failure_threshold=2))
+    pool = DriverPool(factory=_selenium_factory('pw', down=True), max_size=2)
+    try:
+        for _ in range(2):
+            with pytest.raises(SiteUnavailable):
+                with pool.session('u1', 'pw', club):
+                    pass
+    finally:
+        pool.shutdown()
+    assert club.breaker.state == OPEN
+
+
+def test_rejected_selenium_login_is_login_error(club, monkeypatch):
+    monkeypatch.setattr(club, 'breaker', CircuitBreaker(club.site_id, failure_threshold=2))
+    pool = DriverPool(factory=_selenium_factory('pw'), max_size=2)
+    try:
+        for _ in range(3):
+            with pytest.raises(LoginError):
+                with pool.session('u1', 'WRONG', club):
+                    pass
+        with pool.session('u1', 'pw', club) as scraper:
+            assert scraper.logged_in
+    finally:
+        pool.shutdown()
+    assert club.breaker.state == CLOSED
+    assert club.breaker.failures == 0
+
+
+class HangingScraper:
+    """終了（quit）が release まで返らないスクレイパー"""
+
+    release = None
+
+    def __init__(self):
+        self.logged_in = False
+        self.logins = 0
+        self.quitting = threading.Event()
+
+    def is_alive(self):
+        return True
+
+    def ensure_logged_in(self, user_id, password):
+        self.logged_in = True
+        return True
+
+    def memory_usage_mb(self):
+        return 0
+
+    def quit(self):
+        self.quitting.set()
+        self.release.wait(5)
+
+
+def test_slow_browser_shutdown_does_not_block_sessions(club, monkeypatch):
+    monkeypatch.setattr(driver_pool, 'get_site', lambda site_id=None: club)
+    release = threading.Event()
+    HangingScraper.release = release
+    pool = DriverPool(factory=lambda site: HangingScraper(), max_size=4)
+    try:
+        with pool.session('u1', 'pw', club) as hanging:
+            pass
+        discard = threading.Thread(target=pool.discard, args=('u1', club.site_id))
+        discard.daemon = True
+        discard.start()
+        assert hanging.quitting.wait(5)
+
+        # u1のブラウザの終了を待たずに、他の会員の取得と状態確認ができる
+        done = threading.Event()
+
+        def other():
+            with pool.session('u2', 'pw', club):
+                pass
+            pool.stats()
+            done.set()
+
+        threading.Thread(target=other, daemon=True).start()
+        assert done.wait(2)
+    finally:
+        release.set()
+        pool.shutdown()
@@ -0,0 +1,83 @@
+import pytest
+import requests
+
+from http_scraper import FallbackScraper, HttpFlowError, HttpGunzeScraper
+from sites import Site
+
+from conftest import FAKE_PASSWORD
+
+
+def test_login_and_calendar_match_site(fake_site, club):
+    scraper = HttpGunzeScraper(club)
+    assert scraper.login('u1', FAKE_PASSWORD)
+
+    results = scraper.go_to_program_page_and_scrape_dates(None)
+
+    expected = fake_site.seats.snapshot()
+    assert sorted(results) == sorted(expected)
+    for date_str, lessons in results.items():
+        assert [(l.time, l.name, l.remaining) for l in lessons] == list(expected[date_str])
+        assert all(l.date == f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}" for l in lessons)
+
+
+def test_selected_dates_only(fake_site, club):
+    scraper = HttpGunzeScraper(club)
+    assert scraper.login('u1', FAKE_PASSWORD)
+    date_str = sorted(fake_site.seats.snapshot())[1]
+
+    assert list(scraper.go_to_program_page_and_scrape_dates([date_str])) == [date_str]
+    assert len(scraper.go_to_program_page_and_scrape(date_str)) == len(fake_site.seats.snapshot()[date_str])
+
+
+def test_wrong_password_returns_false(club):
+    scraper = HttpGunzeScraper(club)
+    assert scraper.login('u1', 'WRONG') is False
+    assert not scraper.logged_in
+
+
+def test_session_reused_without_new_login(fake_site, club):
+    scraper = HttpGunzeScraper(club)
+    assert scraper.ensure_logged_in('u1', FAKE_PASSWORD)
+    assert scraper.ensure_logged_in('u1', FAKE_PASSWORD)
+    assert scraper.logins == 1
+    assert fake_site.stats()['requests']['/mypage/login'] == 1
+
+
+def test_cookies_restore_session(club):
+    first = HttpGunzeScraper(club)
+    assert first.login('u1', FAKE_PASSWORD)
+
+    second = HttpGunzeScraper(club)
+    assert second.restore_session(first.export_cookies())
+    assert second.go_to_program_page_and_scrape_dates(None)
+    assert second.logins == 0
+
+
+def test_fallback_does_not_launch_browser_when_site_is_down(monkeypatch):
+    # 誰も待ち受けていないポート（接続拒否）
+    site = Site('down', '停止中', 'http://127.0.0.1:9/mypage/')
+    scraper = FallbackScraper(site)
+    monkeypatch.setattr(scraper, '_switch_to_selenium', lambda reason: pytest.fail("Seleniumへ切り替えた"))
+
+    with pytest.raises(requests.RequestException):
+        scraper.login('u1', FAKE_PASSWORD)
+    assert not scraper.using_selenium
+
+
+def test_fallback_switches_when_page_structure_changes(club, monkeypatch):
+    scraper = FallbackScraper(club)
+    switched = []
+
+    def fail_flow(*args):
+        raise HttpFlowError("ログインフォームが見つかりません")
+
+    def switch(reason):
+        # Seleniumの代わりに新しいHTTP版へ差し替える
+        switched.append(reason)
+        scraper.active = HttpGunzeScraper(club)
+        scraper.using_selenium = True
+
+    monkeypatch.setattr(scraper.active, 'login', fail_flow)
+    monkeypatch.setattr(scraper, '_switch_to_selenium', switch)
+    assert scraper.login('u1', FAKE_PASSWORD)
+    assert len(switched) == 1
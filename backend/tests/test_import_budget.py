@@ -0,0 +1,25 @@
+import os
+
+from bench.import_budget import measure
+
+# bench.import_budget の --budget と同じ設定（CIの遅いマシンでは環境変数で広げる）
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5"))
+
+
+def test_api_import_does_not_load_scraping_modules():
+    # 新しいプロセスで計測するため、このテストプロセスで読み込み済みのモジュールの影響は受けない
+    result = measure('app', ['/api/monitoring_status'])
+
+    assert result['heavyModules'] == []
+    assert result['requests']['/api/monitoring_status'][0] == 200
+
+
+def test_api_import_within_budget():
+    # 初回はディスクキャッシュの影響を受けるため、予算を超えた場合のみ計り直して最小値で判定
+    best = None
+    for _ in range(3):
+        seconds = measure('app', [])['importSeconds']
+        best = seconds if best is None else min(best, seconds)
+        if best <= IMPORT_BUDGET_SECONDS:
+            break
+    assert best <= IMPORT_BUDGET_SECONDS, f"import時間が予算を超えています: {best:.3f}秒 > {IMPORT_BUDGET_SECONDS:.3f}秒"
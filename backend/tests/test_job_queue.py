@@ -0,0 +1,91 @@
+import sqlite3
+
+import pytest
+
+from job_queue import DONE, FAILED, JobQueue, SqliteJobQueue, TaskFailed, create_queue
+
+PAYLOAD = {'userId': 'u1', 'password': 'secret-pw', 'dates': ['20300101']}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SqliteJobQueue(str(tmp_path / 'job_queue.db'), max_attempts=2)
+
+
+def _raw(queue, task_id):
+    conn = sqlite3.connect(queue.path)
+    try:
+        return conn.execute("SELECT status, payload, attempts FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_expired_lease_is_taken_over(queue):
+    task_id = queue.put('fetch', PAYLOAD)
+    # w1 が応答しなくなった（借り受けの期限切れ）
+    assert queue.lease('w1', ['fetch'], lease_seconds=-1)[0] == task_id
+
+    leased = queue.lease('w2', ['fetch'], lease_seconds=60)
+    assert leased == (task_id, 'fetch', PAYLOAD)
+    assert _raw(queue, task_id)[2] == 2
+
+    # 借り受けが移った後の w1 の操作は受け付けない
+    assert not queue.extend(task_id, 'w1', 60)
+    assert not queue.complete(task_id, 'w1', {'lessons': 'stale'})
+    assert not queue.fail(task_id, 'w1', "失敗")
+    assert queue.extend(task_id, 'w2', 60)
+    assert queue.complete(task_id, 'w2', {'lessons': []})
+    assert queue.result(task_id) == {'lessons': []}
+
+
+def test_task_fails_after_max_attempts(queue):
+    task_id = queue.put('fetch', PAYLOAD)
+    for worker_id in ('w1', 'w2'):
+        assert queue.lease(worker_id, ['fetch'], lease_seconds=-1)[0] == task_id
+
+    assert queue.lease('w3', ['fetch'], lease_seconds=60) is None
+    with pytest.raises(TaskFailed) as e:
+        queue.result(task_id)
+    assert e.value.error_type == 'WorkerLost'
+    assert _raw(queue, task_id)[:2] == (FAILED, '{}')
+
+
+def test_group_limits(queue):
+    first = queue.put('fetch', PAYLOAD, group='gunze')
+    queue.put('fetch', PAYLOAD, group='gunze')
+    limits = {'gunze': 1}
+
+    assert queue.lease('w1', ['fetch'], 60, limits)[0] == first
+    assert queue.lease('w2', ['fetch'], 60, limits) is None
+    # 他のグループのタスクは制限を受けない
+    other = queue.put('fetch', PAYLOAD, group='other')
+    assert queue.lease('w2', ['fetch'], 60, limits)[0] == other
+
+
+def test_payload_is_wiped_when_finished(queue):
+    done = queue.put('fetch', PAYLOAD)
+    failed = queue.put('fetch', PAYLOAD)
+    queue.lease('w1', ['fetch'], 60)
+    queue.lease('w1', ['fetch'], 60)
+
+    assert queue.complete(done, 'w1', {'lessons': []})
+    assert queue.fail(failed, 'w1', "ログイン失敗", 'LoginError')
+    assert _raw(queue, done)[:2] == (DONE, '{}')
+    assert _raw(queue, failed)[:2] == (FAILED, '{}')
+    with pytest.raises(TaskFailed) as e:
+        queue.result(failed)
+    assert e.value.error_type == 'LoginError'
+
+
+class IncompleteQueue(JobQueue):
+    """complete などを実装していないバックエンド"""
+
+    def put(self, kind, payload, group=None):
+        return 'task'
+
+
+def test_incomplete_backend_fails_on_creation():
+    with pytest.raises(TypeError):
+        create_queue(f"{__name__}:IncompleteQueue")
+    with pytest.raises(TypeError):
+        create_queue(f"{__name__}:PAYLOAD")
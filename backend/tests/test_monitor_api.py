@@ -0,0 +1,70 @@
+import pytest
+
+from scheduler import StoreBackedScheduler
+from store import MonitorStore
+
+LESSONS = [{'id': 'l1', 'name': 'ヨガ', 'time': '10:00'}]
+
+
+def _definition(**overrides):
+    data = {'userId': 'u1', 'password': 'pw', 'date': '2030-01-01', 'interval': 5,
+            'lessons': LESSONS, 'notification': {'method': 'none'}}
+    data.update(overrides)
+    return data
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    import app as app_module
+    store = MonitorStore(str(tmp_path / 'monitoring.db'))
+    monkeypatch.setattr(app_module, 'scheduler', StoreBackedScheduler(
+        store, lambda state: app_module.LessonMonitor.from_state(state)))
+    client = app_module.app.test_client()
+    client.store = store
+    return client
+
+
+def test_batch_reports_every_invalid_item_and_applies_nothing(client):
+    job_id = client.post('/api/monitors', json=_definition()).get_json()['jobId']
+
+    response = client.post('/api/monitors/batch', json={
+        'create': [_definition(), _definition(interval='abc'), 'not-an-object', _definition(interval=0)],
+        'update': [{'jobId': job_id, 'interval': -1}, {'jobId': ['x']}],
+        'delete': [{'jobId': 'abc'}, 'other-job'],
+    })
+
+    assert response.status_code == 400
+    errors = {(e['op'], e['index']) for e in response.get_json()['errors']}
+    assert errors == {('create', 1), ('create', 2), ('create', 3), ('update', 0), ('update', 1), ('delete', 0)}
+    assert len(client.store.load_jobs()) == 1
+
+
+def test_batch_with_valid_items(client):
+    job_id = client.post('/api/monitors', json=_definition()).get_json()['jobId']
+
+    response = client.post('/api/monitors/batch', json={
+        'create': [_definition(userId='u2', interval=2.5)],
+        'update': [{'jobId': job_id, 'interval': 10, 'active': False}],
+    })
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['created'][0]['userId'] == 'u2'
+    assert body['updated'][0]['interval'] == 10
+    assert len(client.store.load_jobs()) == 2
+
+
+@pytest.mark.parametrize('interval', ['abc', None, 0, -5, True, [5]])
+def test_create_rejects_invalid_interval(client, interval):
+    response = client.post('/api/monitors', json=_definition(interval=interval))
+    assert response.status_code == 400
+    assert 'interval' in response.get_json()['error']
+
+
+def test_update_rejects_invalid_fields(client):
+    job_id = client.post('/api/monitors', json=_definition()).get_json()['jobId']
+
+    assert client.patch(f'/api/monitors/{job_id}', json={'interval': 'abc'}).status_code == 400
+    assert client.patch(f'/api/monitors/{job_id}', json={'notification': 'line'}).status_code == 400
+    assert client.patch(f'/api/monitors/{job_id}', json=['interval']).status_code == 400
+    assert client.patch(f'/api/monitors/{job_id}', json={'interval': 15}).status_code == 200
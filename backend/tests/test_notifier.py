@@ -0,0 +1,149 @@
+import socketserver
+import threading
+
+import pytest
+
+import notifier
+from notifier import NotificationDispatcher, NotificationService, PermanentNotificationError
+
+
+class SmtpStub(socketserver.ThreadingTCPServer):
+    """接続数・受信メッセージを記録する最小限のSMTPサーバー（STARTTLS・認証なし）"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SmtpHandler)
+        self.connections = 0
+        self.messages = []
+        self.received = threading.Condition()
+
+    def wait_for_messages(self, count, timeout=5):
+        with self.received:
+            self.received.wait_for(lambda: len(self.messages) >= count, timeout)
+            return len(self.messages)
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        server = self.server
+        with server.received:
+            server.connections += 1
+        self._reply("220 stub ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self._reply("250 stub")
+            elif command == 'DATA':
+                self._reply("354 end with .")
+                body = []
+                for data in iter(self.rfile.readline, b''):
+                    if data in (b'.\r\n', b'.\n'):
+                        break
+                    body.append(data)
+                with server.received:
+                    server.messages.append(b''.join(body))
+                    server.received.notify_all()
+                self._reply("250 queued")
+            elif command == 'QUIT':
+                self._reply("221 bye")
+                return
+            else:
+                # MAIL / RCPT / RSET / NOOP
+                self._reply("250 ok")
+
+
+@pytest.fixture
+def smtp_stub(monkeypatch):
+    server = SmtpStub()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    monkeypatch.setenv('SMTP_HOST', '127.0.0.1')
+    monkeypatch.setenv('SMTP_PORT', str(server.server_address[1]))
+    monkeypatch.setenv('SMTP_STARTTLS', '0')
+    monkeypatch.setenv('SMTP_AUTH', '0')
+    monkeypatch.setenv('GMAIL_EMAIL', 'monitor@example.com')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_emails_reuse_one_smtp_connection(smtp_stub):
+    dispatcher = NotificationDispatcher(NotificationService(), workers=1)
+    try:
+        for i in range(3):
+            assert dispatcher.notify('email', f"件名{i}", f"本文{i}", email='member@example.com')
+        assert smtp_stub.wait_for_messages(3) == 3
+    finally:
+        dispatcher.shutdown()
+    assert smtp_stub.connections == 1
+    assert dispatcher.stats()['sent'] == 3
+
+
+def test_line_notification_delivered(fake_site, monkeypatch):
+    monkeypatch.setattr(notifier, 'LINE_NOTIFY_URL', fake_site.notify_url)
+    dispatcher = NotificationDispatcher(NotificationService(), workers=1)
+    try:
+        assert dispatcher.notify('line', "件名", "空きが出ました", line_token='token')
+        assert fake_site.wait_for_notifications(1, timeout=5) == 1
+    finally:
+        dispatcher.shutdown()
+    assert fake_site.notifications[0][1] == "空きが出ました"
+
+
+class FlakyService:
+    """指定回数だけ失敗してから成功する通知サービス"""
+
+    def __init__(self, failures, error=RuntimeError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+        self.delivered = threading.Event()
+
+    def deliver_line(self, message, line_token):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("送信失敗")
+        self.delivered.set()
+
+    def close(self):
+        pass
+
+
+def test_transient_failure_is_retried():
+    service = FlakyService(failures=2)
+    dispatcher = NotificationDispatcher(service, workers=1, max_attempts=4, backoff_base=0.01)
+    try:
+        dispatcher.notify('line', "件名", "本文", line_token='token')
+        assert service.delivered.wait(5)
+    finally:
+        dispatcher.shutdown()
+    assert service.calls == 3
+    assert dispatcher.stats()['sent'] == 1
+
+
+def test_permanent_failure_is_not_retried():
+    service = FlakyService(failures=10, error=PermanentNotificationError)
+    dispatcher = NotificationDispatcher(service, workers=1, max_attempts=4, backoff_base=0.01)
+    dispatcher.notify('line', "件名", "本文", line_token='token')
+    dispatcher.shutdown()
+    assert service.calls == 1
+    assert dispatcher.stats()['failed'] == 1
+
+
+def test_notification_without_destination_is_rejected():
+    dispatcher = NotificationDispatcher(FlakyService(failures=0), workers=1)
+    try:
+        assert not dispatcher.notify('email', "件名", "本文")
+        assert not dispatcher.notify('none', "件名", "本文")
+    finally:
+        dispatcher.shutdown()
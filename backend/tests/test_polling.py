@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import polling
+from lessons import Lesson
+from polling import AdaptivePoller
+
+NOW = datetime(2030, 1, 1, 8, 0)
+
+
+def _lessons(start, remaining=0):
+    """start に始まるレッスン1件"""
+    return [Lesson(start.strftime('%Y-%m-%d'), start.strftime('%H:%M'), "ヨガ", remaining)]
+
+
+@pytest.fixture
+def poller(monkeypatch):
+    monkeypatch.setenv('ADAPTIVE_POLLING', '1')
+    return AdaptivePoller(300, min_seconds=60, max_seconds=1800, error_max_seconds=900)
+
+
+def test_quiet_checks_back_off_up_to_max(poller):
+    lessons = _lessons(NOW + timedelta(days=5))
+    delays = [poller.next_delay(lessons, None, NOW) for _ in range(7)]
+    assert delays == [300, 450, 675, 1012.5, 1518.75, 1800, 1800]
+
+
+def test_change_resets_to_min(poller):
+    far = NOW + timedelta(days=5)
+    for _ in range(3):
+        poller.next_delay(_lessons(far, remaining=0), None, NOW)
+
+    assert poller.next_delay(_lessons(far, remaining=2), None, NOW) == 60
+    assert poller.quiet_checks == 0
+    assert poller.next_delay(_lessons(far, remaining=2), None, NOW) == 300
+
+
+@pytest.mark.parametrize('until_start, expected', [
+    (timedelta(minutes=30), 60),
+    (timedelta(hours=2), 150),
+    (timedelta(hours=12), 300),
+])
+def test_delay_shrinks_near_start(poller, until_start, expected):
+    lessons = _lessons(NOW + until_start)
+    # 変化が無く間隔が広がった後でも、開始が近ければ短くする
+    delays = [poller.next_delay(lessons, None, NOW) for _ in range(4)]
+    assert delays[-1] == expected
+
+
+def test_never_sleeps_past_start(monkeypatch):
+    monkeypatch.setenv('ADAPTIVE_POLLING', '1')
+    poller = AdaptivePoller(6 * 3600, min_seconds=60, max_seconds=6 * 3600)
+    lessons = _lessons(NOW + timedelta(hours=4))
+    assert poller.next_delay(lessons, None, NOW) == 4 * 3600
+
+
+def test_all_started_finishes(poller):
+    assert poller.next_delay(_lessons(NOW - timedelta(minutes=5)), None, NOW) is None
+
+
+def test_disabled_uses_base_interval(monkeypatch):
+    monkeypatch.setenv('ADAPTIVE_POLLING', '0')
+    poller = AdaptivePoller(300)
+    lessons = _lessons(NOW + timedelta(minutes=30))
+    assert [poller.next_delay(lessons, None, NOW) for _ in range(3)] == [300, 300, 300]
+
+
+def test_error_backoff_and_reset(poller, monkeypatch):
+    monkeypatch.setattr(polling.random, 'uniform', lambda low, high: 1.0)
+    assert [poller.error_delay() for _ in range(6)] == [60, 120, 240, 480, 900, 900]
+
+    # 正常なチェックでバックオフは元に戻る
+    poller.next_delay(_lessons(NOW + timedelta(days=5)), None, NOW)
+    assert poller.error_delay() == 60
+
+
+def test_error_delay_jitter(poller):
+    for _ in range(20):
+        assert 45 <= poller.error_delay() <= 75
+        poller.errors = 0
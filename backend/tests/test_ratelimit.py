@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+from conftest import BACKEND_DIR
+from ratelimit import TokenBucket
+from site_state import SiteStateStore
+
+
+def test_local_bucket_limits_burst():
+    bucket = TokenBucket(rate=0.001, capacity=2)
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert not bucket.acquire(timeout=0.05)
+
+
+def test_shared_bucket_is_one_budget_across_processes(tmp_path):
+    path = str(tmp_path / 'sites.db')
+    bucket = TokenBucket(rate=0.001, capacity=3, name='site', shared=SiteStateStore(path))
+    assert bucket.try_acquire()
+
+    # 別のプロセスが残りのトークンを使い切る
+    code = ("from ratelimit import TokenBucket; from site_state import SiteStateStore; "
+            f"b = TokenBucket(rate=0.001, capacity=3, name='site', shared=SiteStateStore({path!r})); "
+            "print(sum(b.try_acquire() for _ in range(5)))")
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR)
+    output = subprocess.run([sys.executable, '-c', code], env=env, stdout=subprocess.PIPE,
+                            universal_newlines=True, check=True).stdout
+    assert output.strip() == '2'
+    assert not bucket.try_acquire()
+    # 名前が違うバケットは別に数える
+    assert TokenBucket(rate=0.001, capacity=3, name='other', shared=SiteStateStore(path)).try_acquire()
@@ -0,0 +1,223 @@
+import threading
+import time
+
+import pytest
+
+import scheduler
+from ratelimit import TokenBucket
+from scheduler import MonitorScheduler
+from sites import Site
+
+
+class FakeMonitor:
+    """サイトの枠を確保してからcheckを呼ぶ監視（check が次回までの秒数を返す。Noneで完了）"""
+
+    def __init__(self, user_id, site, check, date='2030-01-01'):
+        self.user_id = user_id
+        self.site = site
+        self.site_id = site.site_id if site is not None else None
+        self.date = date
+        self.interval_minutes = 5
+        self.check = check
+
+    def run_check(self):
+        if self.site is None:
+            return self.check(self)
+        with self.site.slot(timeout=30):
+            return self.check(self)
+
+
+@pytest.fixture
+def sites(monkeypatch):
+    registered = {}
+    monkeypatch.setattr(scheduler, 'get_site', lambda site_id: registered[site_id])
+    return registered
+
+
+def _site(sites, site_id, **kwargs):
+    site = Site(site_id, site_id, 'http://127.0.0.1:9/', **kwargs)
+    sites[site_id] = site
+    return site
+
+
+def test_throttled_site_does_not_hold_workers(sites):
+    slow = _site(sites, 'slow', max_concurrency=2)
+    fast = _site(sites, 'fast', max_concurrency=2)
+    # slowサイトはアクセス頻度の上限に達している（次のアクセスまで60秒）
+    slow._bucket = TokenBucket(rate=1 / 60, capacity=1)
+    assert slow._bucket.try_acquire()
+    done = threading.Event()
+    checked = []
+
+    def check(monitor):
+        checked.append(monitor.user_id)
+        if monitor.site is fast:
+            done.set()
+
+    s = MonitorScheduler(max_workers=2)
+    try:
+        for i in range(3):
+            s.add(FakeMonitor(f"slow{i}", slow, check))
+        s.add(FakeMonitor('fast', fast, check), delay=0.1)
+
+        assert done.wait(2)
+        assert checked == ['fast']
+        # slowサイトのジョブはワーカーで待たずに、アクセスできる時刻へ予定し直される
+        assert s.stats()['running'] == 0
+        next_runs = [job.next_run for job in s.jobs() if job.site_id == 'slow']
+        assert min(next_runs) > time.time() + 50
+    finally:
+        s.shutdown()
+
+
+def test_one_site_cannot_use_every_worker(sites):
+    busy = _site(sites, 'busy', max_concurrency=2, rate_per_minute=6000)
+    other = _site(sites, 'other', max_concurrency=2, rate_per_minute=6000)
+    release, other_done = threading.Event(), threading.Event()
+
+    def check(monitor):
+        if monitor.site is busy:
+            release.wait(5)
+        else:
+            other_done.set()
+
+    s = MonitorScheduler(max_workers=2)
+    try:
+        for i in range(2):
+            s.add(FakeMonitor(f"busy{i}", busy, check))
+        s.add(FakeMonitor('other', other, check), delay=0.1)
+        # busyサイトのチェックが終わらなくても、他のサイトのチェックは実行される
+        assert other_done.wait(2)
+    finally:
+        release.set()
+        s.shutdown()
+
+
+class FakeClock:
+    """スケジューラーが参照する現在時刻（advance で進める）"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, 'time', clock)
+    return clock
+
+
+def _advance(s, clock, seconds):
+    clock.now += seconds
+    with s._cond:
+        s._cond.notify_all()
+
+
+class Recorder:
+    """チェックの実行順と同時実行数を記録し、block中の会員のチェックは release まで終わらせない"""
+
+    def __init__(self, delay=None):
+        self.delay = delay
+        self.order = []
+        self.running = {}
+        self.peak_by_user = {}
+        self.peak_total = 0
+        self.block = set()
+        self.release = threading.Event()
+        self.started = threading.Condition()
+
+    def __call__(self, monitor):
+        with self.started:
+            self.order.append(monitor.user_id)
+            self.running[monitor.user_id] = self.running.get(monitor.user_id, 0) + 1
+            self.peak_by_user[monitor.user_id] = max(self.peak_by_user.get(monitor.user_id, 0),
+                                                     self.running[monitor.user_id])
+            self.peak_total = max(self.peak_total, sum(self.running.values()))
+            self.started.notify_all()
+        if monitor.user_id in self.block:
+            self.release.wait(5)
+        with self.started:
+            self.running[monitor.user_id] -= 1
+        return self.delay
+
+    def wait_for(self, count, timeout=5):
+        with self.started:
+            return self.started.wait_for(lambda: len(self.order) >= count, timeout)
+
+
+def test_jobs_run_in_deadline_order(clock):
+    record = Recorder()
+    s = MonitorScheduler(max_workers=1)
+    try:
+        for user_id, delay in (('a', 30), ('b', 10), ('c', 20)):
+            s.add(FakeMonitor(user_id, None, record), delay=delay)
+        time.sleep(0.1)
+        assert record.order == []
+
+        _advance(s, clock, 60)
+        assert record.wait_for(3)
+        assert record.order == ['b', 'c', 'a']
+    finally:
+        s.shutdown()
+
+
+def test_next_check_waits_for_returned_delay(clock):
+    record = Recorder(delay=60)
+    s = MonitorScheduler(max_workers=1)
+    try:
+        job = s.add(FakeMonitor('a', None, record))
+        assert record.wait_for(1)
+        time.sleep(0.1)
+        assert job.next_run == clock.now + 60
+        assert record.order == ['a']
+
+        _advance(s, clock, 60)
+        assert record.wait_for(2)
+    finally:
+        s.shutdown()
+
+
+def test_one_user_cannot_take_every_worker(clock):
+    record = Recorder()
+    record.block.add('u1')
+    s = MonitorScheduler(max_workers=2, per_user_limit=1)
+    try:
+        s.add(FakeMonitor('u1', None, record, date='2030-01-01'))
+        s.add(FakeMonitor('u1', None, record, date='2030-01-02'))
+        s.add(FakeMonitor('u2', None, record), delay=1)
+        _advance(s, clock, 1)
+
+        # u1の2件目は1件目の完了まで待ち、空いたワーカーはu2が使う
+        assert record.wait_for(2)
+        time.sleep(0.1)
+        assert record.order == ['u1', 'u2']
+        record.release.set()
+        assert record.wait_for(3)
+        assert record.order == ['u1', 'u2', 'u1']
+        assert record.peak_by_user['u1'] == 1
+    finally:
+        record.release.set()
+        s.shutdown()
+
+
+def test_site_concurrency_limit(sites, clock):
+    club = _site(sites, 'club', max_concurrency=2, rate_per_minute=6000)
+    record = Recorder()
+    record.block.update({'u1', 'u2', 'u3'})
+    s = MonitorScheduler(max_workers=4)
+    try:
+        for user_id in ('u1', 'u2', 'u3'):
+            s.add(FakeMonitor(user_id, club, record))
+
+        assert record.wait_for(2)
+        time.sleep(0.1)
+        assert len(record.order) == 2
+        record.release.set()
+        assert record.wait_for(3)
+        assert record.peak_total == 2
+    finally:
+        record.release.set()
+        s.shutdown()
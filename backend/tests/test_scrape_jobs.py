@@ -0,0 +1,63 @@
+import threading
+
+from scrape_jobs import DONE, FAILED, RUNNING, ScrapeError, ScrapeJobManager
+from store import MonitorStore
+
+
+def _managers(tmp_path):
+    """同じストアを使う2つのWebワーカーに相当"""
+    path = str(tmp_path / 'monitoring.db')
+    return ScrapeJobManager(max_workers=1, store=MonitorStore(path)), ScrapeJobManager(store=MonitorStore(path))
+
+
+def test_job_is_visible_from_another_worker(tmp_path):
+    accepted, other = _managers(tmp_path)
+    started, release = threading.Event(), threading.Event()
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        return {'lessons': [], 'message': "0件のレッスンを取得しました"}
+
+    try:
+        job = accepted.submit(('u1', 'digest', ('20300101',)), fetch)
+        started.wait(5)
+
+        remote = other.get(job.job_id)
+        assert remote is not None
+        assert remote.status == RUNNING
+        assert not remote.wait(0.1)
+
+        release.set()
+        assert remote.wait(5)
+        assert remote.status == DONE
+        assert remote.to_dict()['message'] == "0件のレッスンを取得しました"
+    finally:
+        release.set()
+        accepted.shutdown()
+        other.shutdown()
+
+
+def test_failed_job_keeps_http_status(tmp_path):
+    accepted, other = _managers(tmp_path)
+
+    def fetch():
+        raise ScrapeError("ログインに失敗しました", 401)
+
+    try:
+        job = accepted.submit(('u1', 'digest', ('20300101',)), fetch)
+        assert job.wait(5)
+        remote = other.get(job.job_id)
+        assert remote.status == FAILED
+        assert remote.error_status == 401
+        assert remote.to_dict()['error'] == "ログインに失敗しました"
+    finally:
+        accepted.shutdown()
+        other.shutdown()
+
+
+def test_unknown_job(tmp_path):
+    accepted, other = _managers(tmp_path)
+    assert other.get('missing') is None
+    accepted.shutdown()
+    other.shutdown()
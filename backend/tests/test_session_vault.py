@@ -0,0 +1,45 @@
+import os
+import threading
+
+from cryptography.fernet import Fernet
+
+from session_vault import _load_key
+
+
+def test_concurrent_key_creation_yields_one_key(tmp_path):
+    path = str(tmp_path / 'session_vault.key')
+    start = threading.Barrier(8)
+    keys = []
+
+    def load():
+        start.wait()
+        keys.append(_load_key(path, Fernet.generate_key))
+
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(set(keys)) == 1
+    Fernet(keys[0])
+    # 一時ファイルは残さない
+    assert os.listdir(str(tmp_path)) == ['session_vault.key']
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+
+def test_waits_for_key_being_written(tmp_path):
+    path = str(tmp_path / 'session_vault.key')
+    key = Fernet.generate_key()
+    open(path, 'wb').close()
+
+    def write_key():
+        with open(path, 'wb') as f:
+            f.write(key)
+
+    timer = threading.Timer(0.2, write_key)
+    timer.start()
+    try:
+        assert _load_key(path, Fernet.generate_key) == key
+    finally:
+        timer.join()
@@ -0,0 +1,52 @@
+import json
+import sqlite3
+
+from cryptography.fernet import Fernet
+
+from session_vault import SecretBox
+from store import MonitorStore
+
+STATE = {'user_id': 'u1', 'password': 'secret-pw', 'date': '2030-01-01', 'interval': 5}
+
+
+def _raw_state(store, job_id):
+    conn = sqlite3.connect(store.path)
+    try:
+        return json.loads(conn.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0])
+    finally:
+        conn.close()
+
+
+def test_job_password_is_encrypted_at_rest(tmp_path):
+    store = MonitorStore(str(tmp_path / 'monitoring.db'), secrets=SecretBox(Fernet.generate_key()))
+    store.save_job('job1', 'u1', STATE, True)
+
+    raw = _raw_state(store, 'job1')
+    assert 'password' not in raw
+    assert 'secret-pw' not in json.dumps(raw)
+    assert store.load_job('job1')['state'] == STATE
+    assert store.load_jobs()[0]['state']['password'] == 'secret-pw'
+
+
+def test_plaintext_passwords_are_migrated(tmp_path):
+    path = str(tmp_path / 'monitoring.db')
+    MonitorStore(path).save_job('job1', 'u1', STATE, True)
+    store = MonitorStore(path, secrets=SecretBox(Fernet.generate_key()))
+    version = store.job_versions()['job1']
+
+    assert store.encrypt_job_passwords() == 1
+    assert 'password' not in _raw_state(store, 'job1')
+    assert store.load_job('job1')['state'] == STATE
+    # 定義の変更ではないので監視プロセスは差し替えない
+    assert store.job_versions()['job1'] == version
+    assert store.encrypt_job_passwords() == 0
+
+
+def test_unreadable_password_requires_reentry(tmp_path):
+    path = str(tmp_path / 'monitoring.db')
+    MonitorStore(path, secrets=SecretBox(Fernet.generate_key())).save_job('job1', 'u1', STATE, True)
+
+    # 鍵が変わった場合は空のパスワードとして読み込む
+    state = MonitorStore(path, secrets=SecretBox(Fernet.generate_key())).load_job('job1')['state']
+    assert state['password'] == ''
+    assert state['user_id'] == 'u1'
@@ -0,0 +1,205 @@
+# 取得ワーカー: python worker.py
+# SCRAPE_MODE=queue で起動したAPI・監視プロセスがキューに積んだ取得タスクを、
+# このプロセスが持つブラウザプールで実行して結果を返す。台数は実行中に増減できる
+# （SIGTERMで実行中のタスクを終えてから停止。異常終了した場合は期限切れ後に他のワーカーが実行）
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+from circuit import CircuitOpen
+from driver_pool import DriverPool, LoginError
+from governor import BrowserLimitReached
+from job_queue import TaskFailed, TaskTimeout, create_queue
+from lessons import Lesson
+from logging_config import configure_logging, log_context
+from metrics import REGISTRY
+from session_vault import SessionVault
+from sites import SiteBusy, SiteUnavailable, get_site, site_ids
+from store import MonitorStore
+
+logger = logging.getLogger(__name__)
+
+# タスクの種類: 会員のセッションで表示中の全日付のレッスンを取得 / ログインできることだけを確認
+FETCH = 'fetch'
+LOGIN = 'login'
+
+# ワーカーで発生した例外を、依頼元でも同じ種類の例外として扱う
+REMOTE_ERRORS = {cls.__name__: cls for cls in (LoginError, SiteBusy, SiteUnavailable, BrowserLimitReached)}
+
+
+def fetch_calendar(pool, site, user_id, password):
+    """ログイン済みのセッションで表示中の全日付のレッスンを取得（{YYYYMMDD: [Lesson]}）"""
+    with pool.session(user_id, password, site) as scraper:
+        lessons_by_date = scraper.go_to_program_page_and_scrape_dates(None)
+        if not lessons_by_date:
+            # タイムアウト等でカレンダーが表示されなかった（サーキットブレーカーに失敗として記録）
+            raise SiteUnavailable(f"{site.name}からカレンダーを取得できませんでした")
+    return lessons_by_date
+
+
+def verify_login(pool, site, user_id, password):
+    """会員番号・パスワードでログインできることを確認（失敗時はLoginError）"""
+    with pool.session(user_id, password, site):
+        pass
+
+
+def encode_lessons(lessons_by_date):
+    return {date_str: [lesson.to_dict() for lesson in lessons] for date_str, lessons in lessons_by_date.items()}
+
+
+def decode_lessons(data):
+    return {date_str: [Lesson.from_dict(item) for item in items] for date_str, items in data.items()}
+
+
+class RemoteFetcher:
+    """取得をキューに積み、ワーカーの結果を待つ（API・監視プロセスがブラウザを起動しない）"""
+
+    def __init__(self, queue, timeout=None):
+        self.queue = queue
+        self.timeout = timeout or float(os.getenv("QUEUE_RESULT_TIMEOUT", "180"))
+
+    def fetch(self, site, user_id, password):
+        """fetch_calendar と同じ結果をワーカー経由で取得"""
+        return decode_lessons(self._call(FETCH, site, user_id, password))
+
+    def login(self, site, user_id, password):
+        """verify_login をワーカー経由で実行"""
+        self._call(LOGIN, site, user_id, password)
+
+    def _call(self, kind, site, user_id, password):
+        task_id = self.queue.put(kind, {'site': site.site_id, 'userId': user_id, 'password': password},
+                                 group=site.site_id)
+        try:
+            return self.queue.wait(task_id, self.timeout)
+        except TaskTimeout:
+            self.queue.cancel(task_id)
+            raise SiteBusy(f"取得ワーカーが{self.timeout:.0f}秒以内に応答しませんでした")
+        except TaskFailed as e:
+            if e.error_type == 'CircuitOpen':
+                raise CircuitOpen(str(e), e.details.get('retryAfter', 0))
+            raise REMOTE_ERRORS.get(e.error_type, RuntimeError)(str(e))
+
+
+class Worker:
+    """キューから取得タスクを借り受け、自分のブラウザプールで実行して結果を返す"""
+
+    def __init__(self, queue, pool, threads=None, lease_seconds=None, worker_id=None, store=None):
+        self.queue = queue
+        self.pool = pool
+        self.store = store
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.threads = threads or int(os.getenv("WORKER_THREADS", "2"))
+        self.lease_seconds = lease_seconds or float(os.getenv("QUEUE_LEASE_SECONDS", "60"))
+        self.poll_interval = float(os.getenv("WORKER_POLL_SECONDS", "0.5"))
+        self.retention = float(os.getenv("QUEUE_RETENTION_SECONDS", "600"))
+        # サイトごとの同時実行数の上限は全ワーカーの合計で守る
+        self.group_limits = {site_id: get_site(site_id).max_concurrency for site_id in site_ids()}
+        self.done = 0
+        self.failed = 0
+        self._leased = {}  # タスクID → 開始時刻
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def run(self):
+        """停止要求まで実行（実行中のタスクは終えてから戻る）"""
+        logger.info(f"取得ワーカーを開始しました: {self.worker_id} (スレッド{self.threads})")
+        self._heartbeat()
+        workers = []
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._work_loop, name=f'queue-worker-{i}')
+            thread.daemon = True
+            thread.start()
+            workers.append(thread)
+        while not self._stopping.wait(self.lease_seconds / 3):
+            try:
+                self._heartbeat()
+            except Exception as e:
+                logger.error(f"ワーカーの生存確認の記録に失敗: {e}")
+        for thread in workers:
+            thread.join()
+        self.queue.remove_worker(self.worker_id)
+        logger.info(f"取得ワーカーを停止しました: {self.worker_id} (完了{self.done}件 失敗{self.failed}件)")
+
+    def stop(self):
+        self._stopping.set()
+
+    def stats(self):
+        with self._lock:
+            return {'host': socket.gethostname(), 'pid': os.getpid(), 'threads': self.threads,
+                    'inFlight': len(self._leased), 'done': self.done, 'failed': self.failed,
+                    'pool': self.pool.stats()}
+
+    def _heartbeat(self):
+        """借り受け中のタスクの期限を延長し、ワーカーの状況・メトリクスを記録"""
+        with self._lock:
+            leased = list(self._leased)
+        for task_id in leased:
+            self.queue.extend(task_id, self.worker_id, self.lease_seconds)
+        self.queue.heartbeat_worker(self.worker_id, self.stats())
+        self.queue.prune(self.retention)
+        if self.store is not None:
+            self.store.save_metrics(os.getpid(), 'worker', REGISTRY.snapshot())
+
+    def _work_loop(self):
+        while not self._stopping.is_set():
+            try:
+                task = self.queue.lease(self.worker_id, (FETCH, LOGIN), self.lease_seconds, self.group_limits)
+            except Exception as e:
+                logger.error(f"タスクの取得に失敗: {e}")
+                task = None
+            if task is None:
+                self._stopping.wait(self.poll_interval)
+                continue
+            self._execute(*task)
+
+    def _execute(self, task_id, kind, payload):
+        with self._lock:
+            self._leased[task_id] = time.time()
+        try:
+            with log_context(task_id=task_id, user_id=payload.get('userId')):
+                try:
+                    site = get_site(payload['site'])
+                    if kind == LOGIN:
+                        verify_login(self.pool, site, payload['userId'], payload['password'])
+                        result = {}
+                    else:
+                        result = encode_lessons(
+                            fetch_calendar(self.pool, site, payload['userId'], payload['password']))
+                except CircuitOpen as e:
+                    self._fail(task_id, e, {'retryAfter': e.retry_after})
+                except Exception as e:
+                    logger.error(f"取得タスクの実行に失敗: {e}")
+                    self._fail(task_id, e)
+                else:
+                    self.queue.complete(task_id, self.worker_id, result)
+                    with self._lock:
+                        self.done += 1
+        finally:
+            with self._lock:
+                self._leased.pop(task_id, None)
+
+    def _fail(self, task_id, error, details=None):
+        self.queue.fail(task_id, self.worker_id, str(error), type(error).__name__, details)
+        with self._lock:
+            self.failed += 1
+
+
+def main():
+    configure_logging()
+    store = MonitorStore()
+    pool = DriverPool(vault=SessionVault(store))
+    worker = Worker(create_queue(), pool, store=store)
+    signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+    signal.signal(signal.SIGINT, lambda *args: worker.stop())
+    try:
+        worker.run()
+    finally:
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+# 本番用エントリーポイント: gunicorn -c gunicorn.conf.py wsgi:app
+# 監視ジョブは実行ロックを取得した1つのワーカー（または monitor_service.py）だけが実行する
+from app import app, start_services
+
+start_services()
@@ -1,7 +1,10 @@
 // グローバル変数
 let selectedLessons = [];
 let monitoringInterval = null;
+let monitoringEvents = null;
+let latestSnapshot = [];
 let isMonitoring = false;
+let monitoringJobId = localStorage.getItem("monitoringJobId");
 
 document.addEventListener("DOMContentLoaded", function () {
   initializeEventListeners();
@@ -67,19 +70,25 @@ async function handleLessonSearch(e) {
   submitBtn.classList.add('loading');
 
   try {
-    const response = await fetch("/api/scrape_lessons", {
+    let response = await fetch("/api/scrape_lessons?wait=5", {
       method: "POST",
       headers: {
         "Content-Type": "application/json"
       },
       body: JSON.stringify(searchData)
     });
+    let result = await response.json();
+
+    // 取得に時間がかかる場合はジョブの完了を待つ
+    while (response.status === 202) {
+      response = await fetch(`${result.statusUrl}?wait=20`);
+      result = await response.json();
+    }
 
     if (!response.ok) {
-      throw new Error("レッスン取得に失敗しました");
+      throw new Error(result.error || "レッスン取得に失敗しました");
     }
 
-    const result = await response.json();
     displayLessons(result.lessons || []);
     showToast("レッスン情報を取得しました", "success");
     
@@ -132,7 +141,7 @@ function displayLessons(lessons) {
          onmouseout="this.style.borderColor='transparent'">
       <div class="lesson-info">
         <h4>⏰ ${lesson.time || 'N/A'}</h4>
-        <p>📚 ${lesson.name || 'N/A'}</p>
+        <p>📚 ${lesson.name || 'N/A'}${lesson.remaining != null ? `（残り${lesson.remaining}枠）` : ''}</p>
         <small style="color: #888;">ID: ${lesson.id}, Status: ${lesson.status}</small>
       </div>
       <div class="lesson-status ${lesson.status === '空きあり' ? 'status-available' : (lesson.status === '残りわずか' ? 'status-warning' : (lesson.status === '満員' ? 'status-full' : 'status-unknown'))}">
@@ -286,12 +295,17 @@ async function startMonitoring() {
       throw new Error("監視開始に失敗しました");
     }
 
+    const result = await response.json();
+    monitoringJobId = result.jobId;
+    localStorage.setItem("monitoringJobId", monitoringJobId);
+
     isMonitoring = true;
-    updateMonitoringStatus();
+    latestSnapshot = [];
+    updateMonitoringStatusDisplay(result);
     showToast("監視を開始しました", "success");
     
-    // 定期的にステータス更新
-    monitoringInterval = setInterval(updateMonitoringStatus, 30000);
+    // サーバーからのイベントでステータスを更新
+    subscribeMonitoringEvents();
     
   } catch (err) {
     showToast("エラー: " + err.message, "error");
@@ -310,7 +324,11 @@ async function stopMonitoring() {
 
   try {
     const response = await fetch("/api/stop_monitoring", {
-      method: "POST"
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json"
+      },
+      body: JSON.stringify({ jobId: monitoringJobId })
     });
 
     if (!response.ok) {
@@ -318,12 +336,12 @@ async function stopMonitoring() {
     }
 
     isMonitoring = false;
-    if (monitoringInterval) {
-      clearInterval(monitoringInterval);
-      monitoringInterval = null;
-    }
+    monitoringJobId = null;
+    localStorage.removeItem("monitoringJobId");
+    unsubscribeMonitoringEvents();
+    latestSnapshot = [];
     
-    updateMonitoringStatus();
+    updateMonitoringStatusDisplay(null);
     showToast("監視を停止しました", "info");
     
   } catch (err) {
@@ -361,9 +379,14 @@ function updateUIState() {
 // 監視ステータス更新
 async function updateMonitoringStatus() {
   try {
-    const response = await fetch("/api/monitoring_status");
+    const query = monitoringJobId ? `?jobId=${encodeURIComponent(monitoringJobId)}` : "";
+    const response = await fetch(`/api/monitoring_status${query}`);
     if (response.ok) {
       const status = await response.json();
+      if (monitoringJobId) {
+        isMonitoring = !!status.isRunning;
+        updateUIState();
+      }
       updateMonitoringStatusDisplay(status);
     }
   } catch (err) {
@@ -371,6 +394,106 @@ async function updateMonitoringStatus() {
   }
 }
 
+// 監視イベントの購読（SSE）。非対応ブラウザでは定期取得に切り替え
+function subscribeMonitoringEvents() {
+  unsubscribeMonitoringEvents();
+  if (!monitoringJobId) return;
+
+  if (!window.EventSource) {
+    monitoringInterval = setInterval(updateMonitoringStatus, 30000);
+    return;
+  }
+
+  monitoringEvents = new EventSource(`/api/monitors/${encodeURIComponent(monitoringJobId)}/events`);
+
+  monitoringEvents.addEventListener("status", (e) => {
+    const data = JSON.parse(e.data);
+    isMonitoring = !!data.job.isRunning;
+    updateUIState();
+    updateMonitoringStatusDisplay(data.job);
+    if (data.change === "finished") {
+      showToast("監視対象のレッスンが全て開始したため監視を終了しました", "info");
+    }
+  });
+
+  monitoringEvents.addEventListener("check_started", (e) => {
+    updateMonitoringStatusDisplay(JSON.parse(e.data).job);
+  });
+
+  monitoringEvents.addEventListener("check_finished", (e) => {
+    const job = JSON.parse(e.data).job;
+    isMonitoring = !!job.isRunning;
+    updateUIState();
+    updateMonitoringStatusDisplay(job);
+  });
+
+  monitoringEvents.addEventListener("snapshot", (e) => {
+    latestSnapshot = JSON.parse(e.data).lessons || [];
+    updateSnapshotDisplay();
+  });
+
+  monitoringEvents.addEventListener("changes", (e) => {
+    const events = JSON.parse(e.data).events || [];
+    events.forEach((event) => {
+      const lesson = event.lesson;
+      showToast(`${lesson.time} ${lesson.name}: ${describeChange(event)}（残り${lesson.remaining}枠）`, "success");
+    });
+  });
+
+  monitoringEvents.addEventListener("error", (e) => {
+    // サーバーが送るerrorイベント（接続エラーはe.dataを持たない）
+    if (e.data) {
+      const data = JSON.parse(e.data);
+      updateMonitoringStatusDisplay(data.job);
+      return;
+    }
+    if (monitoringEvents && monitoringEvents.readyState === EventSource.CLOSED) {
+      // ジョブが見つからない等で接続が閉じられた場合は状態を問い合わせる
+      monitoringEvents = null;
+      updateMonitoringStatus();
+    }
+  });
+}
+
+function unsubscribeMonitoringEvents() {
+  if (monitoringEvents) {
+    monitoringEvents.close();
+    monitoringEvents = null;
+  }
+  if (monitoringInterval) {
+    clearInterval(monitoringInterval);
+    monitoringInterval = null;
+  }
+}
+
+function describeChange(event) {
+  switch (event.type) {
+    case "opened":
+      return "空きが出ました";
+    case "filled":
+      return "満員になりました";
+    case "threshold":
+      return `残り${event.threshold}枠以上になりました`;
+    case "added":
+      return "追加されました";
+    case "removed":
+      return "カレンダーから消えました";
+    default:
+      return event.type;
+  }
+}
+
+// 最新スナップショット表示更新
+function updateSnapshotDisplay() {
+  const snapshotDiv = document.getElementById("monitoringSnapshot");
+  if (!snapshotDiv) return;
+  snapshotDiv.innerHTML = latestSnapshot.map((lesson) => `
+    <div class="snapshot-item">
+      ${lesson.time} ${lesson.name}（${lesson.remaining === null ? "不明" : `残り${lesson.remaining}枠`}）
+    </div>
+  `).join("");
+}
+
 // 監視ステータス表示更新
 function updateMonitoringStatusDisplay(status) {
   const statusDiv = document.getElementById("monitoringStatus");
@@ -378,13 +501,16 @@ function updateMonitoringStatusDisplay(status) {
   if (status && status.isRunning) {
     statusDiv.className = "status-card status-running";
     statusDiv.innerHTML = `
-      <div class="status-title">🔄 監視実行中</div>
+      <div class="status-title">${status.checking ? "🔍 チェック中..." : "🔄 監視実行中"}</div>
       <div class="status-description">
         📊 監視対象: ${status.lessonCount || 0}件<br>
         ⏱️ 次回チェック: ${formatNextCheck(status.nextCheck)}<br>
         📧 最終チェック: ${formatLastCheck(status.lastCheck)}
+        ${status.lastError ? `<br>⚠️ エラー: ${status.lastError}` : ""}
       </div>
+      <div id="monitoringSnapshot" class="status-snapshot"></div>
     `;
+    updateSnapshotDisplay();
   } else {
     statusDiv.className = "status-card status-stopped";
     statusDiv.innerHTML = `
@@ -453,5 +579,10 @@ function formatLastCheck(timestamp) {
 
 // ページロード時にステータスチェック
 window.addEventListener('load', () => {
-  updateMonitoringStatus();
+  if (monitoringJobId) {
+    // 監視中のジョブは接続直後に現在の状態が送られてくる
+    subscribeMonitoringEvents();
+  } else {
+    updateMonitoringStatus();
+  }
 });
\ No newline at end of file